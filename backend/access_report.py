@@ -0,0 +1,46 @@
+import argparse
+import sys
+import time
+from sqlmodel import Session
+from database import engine
+from services.access_matrix import AccessMatrix, READ, WRITE
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute who can read/write every folder (compliance report).")
+    parser.add_argument("--output", help="Write the full report as CSV to this file ('-' for stdout)")
+    parser.add_argument("--folder", type=int, action="append", help="Only this folder (repeatable)")
+    parser.add_argument("--user", type=int, help="List the folders this user can access")
+    parser.add_argument("--action", choices=[READ, WRITE], default=READ, help="Access level for --folder/--user listings")
+    args = parser.parse_args()
+
+    started = time.time()
+    with Session(engine) as session:
+        matrix = AccessMatrix.build(session)
+    print(f"Built access matrix for {len(matrix.user_ids)} users x {len(matrix.folder_ids)} folders "
+          f"in {time.time() - started:.2f}s", file=sys.stderr)
+
+    if args.output:
+        out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+        try:
+            rows = matrix.write_csv(out, args.folder)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"Wrote {rows} rows", file=sys.stderr)
+        return
+
+    if args.user is not None:
+        folder_ids = matrix.folders_for_user(args.user, args.action)
+        print(f"User {args.user} can {args.action} {len(folder_ids)} folders:")
+        for folder_id in folder_ids:
+            print(f"  {folder_id}")
+    for folder_id in args.folder or []:
+        user_ids = matrix.users_with_access(folder_id, args.action)
+        print(f"Folder {folder_id}: {len(user_ids)} users can {args.action}:")
+        for user_id in user_ids:
+            print(f"  {user_id}")
+    if args.user is None and not args.folder:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from sqlmodel import create_engine, Session, SQLModel
+from sqlalchemy import inspect, text
 from models import *
 import os
 
@@ -8,8 +9,53 @@ sqlite_url = f"sqlite:///{os.path.join(base_dir, sqlite_file_name)}"
 
 engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
 
+# Columns added after the first release. create_all() only creates missing tables,
+# so existing databases get these via ALTER TABLE on startup.
+# (table, column, DDL type)
+ADDED_COLUMNS = [
+    ("document", "content_hash", "VARCHAR"),
+    ("document", "deleted_at", "DATETIME"),
+    ("document", "deleted_by", "INTEGER"),
+    ("document", "deleted_from", "VARCHAR"),
+    ("collaborator", "created_at", "DATETIME"),
+]
+
+# Indexes on pre-existing tables that create_all() would not add to an old database.
+# (index name, table, columns)
+ADDED_INDEXES = [
+    ("ix_document_oss_key", "document", "oss_key"),
+    ("ix_document_content_hash", "document", "content_hash"),
+    ("ix_collaborator_created_at", "collaborator", "created_at"),
+    ("ix_collaborator_user_id", "collaborator", "user_id"),
+    ("ix_user_department_id", "user", "department_id"),
+]
+
+# Partial indexes: (index name, table, columns, WHERE clause).
+# Listings and duplicate-name checks only look at live documents, so their index
+# skips trashed rows; the trash listing and purge sweep get their own.
+PARTIAL_INDEXES = [
+    ("ix_document_active_folder_name", "document", "folder_id, name", "is_deleted = 0"),
+    ("ix_document_trash_deleted_at", "document", "deleted_at", "is_deleted = 1"),
+]
+
+def _ensure_columns():
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        for name, table, columns in ADDED_INDEXES:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        for name, table, columns, where in PARTIAL_INDEXES:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}) WHERE {where}"))
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _ensure_columns()
 
 def get_session():
     with Session(engine) as session:
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, BackgroundTasks
 from pydantic import BaseModel
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -7,21 +7,33 @@ from sqlmodel import Session, select, SQLModel
 from typing import List, Optional, Union
 from datetime import datetime
 from database import get_session, create_db_and_tables
-from models import User, Document, Folder, Department, Project
+from models import User, Document, Folder, Department, Project, ArchiveJob
 from auth_utils import verify_password, create_access_token, get_password_hash
 from jose import jwt
 from auth_utils import SECRET_KEY, ALGORITHM
 import shutil
 import os
 import uuid
+import hashlib
 import zipfile
-import io
-from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
-from services.storage import StorageService
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse, Response
+from services.storage import StorageService, get_backend
+from services.blob import BlobService, verify_and_register
+from services.archive import collect_folder_entries, stream_zip
+from services.archive_jobs import create_job as create_archive_job, start_sweeper as start_archive_sweeper
+from services.ranges import RangeFileResponse, proxy_object_response
+from services.preview import ensure_rendition, schedule_rendition
+from services.ingest import IngestError, ingest_batch, items_from_files, items_from_zip, writable_folders, taken_names
+from services.trash import TRASH_RETENTION_DAYS, expires_at, trashed_at, purge_documents, start_sweeper
+from services.batch import BatchError, copy_folder_tree, copy_items, delete_folder_trees, delete_items, move_items
 from services.permission import PermissionService
 from services.permission import PermissionService
+from services.user_search import backfill as backfill_user_search, index_users, matching_users, remove_users
+from services.user_import import UserImportError, import_users, read_table
+from services.columnar import columnar_response, wants_columnar
 from models import Role, SpaceType, ProjectMember, ProjectRole, Collaborator, CollaboratorRole
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import mimetypes
 
 # Fix for Docker/Slim images missing mime types
@@ -85,14 +97,10 @@ async def get_current_active_superuser(current_user: User = Depends(get_current_
         )
     return current_user
 
-@app.post("/documents", response_model=Document)
-async def create_document(
-    file: UploadFile = File(...),
-    folder_id: str = Form(...),
-    is_restricted: bool = Form(False),
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
-):
+def resolve_upload_folder(session: Session, folder_id: str) -> Folder:
+    """
+    Resolve an upload target: a folder id, or 'dept-X' for a department's root folder.
+    """
     # Handle 'dept-X' ID format from frontend
     real_folder_id = None
     
@@ -129,28 +137,50 @@ async def create_document(
 
     if not real_folder_id:
          raise HTTPException(status_code=400, detail="Valid Folder ID is required")
-        
+    return folder
+
+@app.post("/documents", response_model=Document)
+async def create_document(
+    file: UploadFile = File(...),
+    folder_id: str = Form(...),
+    is_restricted: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    folder = resolve_upload_folder(session, folder_id)
+    real_folder_id = folder.id
         
     # Permission Check
     perm_service = PermissionService(session)
     if not perm_service.check_permission(current_user, folder, 'write'):
         raise HTTPException(status_code=403, detail="Permission denied")
 
-    # Generate OSS Key
-    oss_key = StorageService.generate_oss_key(file.filename)
-    
     # STRICT ENFORCEMENT: Force restricted if parent is restricted
     if folder.is_restricted:
         is_restricted = True
     
     # Ensure directory exists (Mock OSS)
     # Save file and calculate size
+    blob_service = BlobService(session)
     try:
         content = await file.read()
         file_size = len(content)
-        success = StorageService.upload_file(oss_key, content)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to upload file to storage")
+        # Hashing a large upload takes a while: keep it off the event loop
+        content_hash = await run_in_threadpool(lambda: hashlib.sha256(content).hexdigest())
+
+        # DEDUP: Same bytes already stored -> point at the existing object
+        existing_blob = blob_service.find_reusable(content_hash, file_size)
+        if existing_blob:
+            oss_key = existing_blob.oss_key
+        else:
+            oss_key = StorageService.generate_oss_key(file.filename)
+            try:
+                await get_backend().put_stream(oss_key, content, file.content_type)
+            except Exception as e:
+                print(f"Storage Upload Error: {e}")
+                raise HTTPException(status_code=500, detail="Failed to upload file to storage")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
         
@@ -173,16 +203,71 @@ async def create_document(
         oss_key=oss_key,
         file_type=file_type,
         size=file_size,
+        content_hash=content_hash,
         folder_id=real_folder_id,
         author_id=current_user.id,
         is_restricted=is_restricted
     )
     session.add(doc)
+    blob_service.acquire(oss_key, content_hash, file_size)
     session.commit()
     session.refresh(doc)
     session.refresh(doc)
+    schedule_rendition(doc.oss_key, doc.file_type, doc.size)
     return doc
 
+class BulkUploadResponse(BaseModel):
+    folders_created: int
+    documents: List[Document]
+
+@app.post("/documents/bulk", response_model=BulkUploadResponse)
+async def bulk_upload_documents(
+    folder_id: str = Form(...),
+    files: Optional[List[UploadFile]] = File(None),
+    # Relative path per file ("sub/dir/name.ext"), same order as files; defaults to the filename
+    paths: Optional[List[str]] = Form(None),
+    archive: Optional[UploadFile] = File(None),
+    is_restricted: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Upload many files (multipart batch with relative paths, or one .zip) into a folder.
+    Missing subfolders are created; everything is stored concurrently and all
+    Folder/Document rows are inserted in one transaction (all or nothing).
+    """
+    folder = resolve_upload_folder(session, folder_id)
+
+    items = []
+    zf = None
+    try:
+        if archive is not None:
+            try:
+                zf = zipfile.ZipFile(archive.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Invalid zip archive")
+            items = items_from_zip(zf)
+        elif files:
+            if paths and len(paths) != len(files):
+                raise HTTPException(status_code=400, detail="paths must match files one to one")
+            items = items_from_files([
+                (paths[index] if paths else upload.filename or "", upload.file)
+                for index, upload in enumerate(files)
+            ])
+
+        documents, folders_created = await run_in_threadpool(
+            ingest_batch, session, current_user, folder, items, is_restricted or folder.is_restricted
+        )
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        if zf is not None:
+            zf.close()
+
+    for doc in documents:
+        schedule_rendition(doc.oss_key, doc.file_type, doc.size)
+    return BulkUploadResponse(folders_created=folders_created, documents=documents)
+
 # --- NEW: Frontend Direct Upload Endpoints ---
 
 class DocumentRead(BaseModel):
@@ -202,11 +287,17 @@ class UploadTokenRequest(BaseModel):
     file_size: int
     folder_id: int
     content_type: str = "application/octet-stream"
+    # Optional pre-upload SHA-256 (hex) for instant upload
+    content_hash: Optional[str] = None
+    is_restricted: bool = False
 
 class UploadTokenResponse(BaseModel):
     upload_url: str
     oss_key: str
     method: str
+    # True when the content already exists: no transfer, document already created
+    instant: bool = False
+    document_id: Optional[int] = None
 
 @app.post("/files/upload-token", response_model=UploadTokenResponse)
 async def get_upload_token(
@@ -216,6 +307,7 @@ async def get_upload_token(
 ):
     """
     Step 1: Get Presigned URL for Direct Upload
+    If content_hash matches a stored blob, skip the transfer and create the Document now.
     """
     # 1. Validate Target Folder & Permissions
     folder = session.get(Folder, req.folder_id)
@@ -235,7 +327,36 @@ async def get_upload_token(
     if existing:
         raise HTTPException(status_code=409, detail="File already exists") # 409 Conflict
 
-    # 3. Generate Key & URL
+    # 3. Instant Upload: content already stored (hash + size must both match) and
+    #    already readable by this user, since the client has not proven it has the bytes
+    if req.content_hash:
+        blob_service = BlobService(session)
+        blob = blob_service.find_reusable(req.content_hash, req.file_size, current_user)
+        if blob:
+            ext = os.path.splitext(req.filename)[1].lower()
+            new_doc = Document(
+                name=req.filename,
+                folder_id=req.folder_id,
+                author_id=current_user.id,
+                oss_key=blob.oss_key,
+                file_type=ext[1:] if ext else "unknown",
+                size=blob.size,
+                content_hash=blob.content_hash,
+                is_restricted=req.is_restricted or folder.is_restricted,
+            )
+            session.add(new_doc)
+            blob_service.acquire(blob.oss_key, blob.content_hash, blob.size)
+            session.commit()
+            session.refresh(new_doc)
+            return UploadTokenResponse(
+                upload_url="",
+                oss_key=blob.oss_key,
+                method="NONE",
+                instant=True,
+                document_id=new_doc.id
+            )
+
+    # 4. Generate Key & URL
     oss_key = StorageService.generate_oss_key(req.filename)
     url = StorageService.generate_upload_url(oss_key, req.content_type)
     
@@ -251,10 +372,12 @@ class UploadCompleteRequest(BaseModel):
     folder_id: int
     file_size: int
     is_restricted: bool = False
+    content_hash: Optional[str] = None
 
 @app.post("/files/upload-complete", response_model=DocumentRead)
 async def complete_upload(
     req: UploadCompleteRequest,
+    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
@@ -287,6 +410,7 @@ async def complete_upload(
         oss_key=req.oss_key,
         file_type=file_type,
         size=req.file_size,
+        content_hash=req.content_hash.lower() if req.content_hash else None,
         version=1,
         is_restricted=req.is_restricted or folder.is_restricted, 
     )
@@ -294,9 +418,159 @@ async def complete_upload(
     session.add(new_doc)
     session.commit()
     session.refresh(new_doc)
+
+    # Hash the stored bytes server-side before the blob becomes reusable for dedup
+    background_tasks.add_task(verify_and_register, new_doc.id)
+    # Pre-render the preview so the first open does not wait for it
+    schedule_rendition(new_doc.oss_key, new_doc.file_type, new_doc.size)
     
     return new_doc
 
+# --- Batch variants for multi-file drops: one permission check per folder,
+# one duplicate query, one commit for the whole batch ---
+
+MAX_UPLOAD_BATCH = 500
+
+class UploadTokenBatchRequest(BaseModel):
+    files: List[UploadTokenRequest]
+
+class UploadBatchItem(BaseModel):
+    filename: str
+    folder_id: int
+    upload_url: str = ""
+    oss_key: Optional[str] = None
+    method: Optional[str] = None
+    instant: bool = False
+    document_id: Optional[int] = None
+    # Per-file failure; the rest of the batch is unaffected
+    status_code: int = 200
+    error: Optional[str] = None
+
+class UploadBatchResponse(BaseModel):
+    items: List[UploadBatchItem]
+
+class UploadCompleteBatchRequest(BaseModel):
+    files: List[UploadCompleteRequest]
+
+def _screen_upload_batch(session: Session, user: User, files: list) -> tuple:
+    """
+    Folder, permission and duplicate checks shared by both batch endpoints.
+    Returns (results in request order, writable folders); rejected items already carry their error.
+    """
+    if len(files) > MAX_UPLOAD_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_UPLOAD_BATCH} files per request")
+
+    folder_ids = {f.folder_id for f in files}
+    folders, denied = writable_folders(session, user, folder_ids)
+    taken = taken_names(session, set(folders), {f.filename for f in files})
+
+    results = []
+    for f in files:
+        item = UploadBatchItem(filename=f.filename, folder_id=f.folder_id)
+        if f.folder_id in denied:
+            item.status_code, item.error = 403, "Permission denied"
+        elif f.folder_id not in folders:
+            item.status_code, item.error = 404, "Target folder not found"
+        elif (f.folder_id, f.filename) in taken:
+            item.status_code, item.error = 409, "File already exists"
+        else:
+            # Later items with the same name in the same folder conflict with this one
+            taken.add((f.folder_id, f.filename))
+        results.append(item)
+    return results, folders
+
+@app.post("/files/upload-token/batch", response_model=UploadBatchResponse)
+async def get_upload_tokens(
+    req: UploadTokenBatchRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Batch /files/upload-token. Items whose content is already stored (and readable
+    by the caller) are created right away (instant); the others get a signed PUT URL.
+    """
+    results, folders = _screen_upload_batch(session, current_user, req.files)
+
+    blob_service = BlobService(session)
+    reusable = blob_service.find_reusable_many(
+        ((f.content_hash, f.file_size) for f, item in zip(req.files, results) if not item.error and f.content_hash),
+        current_user
+    )
+
+    instant_docs = []
+    for f, item in zip(req.files, results):
+        if item.error:
+            continue
+        blob = reusable.get((f.content_hash.lower(), f.file_size)) if f.content_hash else None
+        if blob:
+            ext = os.path.splitext(f.filename)[1].lower()
+            doc = Document(
+                name=f.filename,
+                folder_id=f.folder_id,
+                author_id=current_user.id,
+                oss_key=blob.oss_key,
+                file_type=ext[1:] if ext else "unknown",
+                size=blob.size,
+                content_hash=blob.content_hash,
+                is_restricted=f.is_restricted or folders[f.folder_id].is_restricted,
+            )
+            session.add(doc)
+            blob_service.acquire(blob.oss_key, blob.content_hash, blob.size)
+            instant_docs.append((item, doc))
+            item.oss_key, item.method, item.instant = blob.oss_key, "NONE", True
+        else:
+            item.oss_key = StorageService.generate_oss_key(f.filename)
+            item.upload_url = StorageService.generate_upload_url(item.oss_key, f.content_type)
+            item.method = "PUT"
+
+    if instant_docs:
+        session.commit()
+        for item, doc in instant_docs:
+            session.refresh(doc)
+            item.document_id = doc.id
+
+    return UploadBatchResponse(items=results)
+
+@app.post("/files/upload-complete/batch", response_model=UploadBatchResponse)
+async def complete_uploads(
+    req: UploadCompleteBatchRequest,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Batch /files/upload-complete: every accepted Document row in one commit.
+    """
+    results, folders = _screen_upload_batch(session, current_user, req.files)
+
+    created = []
+    for f, item in zip(req.files, results):
+        if item.error:
+            continue
+        ext = os.path.splitext(f.filename)[1].lower()
+        doc = Document(
+            name=f.filename,
+            folder_id=f.folder_id,
+            author_id=current_user.id,
+            oss_key=f.oss_key,
+            file_type=ext[1:] if ext else "unknown",
+            size=f.file_size,
+            content_hash=f.content_hash.lower() if f.content_hash else None,
+            is_restricted=f.is_restricted or folders[f.folder_id].is_restricted,
+        )
+        session.add(doc)
+        created.append((item, doc))
+
+    if created:
+        session.commit()
+        for item, doc in created:
+            session.refresh(doc)
+            item.document_id, item.oss_key = doc.id, doc.oss_key
+            background_tasks.add_task(verify_and_register, doc.id)
+            schedule_rendition(doc.oss_key, doc.file_type, doc.size)
+
+    return UploadBatchResponse(items=results)
+
 # --- Local Dev: PUT Handler ---
 @app.put("/files/local-upload/{oss_key:path}")
 async def local_upload_handler(
@@ -307,13 +581,12 @@ async def local_upload_handler(
     Handle 'direct upload' for local dev environment.
     Mimics OSS PUT behavior.
     """
-    # Stream payload to file
-    local_path = os.path.join("uploads", oss_key)
-    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-    
+    # Only meaningful for local storage; remote backends hand out their own signed PUT URLs
+    if get_backend().remote:
+        raise HTTPException(status_code=404, detail="Not found")
+
     body = await request.body()
-    with open(local_path, "wb") as f:
-        f.write(body)
+    await get_backend().put_stream(oss_key, body, request.headers.get("content-type"))
         
     return {"status": "ok"}
 
@@ -395,18 +668,71 @@ async def get_document_url(
          
     return {"url": StorageService.get_presigned_url(doc.oss_key)}
 
-@app.get("/documents/{document_id}/content")
+# Upper bound for one batch request; a folder page is well below this
+MAX_URL_BATCH = 500
+
+class DocumentUrlsRequest(BaseModel):
+    document_ids: List[int]
+    # True: Content-Disposition attachment with the document name
+    download: bool = False
+
+class DocumentUrlsResponse(BaseModel):
+    urls: dict
+    denied: List[int] = []
+    missing: List[int] = []
+
+@app.post("/documents/urls", response_model=DocumentUrlsResponse)
+async def get_document_urls(
+    req: DocumentUrlsRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Sign URLs for many documents at once (e.g. a whole folder listing).
+    One query for the documents, one bulk permission check, cached signatures.
+    """
+    ids = list(dict.fromkeys(req.document_ids))
+    if len(ids) > MAX_URL_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_URL_BATCH} documents per request")
+
+    docs = session.exec(select(Document).where(Document.id.in_(ids))).all() if ids else []
+    found = {doc.id: doc for doc in docs}
+    allowed = PermissionService(session).check_documents(current_user, docs, 'read')
+
+    urls = {}
+    denied = []
+    for doc_id in ids:
+        doc = found.get(doc_id)
+        if doc is None:
+            continue
+        if not allowed.get(doc_id):
+            denied.append(doc_id)
+            continue
+        download_name = doc.name if req.download else None
+        urls[str(doc_id)] = StorageService.get_presigned_url(doc.oss_key, download_name)
+
+    return {
+        "urls": urls,
+        "denied": denied,
+        "missing": [doc_id for doc_id in ids if doc_id not in found]
+    }
+
+@app.api_route("/documents/{document_id}/content", methods=["GET", "HEAD"])
 async def get_document_content(
     document_id: int,
+    request: Request,
     token: Optional[str] = None,
+    inline: bool = False,
     session: Session = Depends(get_session),
     # Remove Depends(get_current_user) to prevent auto-401 for missing header
 ):
     """
     Download/Serve the actual file content.
     - Check Read Permission
-    - Serve local file if exists (FileResponse)
-    - Redirect to OSS URL if not local (RedirectResponse)
+    - Serve local file if exists (Range / If-Range / multipart, zero-copy when available)
+    - Redirect to OSS URL if not local (RedirectResponse; OSS serves Range itself)
+    - OSS_DOWNLOAD_MODE=proxy: stream the OSS object through the backend instead
+    - inline=true: Content-Disposition inline, for in-browser video/PDF preview
     """
     user = None
     
@@ -439,14 +765,70 @@ async def get_document_content(
         local_path = os.path.join(UPLOAD_DIR, doc.oss_key)
     
     # If file exists locally, serve it
+    disposition = "inline" if inline else "attachment"
     if os.path.exists(local_path):
-        return FileResponse(local_path, filename=doc.name, content_disposition_type="attachment")
+        media_type = mimetypes.guess_type(doc.name)[0] or "application/octet-stream"
+        return RangeFileResponse(local_path, filename=doc.name, media_type=media_type, disposition=disposition)
     
     
+    # Proxy mode: for clients that cannot reach OSS, and to keep responses cacheable by our reverse proxy
+    if StorageService.proxy_downloads():
+        media_type = mimetypes.guess_type(doc.name)[0]
+        return await proxy_object_response(request, doc.oss_key, doc.name, media_type, disposition)
+
     # If not local, try OSS Redirection
     url = StorageService.get_presigned_url(doc.oss_key, download_name=doc.name)
     return RedirectResponse(url)
 
+@app.get("/documents/{document_id}/preview")
+async def get_document_preview(
+    document_id: int,
+    token: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    """
+    Lightweight preview rendition: HTML for docx/xlsx, downscaled JPEG for images.
+    Rendered in the background on upload; rendered on first request otherwise.
+    Images without a thumbnail (Pillow missing) are redirected to the original.
+    """
+    user = None
+    if token:
+        try:
+             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+             username: str = payload.get("sub")
+             if username:
+                 user = session.exec(select(User).where(User.username == username)).first()
+        except Exception:
+            pass
+
+    if not user:
+         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    doc = session.get(Document, document_id)
+    if not doc or doc.is_deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    perm_service = PermissionService(session)
+    if not perm_service.check_permission(user, doc, 'read'):
+         raise HTTPException(status_code=403, detail="Permission denied")
+
+    rendition = await run_in_threadpool(ensure_rendition, doc.oss_key, doc.file_type, doc.size)
+    if rendition is None:
+        if (mimetypes.guess_type(doc.name)[0] or "").startswith("image/"):
+            return RedirectResponse(f"/documents/{document_id}/content?token={token}&inline=true")
+        raise HTTPException(status_code=404, detail="No preview available for this file")
+
+    key, media_type = rendition
+    content = await run_in_threadpool(StorageService.get_file_content, key)
+    if content is None:
+        raise HTTPException(status_code=404, detail="No preview available for this file")
+
+    headers = {"Cache-Control": "private, max-age=300"}
+    if media_type.startswith("text/html"):
+        # Rendered from user content: no scripts, no external loads
+        headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; img-src data:"
+    return Response(content=content, media_type=media_type, headers=headers)
+
 @app.get("/folders/{folder_id}/zip")
 async def get_folder_zip(
     folder_id: int, 
@@ -455,7 +837,7 @@ async def get_folder_zip(
 ):
     """
     Download a folder as a ZIP archive.
-    Recursive traversal of subfolders.
+    Recursive traversal of subfolders; the archive is streamed entry by entry.
     """
     user = None
     if token:
@@ -478,64 +860,79 @@ async def get_folder_zip(
     if not perm_service.check_permission(user, folder, 'read'):
         raise HTTPException(status_code=403, detail="Permission denied")
 
-    # In-memory ZIP buffer
-    mem_zip = io.BytesIO()
-
-    with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        # Helper to add files recursively
-        def add_folder_to_zip(folder_obj, current_path):
-            # 1. Add Files
-            files = session.exec(select(Document).where(Document.folder_id == folder_obj.id, Document.is_deleted == False)).all()
-            for file in files:
-                # ROBUST PATH RESOLUTION:
-                # 1. Try Local File (Legacy or specific dev setup)
-                # The file system currently has double nesting: uploads/uploads/2026...
-                local_path = os.path.join(UPLOAD_DIR, file.oss_key)
-                
-                # Fallback: If strict join fails, maybe oss_key is already the full path relative to CWD?
-                if not os.path.exists(local_path) and os.path.exists(file.oss_key):
-                    local_path = file.oss_key
-
-                archive_name = f"{current_path}/{file.name}"
-                
-                if os.path.exists(local_path):
-                    # Found locally, write to ZIP
-                    zf.write(local_path, arcname=archive_name)
-                else:
-                    # 2. Try OSS (Standard Production)
-                    # If not found locally, fetch stream from OSS
-                    file_content = StorageService.get_file_content(file.oss_key)
-                    if file_content is not None:
-                         zf.writestr(archive_name, file_content)
-                    else:
-                        # Log missing file but DO NOT rename it to .txt
-                        print(f"[Warning] File missing in Local & OSS during zip: {local_path} (Key: {file.oss_key})")
-                        pass
-
-            # 2. Recurse Subfolders
-            subfolders = session.exec(select(Folder).where(Folder.parent_id == folder_obj.id)).all()
-            for sub in subfolders:
-                # Check read permission for subfolder (Optional, but safer. Though usually implicit for Dept)
-                # But for simplicity and speed, if you have Read on Parent, you usually see Children in Dept space.
-                # However, safe approach:
-                if perm_service.check_permission(user, sub, 'read'):
-                    add_folder_to_zip(sub, f"{current_path}/{sub.name}")
-
-        add_folder_to_zip(folder, folder.name)
-
-    mem_zip.seek(0)
+    # Resolve the readable subtree up front (off the event loop), then stream without a session
+    entries = await run_in_threadpool(collect_folder_entries, session, perm_service, user, folder)
     
     # Filename encoding for Content-Disposition
     from urllib.parse import quote
     encoded_filename = quote(f"{folder.name}.zip")
     
+    # Sync generator -> Starlette iterates it in the threadpool, keeping the event loop free
     return StreamingResponse(
-        iter([mem_zip.getvalue()]), 
+        stream_zip(entries), 
         media_type="application/x-zip-compressed", 
         headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"}
     )
 
 
+class ArchiveJobRead(BaseModel):
+    job_id: str
+    folder_id: int
+    status: str
+    download_url: Optional[str] = None
+    error: Optional[str] = None
+
+def _archive_job_read(job: ArchiveJob, folder_name: str) -> ArchiveJobRead:
+    download_url = None
+    if job.status == "ready" and job.oss_key:
+        download_url = StorageService.get_presigned_url(job.oss_key, download_name=f"{folder_name}.zip")
+    return ArchiveJobRead(
+        job_id=job.id,
+        folder_id=job.folder_id,
+        status=job.status,
+        download_url=download_url,
+        error=job.error
+    )
+
+@app.post("/folders/{folder_id}/zip-jobs", response_model=ArchiveJobRead)
+async def create_folder_zip_job(
+    folder_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Build a folder archive in the background.
+    Returns immediately; poll GET /zip-jobs/{job_id} for the download URL.
+    If an identical archive (same readable subtree) was built before, the job is ready at once.
+    """
+    folder = session.get(Folder, folder_id)
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    perm_service = PermissionService(session)
+    if not perm_service.check_permission(current_user, folder, 'read'):
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    entries = await run_in_threadpool(collect_folder_entries, session, perm_service, current_user, folder)
+    # create_job checks storage for a cached archive (a HEAD request on OSS)
+    job = await run_in_threadpool(create_archive_job, session, folder.id, current_user.id, entries)
+    return _archive_job_read(job, folder.name)
+
+@app.get("/zip-jobs/{job_id}", response_model=ArchiveJobRead)
+async def get_zip_job(
+    job_id: str,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    job = session.get(ArchiveJob, job_id)
+    # Jobs are private to their creator: the archive reflects that user's ACL
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    folder = session.get(Folder, job.folder_id)
+    return _archive_job_read(job, folder.name if folder else "archive")
+
+
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
     from models import Role # ensure import
@@ -553,71 +950,290 @@ async def delete_document(document_id: int, session: Session = Depends(get_sessi
         if doc.author_id != current_user.id:
             raise HTTPException(status_code=403, detail="Safe Deletion: You can only delete your own files.")
     
-    # Remove file from disk
-    # Use OSS Key to find file
-    # SOFT DELETE: We do NOT delete from OSS. We just mark as deleted.
-    # if doc.oss_key:
-    #     StorageService.delete_file(doc.oss_key)
-                
+    # SOFT DELETE: the document goes to the trash and keeps its blob reference, so it
+    # can be restored. The trash sweeper archives it after TRASH_RETENTION_DAYS.
     doc.is_deleted = True
+    doc.deleted_at = datetime.now()
+    doc.deleted_by = current_user.id
     session.add(doc)
     session.commit()
     return {"ok": True}
 
+class TrashItem(BaseModel):
+    id: int
+    name: str
+    file_type: str
+    size: int
+    folder_id: Optional[int] = None
+    folder_name: Optional[str] = None
+    author_id: Optional[int] = None
+    deleted_at: datetime
+    deleted_by: Optional[int] = None
+    deleted_by_name: Optional[str] = None
+    expires_at: datetime
+
+class TrashListResponse(BaseModel):
+    items: List[TrashItem]
+    total: int
+    retention_days: int
+
+def _trash_visible(session: Session, current_user: User, docs: List[Document]) -> List[Document]:
+    """
+    Super admins see the whole trash. Everyone else sees what they wrote or deleted,
+    plus documents they could write where they were (so a manager sees their own
+    departments' trash, never restricted files elsewhere).
+    """
+    if current_user.role == Role.SUPER_ADMIN:
+        return docs
+
+    def own(doc: Document) -> bool:
+        return doc.author_id == current_user.id or doc.deleted_by == current_user.id
+
+    others = [doc for doc in docs if not own(doc)]
+    allowed = PermissionService(session).check_documents(current_user, others, 'write') if others else {}
+    return [doc for doc in docs if own(doc) or allowed.get(doc.id)]
+
+def _get_trashed_document(session: Session, document_id: int, current_user: User) -> Document:
+    doc = session.exec(select(Document).where(Document.id == document_id, Document.is_deleted == True)).first()
+    if not doc or not _trash_visible(session, current_user, [doc]):
+        raise HTTPException(status_code=404, detail="Document not found in trash")
+    return doc
+
+@app.get("/trash", response_model=TrashListResponse)
+async def read_trash(
+    skip: int = 0,
+    limit: int = Query(default=100, le=500),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    from sqlalchemy import func
+    from sqlalchemy.orm import aliased
+    Deleter = aliased(User)
+    deleted_order = func.coalesce(Document.deleted_at, Document.updated_at)
+
+    statement = (
+        select(Document, Folder.name, Deleter.username)
+        .join(Folder, Document.folder_id == Folder.id, isouter=True)
+        .join(Deleter, Document.deleted_by == Deleter.id, isouter=True)
+        .where(Document.is_deleted == True)
+        .order_by(deleted_order.desc(), Document.id.desc())
+    )
+    if current_user.role == Role.SUPER_ADMIN:
+        total = session.exec(select(func.count()).select_from(Document).where(Document.is_deleted == True)).one()
+        rows = session.exec(statement.offset(skip).limit(limit)).all()
+    else:
+        # Visibility depends on folder permissions, so filter before paging.
+        # The trash only holds TRASH_RETENTION_DAYS worth of deletions.
+        rows = session.exec(statement).all()
+        visible = {doc.id for doc in _trash_visible(session, current_user, [row[0] for row in rows])}
+        rows = [row for row in rows if row[0].id in visible]
+        total = len(rows)
+        rows = rows[skip:skip + limit]
+    items = []
+    for doc, folder_name, deleted_by_name in rows:
+        items.append(TrashItem(
+            id=doc.id,
+            name=doc.name,
+            file_type=doc.file_type,
+            size=doc.size,
+            folder_id=doc.folder_id,
+            folder_name=folder_name or doc.deleted_from,
+            author_id=doc.author_id,
+            deleted_at=trashed_at(doc),
+            deleted_by=doc.deleted_by,
+            deleted_by_name=deleted_by_name,
+            expires_at=expires_at(doc),
+        ))
+    return TrashListResponse(items=items, total=total, retention_days=TRASH_RETENTION_DAYS)
+
+@app.post("/trash/{document_id}/restore", response_model=Document)
+async def restore_document(
+    document_id: int,
+    folder_id: Optional[int] = None,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Put a trashed document back, into its original folder or into folder_id
+    (needed when the original folder has been deleted).
+    """
+    doc = _get_trashed_document(session, document_id, current_user)
+
+    target_id = folder_id if folder_id is not None else doc.folder_id
+    if target_id is None and doc.deleted_from is not None:
+        raise HTTPException(status_code=409, detail="Original folder no longer exists, choose another folder")
+    if target_id is not None:
+        folder = session.get(Folder, target_id)
+        if not folder:
+            raise HTTPException(status_code=409, detail="Original folder no longer exists, choose another folder")
+        if not PermissionService(session).check_permission(current_user, folder, 'write'):
+            raise HTTPException(status_code=403, detail="No write permission on target folder")
+
+    existing = session.exec(select(Document).where(
+        Document.folder_id == target_id,
+        Document.name == doc.name,
+        Document.is_deleted == False
+    )).first()
+    if existing:
+        raise HTTPException(status_code=409, detail="File with this name already exists in this location")
+
+    doc.folder_id = target_id
+    doc.is_deleted = False
+    doc.deleted_at = None
+    doc.deleted_by = None
+    doc.deleted_from = None
+    session.add(doc)
+    session.commit()
+    session.refresh(doc)
+    return doc
+
+@app.delete("/trash/{document_id}")
+async def purge_document(document_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Delete a trashed document permanently, without waiting for the retention period.
+    """
+    doc = _get_trashed_document(session, document_id, current_user)
+    if not PermissionService(session).check_permission(current_user, doc, 'write'):
+        raise HTTPException(status_code=403, detail="No write permission on this document")
+    await run_in_threadpool(purge_documents, session, [doc.id])
+    return {"ok": True}
+
+class BatchRequest(BaseModel):
+    folder_ids: List[int] = []
+    document_ids: List[int] = []
+
+class BatchTargetRequest(BatchRequest):
+    target_folder_id: int
+
+class BatchItemResult(BaseModel):
+    type: str  # "folder" / "document"
+    id: int
+    status_code: int = 200
+    error: Optional[str] = None
+    new_id: Optional[int] = None  # copy only
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+async def _run_batch(fn, *args) -> BatchResponse:
+    try:
+        results = await run_in_threadpool(fn, *args)
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    items = [BatchItemResult(type=r.type, id=r.id, status_code=r.status_code, error=r.error, new_id=r.new_id) for r in results]
+    failed = sum(1 for item in items if item.error)
+    return BatchResponse(results=items, succeeded=len(items) - failed, failed=failed)
+
+@app.post("/batch/move", response_model=BatchResponse)
+async def batch_move(req: BatchTargetRequest, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Move folders and documents into target_folder_id. Items that fail (permission,
+    name clash, moving a folder into itself) are reported; the rest are applied together.
+    """
+    return await _run_batch(move_items, session, current_user, req.target_folder_id, req.folder_ids, req.document_ids)
+
+@app.post("/batch/copy", response_model=BatchResponse)
+async def batch_copy(req: BatchTargetRequest, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Copy folders (with their readable contents) and documents into target_folder_id.
+    Copies share the stored objects; new_id is the copy's id.
+    """
+    return await _run_batch(copy_items, session, current_user, req.target_folder_id, req.folder_ids, req.document_ids)
+
+@app.post("/batch/delete", response_model=BatchResponse)
+async def batch_delete(req: BatchRequest, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Delete folders and move documents to the trash. Contents of deleted folders go to the trash too.
+    """
+    return await _run_batch(delete_items, session, current_user, req.folder_ids, req.document_ids)
+
 @app.get("/users")
 async def read_users(
+    request: Request,
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(default=100, ge=1, le=5000),
     q: Optional[str] = None,
     department_id: Optional[int] = None,
     recursive: bool = True,
+    after: Optional[str] = None,
     session: Session = Depends(get_session), 
     current_user: User = Depends(get_current_user)
 ):
-    statement = select(User)
+    """
+    User directory. q matches username, employee_id, email or name pinyin anywhere
+    (users whose field starts with q come first). The total is in X-Total-Count; for
+    keyset paging pass the X-Next-Cursor value back as after (skip still works).
+    """
+    from sqlalchemy import and_, literal, or_
+
+    filters = []
     if department_id:
         if recursive:
-            # RECURSIVE: Get all descendant departments
-            all_depts = session.exec(select(Department.id, Department.parent_id)).all()
-            
-            dept_tree = {}
-            for d_id, p_id in all_depts:
-                if p_id not in dept_tree:
-                    dept_tree[p_id] = []
-                dept_tree[p_id].append(d_id)
-                
-            target_ids = {department_id}
-            queue = [department_id]
-            while queue:
-                current = queue.pop(0)
-                if current in dept_tree:
-                    children = dept_tree[current]
-                    for child in children:
-                         if child not in target_ids:
-                             target_ids.add(child)
-                             queue.append(child)
-            
-            
-            statement = statement.where(User.department_id.in_(target_ids))
+            # RECURSIVE: the department and all its descendants
+            tree = select(Department.id).where(Department.id == department_id).cte("dept_tree", recursive=True)
+            tree = tree.union(select(Department.id).join(tree, Department.parent_id == tree.c.id))
+            filters.append(User.department_id.in_(select(tree.c.id)))
         else:
             # NON-RECURSIVE: Match exact department_id
-            statement = statement.where(User.department_id == department_id)
-            
+            filters.append(User.department_id == department_id)
+
+    columns = [User.id, User.username, User.employee_id, User.email, User.department_id, User.role,
+               Department.name.label("department_name")]
+    q = (q or "").strip()
     if q:
-        statement = statement.where(User.username.contains(q))
-    
-    statement = statement.offset(skip).limit(limit)
-    results = session.exec(statement)
-    users = results.all()
-    user_list = []
-    for u in users:
-        u_dict = u.dict()
-        if u.department:
-            u_dict["department_name"] = u.department.name
-        else:
-            u_dict["department_name"] = None
-        user_list.append(u_dict)
-    return user_list
+        matches = matching_users(q)
+        statement = select(*columns, matches.c.rank).join(matches, matches.c.user_id == User.id)
+    else:
+        statement = select(*columns, literal(0).label("rank"))
+    # The window count sees every filtered row, before the cursor and LIMIT apply
+    listing = (
+        statement.join(Department, User.department_id == Department.id, isouter=True)
+        .where(*filters)
+        .add_columns(func.count().over().label("total"))
+        .subquery()
+    )
+
+    page = select(*listing.c)
+    if after:
+        # Cursor: "<rank>:<username>" of the last row of the previous page
+        after_rank, _, after_name = after.partition(":")
+        try:
+            after_rank = int(after_rank)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page = page.where(or_(
+            listing.c.rank > after_rank,
+            and_(listing.c.rank == after_rank, listing.c.username > after_name)
+        ))
+    page = page.order_by(listing.c.rank, listing.c.username).offset(skip).limit(limit)
+    rows = session.exec(page).all()
+
+    if rows:
+        response.headers["X-Total-Count"] = str(rows[0].total)
+        if len(rows) == limit:
+            response.headers["X-Next-Cursor"] = f"{rows[-1].rank}:{rows[-1].username}"
+    elif not after and not skip:
+        response.headers["X-Total-Count"] = "0"
+
+    users = [
+        {
+            "id": row.id,
+            "username": row.username,
+            "employee_id": row.employee_id,
+            "email": row.email,
+            "department_id": row.department_id,
+            "role": row.role,
+            "department_name": row.department_name,
+        }
+        for row in rows
+    ]
+    if wants_columnar(request):
+        paging = {k: v for k, v in response.headers.items() if k.lower().startswith("x-")}
+        return columnar_response(users, paging)
+    return users
 
 from pydantic import BaseModel
 
@@ -685,6 +1301,9 @@ class UserCreate(BaseModel):
     department_id: Optional[int] = None
     role: str
 
+# Fields indexed by services.user_search
+SEARCHABLE_USER_FIELDS = {"username", "employee_id", "email"}
+
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
@@ -713,10 +1332,52 @@ async def create_user(
         role=Role(user_in.role)
     )
     session.add(new_user)
+    session.flush()
+    index_users(session, [new_user])
     session.commit()
     session.refresh(new_user)
     return new_user
 
+class UserImportRowResult(BaseModel):
+    row: int
+    username: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+    user_id: Optional[int] = None
+
+class UserImportResponse(BaseModel):
+    created: int
+    failed: int
+    dry_run: bool
+    results: List[UserImportRowResult]
+
+@app.post("/users/import", response_model=UserImportResponse)
+async def import_users_file(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_superuser)
+):
+    """
+    Create users from a .csv or .xlsx sheet with columns username, password and
+    optionally employee_id, email, department (name or Parent/Child path) and role.
+    Valid rows are created together; invalid rows are reported and skipped.
+    dry_run validates without creating anything.
+    """
+    data = await file.read()
+    try:
+        rows = await run_in_threadpool(read_table, file.filename or "", data)
+        results = await run_in_threadpool(import_users, session, rows, dry_run)
+    except UserImportError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    failed = sum(1 for r in results if r.status == "error")
+    return UserImportResponse(
+        created=sum(1 for r in results if r.status == "created"),
+        failed=failed,
+        dry_run=dry_run,
+        results=[UserImportRowResult(**vars(r)) for r in results]
+    )
+
 @app.put("/users/me", response_model=User)
 async def update_self(
     user_in: UserUpdate,
@@ -743,6 +1404,8 @@ async def update_self(
         setattr(current_user, field, value)
     
     session.add(current_user)
+    if SEARCHABLE_USER_FIELDS & update_data.keys():
+        index_users(session, [current_user])
     session.commit()
     session.refresh(current_user)
     return current_user
@@ -769,6 +1432,8 @@ async def update_user(
         setattr(db_user, field, value)
     
     session.add(db_user)
+    if SEARCHABLE_USER_FIELDS & update_data.keys():
+        index_users(session, [db_user])
     session.commit()
     session.refresh(db_user)
     return db_user
@@ -785,6 +1450,7 @@ async def delete_user(
     if db_user.id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete self")
         
+    remove_users(session, [db_user.id])
     session.delete(db_user)
     session.commit()
     return {"ok": True}
@@ -808,13 +1474,117 @@ async def read_departments(
     session: Session = Depends(get_session), 
     current_user: User = Depends(get_current_user)
 ):
-    query = select(Department)
+    # Plain columns: no ORM objects (and their relationships) to build per row
+    query = select(Department.id, Department.name, Department.parent_id, Department.root_folder_id)
     if parent_id is not None:
         query = query.where(Department.parent_id == parent_id)
         
     results = session.exec(query).all()
     
-    return [DepartmentRead.from_orm(dept) for dept in results]
+    return [DepartmentRead(**row._mapping) for row in results]
+
+class DepartmentTreeNode(BaseModel):
+    id: int
+    name: str
+    parent_id: Optional[int] = None
+    root_folder_id: Optional[int] = None
+    member_count: int = 0          # users directly in this department
+    total_member_count: int = 0    # including all sub-departments
+    document_count: int = 0        # live documents under root_folder_id
+    storage_bytes: int = 0
+    children: List["DepartmentTreeNode"] = []
+
+@app.get("/departments/tree", response_model=List[DepartmentTreeNode])
+async def read_department_tree(
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    The whole department hierarchy with headcounts and root-folder storage,
+    from one aggregation query; the tree and recursive counts are assembled in memory.
+    """
+    # Every folder under each department root folder, tagged with that root
+    roots = select(Department.root_folder_id).where(Department.root_folder_id != None)
+    subtree = select(Folder.id.label("root_id"), Folder.id.label("folder_id")).where(
+        Folder.id.in_(roots)
+    ).cte("dept_subtree", recursive=True)
+    # UNION (not UNION ALL) also stops on parent cycles
+    subtree = subtree.union(
+        select(subtree.c.root_id, Folder.id).join(subtree, Folder.parent_id == subtree.c.folder_id)
+    )
+    storage = (
+        select(
+            subtree.c.root_id,
+            func.count(Document.id).label("documents"),
+            func.coalesce(func.sum(Document.size), 0).label("size")
+        )
+        .join(Document, Document.folder_id == subtree.c.folder_id)
+        .where(Document.is_deleted == False)
+        .group_by(subtree.c.root_id)
+        .subquery()
+    )
+    members = (
+        select(User.department_id, func.count(User.id).label("members"))
+        .where(User.department_id != None)
+        .group_by(User.department_id)
+        .subquery()
+    )
+    rows = session.exec(
+        select(
+            Department.id, Department.name, Department.parent_id, Department.root_folder_id,
+            func.coalesce(members.c.members, 0), func.coalesce(storage.c.documents, 0),
+            func.coalesce(storage.c.size, 0)
+        )
+        .join(members, members.c.department_id == Department.id, isouter=True)
+        .join(storage, storage.c.root_id == Department.root_folder_id, isouter=True)
+        .order_by(Department.id)
+    ).all()
+
+    nodes = {
+        dept_id: {
+            "id": dept_id, "name": name, "parent_id": parent_id, "root_folder_id": root_folder_id,
+            "member_count": member_count, "total_member_count": member_count,
+            "document_count": document_count, "storage_bytes": storage_bytes, "children": []
+        }
+        for dept_id, name, parent_id, root_folder_id, member_count, document_count, storage_bytes in rows
+    }
+    tree = []
+    for node in nodes.values():
+        parent = nodes.get(node["parent_id"])
+        (parent["children"] if parent else tree).append(node)
+
+    # Departments caught in a parent cycle are unreachable from the roots: list them at top level
+    reached = set()
+    stack = list(tree)
+    while stack:
+        node = stack.pop()
+        reached.add(node["id"])
+        stack.extend(node["children"])
+    for node in nodes.values():
+        if node["id"] not in reached:
+            parent = nodes[node["parent_id"]]
+            parent["children"].remove(node)
+            tree.append(node)
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                reached.add(current["id"])
+                stack.extend(c for c in current["children"] if c["id"] not in reached)
+
+    def total(node) -> int:
+        # Iterative post-order: deep hierarchies must not hit the recursion limit
+        order, stack = [], [node]
+        while stack:
+            current = stack.pop()
+            order.append(current)
+            stack.extend(current["children"])
+        for current in reversed(order):
+            current["total_member_count"] = current["member_count"] + sum(c["total_member_count"] for c in current["children"])
+        return node["total_member_count"]
+
+    for node in tree:
+        total(node)
+    return tree
 
 @app.get("/departments/{department_id}", response_model=DepartmentRead)
 async def read_department(
@@ -965,7 +1735,15 @@ async def delete_department(
 
 @app.on_event("startup")
 def on_startup():
+    from database import engine
+
     create_db_and_tables()
+    with Session(engine) as session:
+        indexed = backfill_user_search(session)
+    if indexed:
+        print(f"[Search] Indexed {indexed} users")
+    start_sweeper()
+    start_archive_sweeper()
 
 
 @app.post("/token")
@@ -1035,6 +1813,7 @@ from sqlalchemy import func
 
 @app.get("/folders", response_model=List[FolderRead])
 async def read_folders(
+    request: Request,
     q: Optional[str] = Query(None),
     parent_id: Optional[Union[int, str]] = Query(None), 
     space_type: Optional[str] = None, 
@@ -1134,6 +1913,8 @@ async def read_folders(
                 
             accessible_folders.append(FolderRead(**folder_dict))
             
+    if wants_columnar(request):
+        return columnar_response(accessible_folders)
     return accessible_folders
 
 
@@ -1359,11 +2140,76 @@ async def delete_folder(folder_id: int, session: Session = Depends(get_session),
         # Note: If folder has no owner (system folder), only Admin can delete usually provided by permissions, but here explicitly check
         if folder.owner_id != current_user.id:
              raise HTTPException(status_code=403, detail="Safe Deletion: You can only delete your own folders.")
-        
-    session.delete(folder)
-    session.commit()
+
+    # Set-based subtree delete; documents inside go to the trash
+    def remove():
+        delete_folder_trees(session, current_user, [folder_id])
+        session.commit()
+    await run_in_threadpool(remove)
     return {"ok": True}
 
+class FolderCopyRequest(BaseModel):
+    # Defaults to the source's parent (a sibling copy)
+    target_folder_id: Optional[int] = None
+    # Defaults to the source name, with " (n)" appended if taken
+    name: Optional[str] = None
+
+class FolderCopyResponse(BaseModel):
+    folder: Folder
+    folders_created: int
+    documents_created: int
+
+@app.post("/folders/{folder_id}/copy", response_model=FolderCopyResponse)
+async def copy_folder(
+    folder_id: int,
+    req: FolderCopyRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Duplicate a folder subtree (e.g. a template project) without copying bytes:
+    new rows point at the same objects and take blob references.
+    Only what the user can read is copied.
+    """
+    source = session.get(Folder, folder_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    perm_service = PermissionService(session)
+    if not perm_service.check_permission(current_user, source, 'read'):
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    target_id = req.target_folder_id if req.target_folder_id is not None else source.parent_id
+    if target_id is None:
+        raise HTTPException(status_code=400, detail="target_folder_id is required to copy a root folder")
+    target = session.get(Folder, target_id)
+    if not target:
+        raise HTTPException(status_code=404, detail="Target folder not found")
+    if not perm_service.check_permission(current_user, target, 'write'):
+        raise HTTPException(status_code=403, detail="No write permission on target folder")
+
+    if req.name is not None:
+        name = req.name.strip()
+        if not name:
+            raise HTTPException(status_code=400, detail="Folder name cannot be empty")
+        if session.exec(select(Folder).where(Folder.parent_id == target.id, Folder.name == name)).first():
+            raise HTTPException(status_code=409, detail="该位置已存在同名文件夹")
+    else:
+        name = None
+
+    def copy():
+        new_root, folders_created, documents_created = copy_folder_tree(session, current_user, source, target, name=name)
+        session.commit()
+        session.refresh(new_root)
+        return new_root, folders_created, documents_created
+
+    try:
+        new_root, folders_created, documents_created = await run_in_threadpool(copy)
+    except BatchError as e:
+        session.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return FolderCopyResponse(folder=new_root, folders_created=folders_created, documents_created=documents_created)
+
 @app.get("/projects", response_model=List[ProjectRead])
 async def read_projects(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
     # Base statement: Project + Owner Name + Owner ID + Root Folder Updated At from root folder
@@ -1621,19 +2467,21 @@ async def delete_project(
         if not admin_member:
             raise HTTPException(status_code=403, detail="Only Project Admins can delete the project")
 
-    # 1. Delete associated root folder
-    root_folder = session.get(Folder, project.root_folder_id) if project.root_folder_id else None
-    
-    session.delete(project)
-    
-    if root_folder:
-        session.delete(root_folder)
-        
-    session.commit()
+    # Project, members and the whole folder tree go with set-based deletes
+    # (documents to the trash); the project row itself is removed with its root folder.
+    def remove():
+        from sqlalchemy import delete
+        if project.root_folder_id:
+            delete_folder_trees(session, current_user, [project.root_folder_id])
+        session.exec(delete(ProjectMember).where(ProjectMember.project_id == project_id))
+        session.exec(delete(Project).where(Project.id == project_id))
+        session.commit()
+    await run_in_threadpool(remove)
     return {"ok": True}
 
 @app.get("/documents", response_model=List[DocumentRead])
 async def read_documents(
+    request: Request,
     q: Optional[str] = Query(None),
     folder_id: Optional[Union[int, str]] = Query(None), 
     session: Session = Depends(get_session), 
@@ -1726,6 +2574,8 @@ async def read_documents(
 
             accessible_docs.append(DocumentRead(**doc_dict))
             
+    if wants_columnar(request):
+        return columnar_response(accessible_docs)
     return accessible_docs
 
 
@@ -1986,220 +2836,241 @@ class UserShareHistoryItem(SQLModel):
     resource_name: str
     target_user_name: str
     role: str
-    shared_at: str = "2024-01-01"  # Mock date for now
+    share_id: int
+    shared_at: Optional[datetime] = None  # None for shares made before timestamps were recorded
+
+def _collect_user_permissions(session: Session, target_user: User) -> List[UserPermissionItem]:
+    """
+    Everything target_user can reach and why, built from a fixed number of joined
+    queries plus the bulk permission engine (no per-resource lookups).
+    Sorted folders first, then documents, by id.
+    """
+    from sqlalchemy.orm import aliased
+    user_id = target_user.id
 
-@app.get("/users/{user_id}/permissions", response_model=List[UserPermissionItem])
-async def get_user_permissions(
-    user_id: int,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_active_superuser)
-):
-    target_user = session.get(User, user_id)
-    if not target_user:
-        raise HTTPException(status_code=404, detail="User not found")
-        
-    # Dictionary to aggregate permissions: keys (type, id) -> data
     # Role priority: Owner > Admin > Editor > Viewer
     role_priority = {"owner": 4, "admin": 3, "editor": 2, "viewer": 1}
-    
-    perm_map = {} # (type, id) -> {role_val, role_str, sources, name, parent_id, explicit_share_id}
+    perm_map = {} # (type, id) -> {role_val, role_str, sources, name, parent_id, share_id}
 
     def add_perm(res_type, res_id, res_name, role, source, parent_id, share_id=None):
         key = (res_type, res_id)
         current_val = role_priority.get(role, 0)
-        
-        if key not in perm_map:
+        entry = perm_map.get(key)
+        if entry is None:
             perm_map[key] = {
                 "role_val": current_val,
                 "role_str": role,
-                "sources": {source},
+                "sources": [source],
                 "name": res_name,
                 "parent_id": parent_id,
-                "share_id": share_id if source == "shared" else None
+                "share_id": share_id
             }
-        else:
-            entry = perm_map[key]
-            # Update role coverage
-            if current_val > entry["role_val"]:
-                entry["role_val"] = current_val
-                entry["role_str"] = role
-            
-            # Add source
-            entry["sources"].add(source)
-            
-            # If we find an explicit share ID, track it (even if we have other permissions)
-            if share_id:
-                entry["share_id"] = share_id
+            return
+        if current_val > entry["role_val"]:
+            entry["role_val"] = current_val
+            entry["role_str"] = role
+        if source not in entry["sources"]:
+            entry["sources"].append(source)
+        # Track an explicit share even if other sources also grant access
+        if share_id:
+            entry["share_id"] = share_id
 
     # 1. Owned Folders
-    owned_folders = session.exec(select(Folder).where(Folder.owner_id == user_id)).all()
-    for f in owned_folders:
-        add_perm("folder", f.id, f.name, "owner", "Owner", f.parent_id)
+    for f_id, f_name, f_parent in session.exec(
+        select(Folder.id, Folder.name, Folder.parent_id).where(Folder.owner_id == user_id)
+    ).all():
+        add_perm("folder", f_id, f_name, "owner", "Owner", f_parent)
 
-    # 2. Department Folders (Hierarchy)
-    # Fix: User should see folders from their department AND all ancestor departments.
-    # Fix: Role should be dynamic (Editor/Viewer), not hardcoded.
-    perm_service = PermissionService(session)
+    # 2. Department Folders: the user's department and its ancestors (up the tree, 10 levels)
     if target_user.department_id:
-        current_dept_id = target_user.department_id
+        dept_rows = {d_id: (name, parent_id) for d_id, name, parent_id in session.exec(
+            select(Department.id, Department.name, Department.parent_id)
+        ).all()}
         ancestors = []
-        dept_names = {}
-        
-        # Traverse up: Collect all parent departments
-        for _ in range(10): # Depth limit
-            if current_dept_id is None:
-                break
-            dept = session.get(Department, current_dept_id)
-            if not dept:
+        current_dept_id = target_user.department_id
+        for _ in range(10):
+            if current_dept_id is None or current_dept_id not in dept_rows:
                 break
             ancestors.append(current_dept_id)
-            dept_names[current_dept_id] = dept.name
-            current_dept_id = dept.parent_id
-            
+            current_dept_id = dept_rows[current_dept_id][1]
+
         if ancestors:
-            # Fetch all folders belonging to these departments
             dept_folders = session.exec(select(Folder).where(
-                Folder.space_type == SpaceType.DEPARTMENT, 
+                Folder.space_type == SpaceType.DEPARTMENT,
                 Folder.department_id.in_(ancestors)
             )).all()
-            
+            roles = PermissionService(session).effective_roles(target_user, dept_folders)
             for f in dept_folders:
-                # Calculate effective role (e.g. Editor if member, or Viewer if just browsing)
-                # Note: get_effective_role checks strict write permissions
-                eff_role = perm_service.get_effective_role(target_user, f)
-                
-                # Format Source
-                src_dept_name = dept_names.get(f.department_id, "Department")
-                source_desc = f"Department: {src_dept_name}"
+                source_desc = f"Department: {dept_rows[f.department_id][0]}"
                 if f.department_id != target_user.department_id:
-                     source_desc += " (Inherited)"
-                
-                add_perm("folder", f.id, f.name, eff_role, source_desc, f.parent_id)
-            
-    # 3. Project Memberships
-    project_memberships = session.exec(select(ProjectMember).where(ProjectMember.user_id == user_id)).all()
-    for pm in project_memberships:
-        project = session.get(Project, pm.project_id)
-        if project:
-            root_folder = session.get(Folder, project.root_folder_id)
-            if root_folder:
-                # Map Project Role to Folder Permission
-                # Project Admin -> Folder Editor (or Admin if we had that concept fully mapped)
-                folder_role = "viewer"
-                if pm.role == ProjectRole.ADMIN: folder_role = "editor" # Simplified
-                elif pm.role == ProjectRole.EDITOR: folder_role = "editor"
-                
-                add_perm("folder", root_folder.id, root_folder.name, folder_role, f"Project: {project.name}", root_folder.parent_id)
-
-    # 4. Explicit Shares (Collaborator)
-    collaborations = session.exec(select(Collaborator).where(Collaborator.user_id == user_id)).all()
-    for c in collaborations:
-        if c.folder_id:
-            folder = session.get(Folder, c.folder_id)
-            if folder:
-                # Get Sharer Name
-                sharer = "Unknown"
-                if folder.owner: sharer = folder.owner.username
-                add_perm("folder", folder.id, folder.name, c.role, f"Shared by {sharer}", folder.parent_id, share_id=c.id)
-        elif c.document_id:
-            doc = session.get(Document, c.document_id)
-            if doc:
-                sharer = "Unknown"
-                if doc.author: sharer = doc.author.username
-                # Documents often don't have parent_id in this view context unless we fetch folder
-                # But for tree view, we might need it. Sticky point: Doc might be in a folder user also has access to.
-                add_perm("document", doc.id, doc.name, c.role, f"Shared by {sharer}", doc.folder_id, share_id=c.id)
-                
-    # Convert to List
-    result = []
-    for (rtype, rid), data in perm_map.items():
-        result.append(UserPermissionItem(
+                    source_desc += " (Inherited)"
+                add_perm("folder", f.id, f.name, roles[f.id], source_desc, f.parent_id)
+
+    # 3. Project Memberships (one join)
+    for pm_role, project_name, f_id, f_name, f_parent in session.exec(
+        select(ProjectMember.role, Project.name, Folder.id, Folder.name, Folder.parent_id)
+        .join(Project, ProjectMember.project_id == Project.id)
+        .join(Folder, Project.root_folder_id == Folder.id)
+        .where(ProjectMember.user_id == user_id)
+    ).all():
+        # Project Admin/Editor -> Folder Editor (simplified)
+        folder_role = "editor" if pm_role in (ProjectRole.ADMIN, ProjectRole.EDITOR) else "viewer"
+        add_perm("folder", f_id, f_name, folder_role, f"Project: {project_name}", f_parent)
+
+    # 4. Explicit Shares (Collaborator), with the sharer (owner/author) joined in
+    Sharer = aliased(User)
+    for c_id, c_role, f_id, f_name, f_parent, sharer in session.exec(
+        select(Collaborator.id, Collaborator.role, Folder.id, Folder.name, Folder.parent_id, Sharer.username)
+        .join(Folder, Collaborator.folder_id == Folder.id)
+        .join(Sharer, Folder.owner_id == Sharer.id, isouter=True)
+        .where(Collaborator.user_id == user_id)
+    ).all():
+        add_perm("folder", f_id, f_name, c_role.value if hasattr(c_role, 'value') else c_role,
+                 f"Shared by {sharer or 'Unknown'}", f_parent, share_id=c_id)
+    for c_id, c_role, d_id, d_name, d_folder, sharer in session.exec(
+        select(Collaborator.id, Collaborator.role, Document.id, Document.name, Document.folder_id, Sharer.username)
+        .join(Document, Collaborator.document_id == Document.id)
+        .join(Sharer, Document.author_id == Sharer.id, isouter=True)
+        .where(Collaborator.user_id == user_id, Document.is_deleted == False)
+    ).all():
+        add_perm("document", d_id, d_name, c_role.value if hasattr(c_role, 'value') else c_role,
+                 f"Shared by {sharer or 'Unknown'}", d_folder, share_id=c_id)
+
+    type_order = {"folder": 0, "document": 1}
+    return [
+        UserPermissionItem(
             resource_type=rtype,
             resource_id=rid,
             resource_name=data["name"],
             effective_role=data["role_str"],
-            access_sources=list(data["sources"]),
+            access_sources=data["sources"],
             parent_id=data["parent_id"],
             is_explicit_share=data["share_id"] is not None,
             share_id=data["share_id"]
-        ))
-        
-    return result
+        )
+        for (rtype, rid), data in sorted(perm_map.items(), key=lambda kv: (type_order[kv[0][0]], kv[0][1]))
+    ]
+
+@app.get("/users/{user_id}/permissions", response_model=List[UserPermissionItem])
+async def get_user_permissions(
+    user_id: int,
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: Optional[int] = Query(default=None, ge=1, le=5000),
+    format: Optional[str] = Query(default=None, description="'ndjson' to stream one item per line"),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_superuser)
+):
+    """
+    All resources the user can reach, with effective role and access sources.
+    Paginate with skip/limit (total in X-Total-Count), or ask for NDJSON
+    (format=ndjson or Accept: application/x-ndjson) to stream items as they are serialized,
+    or for the columnar format (Accept: application/vnd.sdh.columnar+json).
+    """
+    target_user = session.get(User, user_id)
+    if not target_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    items = await run_in_threadpool(_collect_user_permissions, session, target_user)
+    total = len(items)
+    items = items[skip:skip + limit] if limit else items[skip:]
+
+    if wants_columnar(request):
+        return columnar_response(items, {"X-Total-Count": str(total)})
+    if format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        def lines():
+            for item in items:
+                yield item.json() + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Total-Count": str(total)})
+
+    response.headers["X-Total-Count"] = str(total)
+    return items
 
 @app.get("/users/{user_id}/shares", response_model=List[UserShareHistoryItem])
 async def get_user_shares(
     user_id: int,
+    direction: Optional[str] = Query(default=None, pattern="^(inbound|outbound)$"),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(default=100, ge=1, le=500),
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_active_superuser)
 ):
+    """
+    Shares received (inbound) and granted on the user's folders/documents (outbound),
+    newest first. Next page: pass the last item's shared_at as before and its share_id
+    as before_id (before_id alone once shared_at is null - undated legacy shares come last).
+    """
+    from sqlalchemy import and_, or_
+    from sqlalchemy.orm import aliased
+
+    def page(statement):
+        # created_at DESC already puts NULLs last on SQLite
+        if before is not None and before_id is not None:
+            statement = statement.where(or_(
+                Collaborator.created_at < before,
+                and_(Collaborator.created_at == before, Collaborator.id < before_id),
+                Collaborator.created_at == None
+            ))
+        elif before_id is not None:
+            statement = statement.where(Collaborator.created_at == None, Collaborator.id < before_id)
+        return statement.order_by(Collaborator.created_at.desc(), Collaborator.id.desc()).limit(limit)
+
+    def to_item(direction, share_id, role, created_at, folder_id, folder_name, doc_id, doc_name, other_user):
+        return UserShareHistoryItem(
+            direction=direction,
+            resource_type="folder" if folder_id else "document",
+            resource_id=folder_id or doc_id,
+            resource_name=(folder_name if folder_id else doc_name) or "Unknown",
+            target_user_name=other_user or "Unknown",
+            role=role,
+            share_id=share_id,
+            shared_at=created_at
+        )
+
+    columns = (Collaborator.id, Collaborator.role, Collaborator.created_at,
+               Folder.id, Folder.name, Document.id, Document.name)
     history = []
-    
-    # 1. Inbound Shares (Shared WITH this user)
-    inbound = session.exec(select(Collaborator).where(Collaborator.user_id == user_id)).all()
-    for c in inbound:
-        sharer_name = "Unknown"
-        res_name = "Unknown"
-        res_type = "unknown"
-        res_id = 0
-        
-        if c.folder_id:
-            folder = session.get(Folder, c.folder_id)
-            if folder and folder.owner:
-                sharer_name = folder.owner.username
-                res_name = folder.name
-                res_type = "folder"
-                res_id = folder.id
-        elif c.document_id:
-            doc = session.get(Document, c.document_id)
-            if doc and doc.author:
-                sharer_name = doc.author.username
-                res_name = doc.name
-                res_type = "document"
-                res_id = doc.id
-                
-        history.append(UserShareHistoryItem(
-            direction="inbound",
-            resource_type=res_type,
-            resource_id=res_id,
-            resource_name=res_name,
-            target_user_name=sharer_name, # In this context, it's the "From" user
-            role=c.role
-        ))
 
-    # 2. Outbound Shares (Shared BY this user)
-    # Find folders owned by user that have collaborators
-    owned_folders = session.exec(select(Folder).where(Folder.owner_id == user_id)).all()
-    for f in owned_folders:
-        folder_collabs = session.exec(select(Collaborator).where(Collaborator.folder_id == f.id)).all()
-        for c in folder_collabs:
-            target = session.get(User, c.user_id)
-            if target:
-                history.append(UserShareHistoryItem(
-                    direction="outbound",
-                    resource_type="folder",
-                    resource_id=f.id,
-                    resource_name=f.name,
-                    target_user_name=target.username,
-                    role=c.role
-                ))
-                
-    # Find documents authored by user that have collaborators
-    owned_docs = session.exec(select(Document).where(Document.author_id == user_id)).all()
-    for d in owned_docs:
-        doc_collabs = session.exec(select(Collaborator).where(Collaborator.document_id == d.id)).all()
-        for c in doc_collabs:
-            target = session.get(User, c.user_id)
-            if target:
-                history.append(UserShareHistoryItem(
-                    direction="outbound",
-                    resource_type="document",
-                    resource_id=d.id,
-                    resource_name=d.name,
-                    target_user_name=target.username,
-                    role=c.role
-                ))
-
-    return history
+    # 1. Inbound Shares (Shared WITH this user) - the other party is the owner/author
+    if direction in (None, "inbound"):
+        Sharer = aliased(User)
+        statement = (
+            select(*columns, Sharer.username)
+            .join(Folder, Collaborator.folder_id == Folder.id, isouter=True)
+            .join(Document, Collaborator.document_id == Document.id, isouter=True)
+            .join(Sharer, Sharer.id == func.coalesce(Folder.owner_id, Document.author_id), isouter=True)
+            .where(
+                Collaborator.user_id == user_id,
+                or_(Folder.id != None, and_(Document.id != None, Document.is_deleted == False))
+            )
+        )
+        history += [to_item("inbound", *row) for row in session.exec(page(statement)).all()]
+
+    # 2. Outbound Shares (Shared BY this user) - on folders they own / documents they wrote
+    if direction in (None, "outbound"):
+        Target = aliased(User)
+        statement = (
+            select(*columns, Target.username)
+            .join(Folder, Collaborator.folder_id == Folder.id, isouter=True)
+            .join(Document, Collaborator.document_id == Document.id, isouter=True)
+            .join(Target, Collaborator.user_id == Target.id)
+            .where(
+                or_(
+                    Folder.owner_id == user_id,
+                    and_(Document.author_id == user_id, Document.is_deleted == False)
+                ),
+                # A share with oneself is already listed as inbound
+                Collaborator.user_id != user_id
+            )
+        )
+        history += [to_item("outbound", *row) for row in session.exec(page(statement)).all()]
+
+    # Both pages are sorted the same way; merge and cut so one cursor serves both
+    history.sort(key=lambda h: (h.shared_at is not None, h.shared_at or datetime.min, h.share_id), reverse=True)
+    return history[:limit]
+
 
 # --- SPA Static File Serving (Production) ---
 # Check if 'static' folder exists (created by Docker build)
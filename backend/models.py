@@ -50,7 +50,7 @@ class User(SQLModel, table=True):
     hashed_password: str
     employee_id: Optional[str] = Field(default=None, index=True)
     email: Optional[str] = Field(default=None)
-    department_id: Optional[int] = Field(default=None, foreign_key="department.id")
+    department_id: Optional[int] = Field(default=None, foreign_key="department.id", index=True)
     role: Role = Field(default=Role.VIEWER)
     
     department: Optional[Department] = Relationship(back_populates="users")
@@ -102,10 +102,18 @@ class Document(SQLModel, table=True):
     name: str = Field(index=True)
     
     # Replaces file_url in logic, though we might keep file_url or computed property
-    oss_key: str 
+    oss_key: str = Field(index=True)
     file_type: str
     size: int = Field(default=0)
+    # SHA-256 (hex) of the content. Several documents may share one oss_key via Blob.
+    content_hash: Optional[str] = Field(default=None, index=True)
     is_deleted: bool = Field(default=False)
+    # Set when the document is moved to the trash; purged TRASH_RETENTION_DAYS later
+    deleted_at: Optional[datetime] = None
+    deleted_by: Optional[int] = None  # user id; no FK so User.documents stays unambiguous
+    # Name of the folder a trashed document was in when that folder was deleted
+    # (folder_id is cleared then, since SQLite may hand the id to a new folder)
+    deleted_from: Optional[str] = None
     is_restricted: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -117,12 +125,47 @@ class Document(SQLModel, table=True):
     author: Optional[User] = Relationship(back_populates="documents")
     collaborators: List["Collaborator"] = Relationship(back_populates="document", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
 
+class DocumentArchive(SQLModel, table=True):
+    """
+    Purged documents, moved out of the document table so it only holds live and
+    trashed rows. Kept for audit; the stored object has been released.
+    id is the original Document.id. No foreign keys: folders and users may be gone.
+    """
+    id: int = Field(primary_key=True)
+    name: str
+    oss_key: str
+    file_type: str
+    size: int = Field(default=0)
+    content_hash: Optional[str] = None
+    is_restricted: bool = Field(default=False)
+    folder_id: Optional[int] = Field(default=None, index=True)
+    author_id: Optional[int] = Field(default=None, index=True)
+    created_at: datetime
+    updated_at: datetime
+    deleted_at: Optional[datetime] = None
+    deleted_by: Optional[int] = None
+    archived_at: datetime = Field(default_factory=datetime.now, index=True)
+
+class Blob(SQLModel, table=True):
+    """
+    Content-addressed storage object. ref_count is the number of Document rows
+    pointing at oss_key; the object is only removed from storage when it hits 0.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True)
+    oss_key: str = Field(index=True, unique=True)
+    size: int = Field(default=0)
+    ref_count: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class Collaborator(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     folder_id: Optional[int] = Field(default=None, foreign_key="folder.id")
     document_id: Optional[int] = Field(default=None, foreign_key="document.id")
     role: CollaboratorRole = Field(default=CollaboratorRole.VIEWER)
+    # When the share was granted (NULL for shares made before this was recorded)
+    created_at: Optional[datetime] = Field(default_factory=datetime.now, index=True)
     
     user: User = Relationship(back_populates="collaborations")
     folder: Optional[Folder] = Relationship(back_populates="collaborators")
@@ -148,3 +191,30 @@ class ProjectMember(SQLModel, table=True):
     
     project: Project = Relationship(back_populates="members")
     user: User = Relationship(back_populates="project_memberships")
+
+class ArchiveJob(SQLModel, table=True):
+    """
+    Background folder-archive build. Finished archives are cached in storage under a
+    fingerprint of the user's readable subtree, so identical requests reuse them.
+    """
+    id: str = Field(primary_key=True)  # uuid4 hex
+    folder_id: int = Field(foreign_key="folder.id", index=True)
+    user_id: int = Field(foreign_key="user.id")
+    fingerprint: str = Field(index=True)
+    status: str = Field(default="pending")  # pending / running / ready / failed
+    oss_key: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+class UserSearchTerm(SQLModel, table=True):
+    """
+    User directory search index: every suffix of a user's lowercased username,
+    employee_id, email and name pinyin, so prefix and substring search are both
+    index range scans on term. position is the suffix offset (0 = prefix match).
+    Maintained by services.user_search.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    term: str = Field(index=True)
+    position: int = Field(default=0)
@@ -0,0 +1,38 @@
+import argparse
+from sqlmodel import Session
+from database import engine
+from services.reconcile import reconcile, DEFAULT_GRACE_SECONDS
+
+def format_size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storage objects with database references and collect orphans.")
+    parser.add_argument("--prefix", default="", help="Only scan keys under this prefix")
+    parser.add_argument("--delete", action="store_true", help="Delete orphans older than the grace period (default: report only)")
+    parser.add_argument("--grace-hours", type=float, default=DEFAULT_GRACE_SECONDS / 3600,
+                        help="Never delete objects modified within this many hours")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        report = reconcile(session, prefix=args.prefix, delete=args.delete,
+                           grace_seconds=int(args.grace_hours * 3600))
+
+    print(f"\nScanned {report.scanned} objects ({format_size(report.scanned_bytes)}), {report.referenced} referenced.")
+    print(f"Orphans: {report.orphans} ({format_size(report.orphan_bytes)}), {report.too_new} inside the grace period.")
+    for key in report.orphan_samples:
+        print(f"  [Orphan] {key}")
+    print(f"Missing (referenced but not in storage): {report.missing}")
+    for key in report.missing_samples:
+        print(f"  [Missing] {key}")
+    if args.delete:
+        print(f"Deleted {report.deleted} orphans ({format_size(report.deleted_bytes)}), {report.delete_errors} errors.")
+    elif report.orphans - report.too_new:
+        print("Dry run. Re-run with --delete to remove orphans past the grace period.")
+
+if __name__ == "__main__":
+    main()
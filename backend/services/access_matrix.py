@@ -0,0 +1,337 @@
+import csv
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+from sqlmodel import Session, select
+from models import Collaborator, Department, Folder, Project, ProjectMember, ProjectRole, Role, SpaceType, User
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: only the offline access report needs it
+    np = None
+
+# Organization-wide "who can read/write which folder", computed offline.
+# Same rules as PermissionService.check_permission, but evaluated for every user and
+# folder at once: one bitset of users per folder (packed, 1 bit per user), filled per
+# folder group (space, department, project) and propagated down the folder tree.
+
+# Depth limits of the per-request checks, kept so results match them exactly
+COLLAB_INHERIT_DEPTH = 10   # _get_collaborator_role walks the folder and 9 ancestors
+USER_DEPT_DEPTH = 5         # parent departments of the user's own department
+MANAGER_DEPT_DEPTH = 10     # folder department and its ancestors, for managers
+
+READ = "read"
+WRITE = "write"
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The access matrix needs NumPy (pip install numpy)")
+
+class AccessMatrix:
+    """
+    Readable/writable user bitsets for every folder.
+    Build once with AccessMatrix.build(session); queries are then pure array lookups.
+    """
+    def __init__(self, user_ids, usernames, folder_ids, folder_names, read, write):
+        self.user_ids = user_ids            # (U,) int64
+        self.usernames = usernames          # list, aligned with user_ids
+        self.folder_ids = folder_ids        # (F,) int64
+        self.folder_names = folder_names    # list, aligned with folder_ids
+        self.read = read                    # (F, ceil(U/8)) uint8, packed user bits
+        self.write = write
+        self._user_index = {int(uid): i for i, uid in enumerate(user_ids)}
+        self._folder_index = {int(fid): i for i, fid in enumerate(folder_ids)}
+
+    # --- Queries ---
+
+    def _bits(self, action: str):
+        if action not in (READ, WRITE):
+            raise ValueError(f"Unknown action: {action}")
+        return self.read if action == READ else self.write
+
+    def users_with_access(self, folder_id: int, action: str = READ) -> List[int]:
+        """
+        Ids of the users who can read (or write) the folder. Unknown folders: [].
+        """
+        row = self._folder_index.get(folder_id)
+        if row is None:
+            return []
+        bits = np.unpackbits(self._bits(action)[row], count=len(self.user_ids))
+        return self.user_ids[bits.astype(bool)].tolist()
+
+    def folders_for_user(self, user_id: int, action: str = READ) -> List[int]:
+        """
+        Ids of the folders the user can read (or write). Unknown users: [].
+        """
+        col = self._user_index.get(user_id)
+        if col is None:
+            return []
+        mask = (self._bits(action)[:, col >> 3] & (0x80 >> (col & 7))) != 0
+        return self.folder_ids[mask].tolist()
+
+    def can(self, user_id: int, folder_id: int, action: str = READ) -> bool:
+        row = self._folder_index.get(folder_id)
+        col = self._user_index.get(user_id)
+        if row is None or col is None:
+            return False
+        return bool(self._bits(action)[row, col >> 3] & (0x80 >> (col & 7)))
+
+    def iter_grants(self, folder_ids: Optional[List[int]] = None) -> Iterator[Tuple[int, int, str]]:
+        """
+        (folder_id, user_id, 'read' | 'write') for every user with access, folder by
+        folder; 'write' implies read. Only one folder row is unpacked at a time.
+        """
+        rows = range(len(self.folder_ids)) if folder_ids is None else \
+            [self._folder_index[f] for f in folder_ids if f in self._folder_index]
+        n = len(self.user_ids)
+        for row in rows:
+            can_read = np.unpackbits(self.read[row], count=n).astype(bool)
+            can_write = np.unpackbits(self.write[row], count=n).astype(bool)
+            folder_id = int(self.folder_ids[row])
+            for col in np.flatnonzero(can_read | can_write):
+                yield folder_id, int(self.user_ids[col]), WRITE if can_write[col] else READ
+
+    def write_csv(self, out: TextIO, folder_ids: Optional[List[int]] = None) -> int:
+        """
+        Stream the grants as CSV (folder_id, folder_name, user_id, username, access).
+        Returns the number of rows written.
+        """
+        writer = csv.writer(out)
+        writer.writerow(["folder_id", "folder_name", "user_id", "username", "access"])
+        count = 0
+        for folder_id, user_id, access in self.iter_grants(folder_ids):
+            writer.writerow([
+                folder_id, self.folder_names[self._folder_index[folder_id]],
+                user_id, self.usernames[self._user_index[user_id]], access
+            ])
+            count += 1
+        return count
+
+    # --- Build ---
+
+    @classmethod
+    def build(cls, session: Session) -> "AccessMatrix":
+        _require_numpy()
+        users = session.exec(select(User.id, User.username, User.role, User.department_id).order_by(User.id)).all()
+        folders = session.exec(select(
+            Folder.id, Folder.name, Folder.parent_id, Folder.owner_id, Folder.department_id,
+            Folder.space_type, Folder.is_restricted
+        ).order_by(Folder.id)).all()
+        dept_parent: Dict[int, Optional[int]] = dict(session.exec(select(Department.id, Department.parent_id)).all())
+
+        n_users, n_folders = len(users), len(folders)
+        width = (n_users + 7) // 8
+        user_ids = np.array([u[0] for u in users], dtype=np.int64)
+        folder_ids = np.array([f[0] for f in folders], dtype=np.int64)
+        user_index = {uid: i for i, uid in enumerate(user_ids.tolist())}
+        folder_index = {fid: i for i, fid in enumerate(folder_ids.tolist())}
+
+        def pack(mask) -> "np.ndarray":
+            return np.packbits(mask) if n_users else np.zeros(0, dtype=np.uint8)
+
+        roles = [u[2] for u in users]
+        user_dept = [u[3] for u in users]
+        is_super = np.array([r == Role.SUPER_ADMIN for r in roles], dtype=bool)
+        is_manager = np.array([r == Role.MANAGER for r in roles], dtype=bool)
+        is_editor = np.array([r == Role.EDITOR for r in roles], dtype=bool)
+        is_viewer = np.array([r == Role.VIEWER for r in roles], dtype=bool)
+        everyone = pack(np.ones(n_users, dtype=bool))
+
+        # Folder tree in preorder, so every subtree is one contiguous slice
+        parent = np.full(n_folders, -1, dtype=np.int64)
+        for i, f in enumerate(folders):
+            if f[2] is not None and f[2] in folder_index:
+                parent[i] = folder_index[f[2]]
+        order, depth, subtree_end = _preorder(parent)
+        position = np.empty(n_folders, dtype=np.int64)
+        position[order] = np.arange(n_folders)
+
+        read = np.zeros((n_folders, width), dtype=np.uint8)
+        write = np.zeros((n_folders, width), dtype=np.uint8)
+
+        # 1. Space rules, one user mask per folder group
+        space = [str(f[5]).lower() for f in folders]
+        is_public = np.array([s == SpaceType.PUBLIC.value for s in space], dtype=bool)
+        is_project = np.array([s == SpaceType.PROJECT.value for s in space], dtype=bool)
+        is_dept = ~is_public & ~is_project  # department or anything unrecognised
+        # parent_id is None, not "parent missing": a dangling parent_id is not a root
+        no_parent = np.array([f[2] is None for f in folders], dtype=bool)
+
+        read[is_public] = everyone
+        write[is_public] = pack(is_manager | is_editor)
+
+        read[is_dept & no_parent & np.array([f[5] == SpaceType.DEPARTMENT for f in folders], dtype=bool)] = everyone
+        # Unrestricted department folders get their department's member masks
+        rows = [i for i, f in enumerate(folders) if is_dept[i] and not f[6] and f[4] is not None]
+        if rows:
+            dept_ids = sorted({folders[i][4] for i in rows})
+            dept_read, dept_write = _department_masks(dept_ids, dept_parent, user_dept, is_manager, is_viewer, pack)
+            which = np.searchsorted(dept_ids, [folders[i][4] for i in rows])
+            read[rows] |= dept_read[which]
+            write[rows] |= dept_write[which]
+
+        project_read, project_write, project_of = _project_masks(session, folder_index, user_index, order, parent, pack, width)
+        rows = np.flatnonzero(is_project & (project_of >= 0))
+        read[rows] |= project_read[project_of[rows]]
+        write[rows] |= project_write[project_of[rows]]
+        # The project-space container is readable by all; writing it is super-admin only
+        container = np.array([f[5] == SpaceType.PROJECT for f in folders], dtype=bool)
+        read[is_project & (project_of < 0) & no_parent & container] = everyone
+
+        # 2. Collaborators: the nearest share within COLLAB_INHERIT_DEPTH levels wins.
+        # Shares are applied shallowest first, so deeper (nearer) ones overwrite.
+        shares = [
+            (int(depth[folder_index[fid]]), -cid, folder_index[fid], user_index[uid], role)
+            for cid, uid, fid, role in session.exec(select(
+                Collaborator.id, Collaborator.user_id, Collaborator.folder_id, Collaborator.role
+            ).where(Collaborator.folder_id != None)).all()
+            if fid in folder_index and uid in user_index
+        ]
+        shares.sort()
+        has_share = np.zeros((n_folders, width), dtype=np.uint8)
+        share_writes = np.zeros((n_folders, width), dtype=np.uint8)
+        for share_depth, _, row, col, role in shares:
+            start = position[row]
+            covered = order[start:subtree_end[start]]
+            covered = covered[depth[covered] < share_depth + COLLAB_INHERIT_DEPTH]
+            byte, bit = col >> 3, np.uint8(0x80 >> (col & 7))
+            has_share[covered, byte] |= bit
+            raw = (role.value if hasattr(role, 'value') else str(role)).lower()
+            if raw in ('editor', 'admin'):
+                share_writes[covered, byte] |= bit
+            else:
+                share_writes[covered, byte] &= ~bit
+        read |= has_share
+        write |= share_writes
+
+        # 3. Owners and super admins can do anything
+        owner = np.array([user_index.get(f[3], -1) for f in folders], dtype=np.int64)
+        rows = np.flatnonzero(owner >= 0)
+        cols = owner[rows]
+        bits = (0x80 >> (cols & 7)).astype(np.uint8)
+        read[rows, cols >> 3] |= bits
+        write[rows, cols >> 3] |= bits
+        supers = pack(is_super)
+        read |= supers
+        write |= supers
+
+        return cls(user_ids, [u[1] for u in users], folder_ids, [f[1] for f in folders], read, write)
+
+def _preorder(parent):
+    """
+    Preorder of a forest given as a parent index array (-1 for roots).
+    Returns (order, depth, subtree_end): the descendants of order[k] are
+    order[k + 1:subtree_end[k]]. Folders caught in a parent cycle are treated as roots.
+    """
+    n = len(parent)
+    children: List[List[int]] = [[] for _ in range(n)]
+    roots = []
+    for i, p in enumerate(parent.tolist()):
+        (roots if p < 0 else children[p]).append(i)
+
+    order = np.empty(n, dtype=np.int64)
+    depth = np.zeros(n, dtype=np.int64)
+    subtree_end = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+    k = 0
+
+    def walk(root: int):
+        nonlocal k
+        stack = [(root, 0, False)]
+        while stack:
+            node, d, done = stack.pop()
+            if done:
+                subtree_end[position[node]] = k
+                continue
+            visited[node] = True
+            position[node] = k
+            order[k] = node
+            depth[node] = d
+            k += 1
+            stack.append((node, d, True))
+            for child in reversed(children[node]):
+                if not visited[child]:
+                    stack.append((child, d + 1, False))
+
+    position = np.empty(n, dtype=np.int64)
+    for root in roots:
+        walk(root)
+    for i in range(n):
+        if not visited[i]:
+            walk(i)
+    return order, depth, subtree_end
+
+def _department_masks(dept_ids, dept_parent, user_dept, is_manager, is_viewer, pack):
+    """
+    Per folder department (rows aligned with dept_ids): the users
+    _check_department_permission lets in (own department, or a parent department of it
+    within USER_DEPT_DEPTH levels; managers also see departments below their own),
+    and the same minus viewers for write.
+    """
+    n_users = len(user_dept)
+    # Department ancestors of each user's department, as _check_department_permission walks them
+    user_dept_arr = np.array([d if d is not None else -1 for d in user_dept], dtype=np.int64)
+    ancestors = np.full((n_users, USER_DEPT_DEPTH), -1, dtype=np.int64)
+    for u, d in enumerate(user_dept):
+        current = d
+        for k in range(USER_DEPT_DEPTH):
+            if current is None or current not in dept_parent:
+                break
+            current = dept_parent[current]
+            if current is None:
+                break
+            ancestors[u, k] = current
+
+    readers, writers = [], []
+    for dept_id in dept_ids:
+        members = (user_dept_arr == dept_id) | (ancestors == dept_id).any(axis=1)
+        chain = []
+        current = dept_id
+        for _ in range(MANAGER_DEPT_DEPTH):
+            if current is None:
+                break
+            chain.append(current)
+            if current not in dept_parent:
+                break
+            current = dept_parent[current]
+        members |= is_manager & np.isin(user_dept_arr, chain)
+        readers.append(pack(members))
+        writers.append(pack(members & ~is_viewer))
+    return np.array(readers, dtype=np.uint8), np.array(writers, dtype=np.uint8)
+
+def _project_masks(session: Session, folder_index, user_index, order, parent, pack, width):
+    """
+    Member masks per project, and the project each folder belongs to (the nearest
+    ancestor-or-self that is a project root, -1 if none), filled top-down.
+    """
+    n_users = len(user_index)
+    projects = session.exec(select(Project.id, Project.root_folder_id).order_by(Project.id)).all()
+    project_row = {pid: i for i, (pid, _) in enumerate(projects)}
+    root_project = {}
+    for pid, root_id in projects:
+        if root_id in folder_index:
+            root_project.setdefault(folder_index[root_id], project_row[pid])
+
+    readers = np.zeros((len(projects), n_users), dtype=bool)
+    writers = np.zeros((len(projects), n_users), dtype=bool)
+    for pid, uid, role in session.exec(select(ProjectMember.project_id, ProjectMember.user_id, ProjectMember.role)).all():
+        if pid not in project_row or uid not in user_index:
+            continue
+        # A user should have one membership per project; the first row wins like .first()
+        p, u = project_row[pid], user_index[uid]
+        if readers[p, u]:
+            continue
+        readers[p, u] = role in (ProjectRole.ADMIN, ProjectRole.EDITOR, ProjectRole.VIEWER)
+        writers[p, u] = role in (ProjectRole.ADMIN, ProjectRole.EDITOR)
+
+    project_of = np.full(len(parent), -1, dtype=np.int64)
+    for node in order.tolist():
+        if node in root_project:
+            project_of[node] = root_project[node]
+        elif parent[node] >= 0:
+            project_of[node] = project_of[parent[node]]
+
+    if not projects:
+        empty = np.zeros((0, width), dtype=np.uint8)
+        return empty, empty, project_of
+    return (np.array([pack(r) for r in readers], dtype=np.uint8).reshape(len(projects), -1),
+            np.array([pack(w) for w in writers], dtype=np.uint8).reshape(len(projects), -1),
+            project_of)
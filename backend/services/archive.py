@@ -0,0 +1,527 @@
+import itertools
+import os
+import struct
+import threading
+import zlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Deque, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from sqlmodel import Session, select
+from models import User, Folder, Document
+from services.permission import PermissionService
+from services.storage import StorageService
+from services.compress_worker import deflate_member
+
+UPLOAD_DIR = "uploads"
+READ_CHUNK_SIZE = 64 * 1024
+
+# OSS prefetch: fetch up to PREFETCH_WORKERS objects ahead of the writer, holding at most
+# PREFETCH_MAX_BYTES in memory. Objects above PREFETCH_MAX_OBJECT_SIZE are streamed in place.
+PREFETCH_WORKERS = int(os.getenv("ZIP_PREFETCH_WORKERS", "8"))
+PREFETCH_MAX_BYTES = int(os.getenv("ZIP_PREFETCH_MAX_BYTES", str(64 * 1024 * 1024)))
+PREFETCH_MAX_OBJECT_SIZE = int(os.getenv("ZIP_PREFETCH_MAX_OBJECT_SIZE", str(8 * 1024 * 1024)))
+
+# Parallel compression: 0 = deflate inline in the streaming thread (default).
+# N > 0 = deflate members in a shared pool of N processes and assemble them in order.
+COMPRESS_WORKERS = int(os.getenv("ZIP_COMPRESS_WORKERS", "0"))
+# Members above this size are deflated inline, streaming, instead of being shipped to a worker
+COMPRESS_MAX_MEMBER_SIZE = int(os.getenv("ZIP_COMPRESS_MAX_MEMBER_SIZE", str(32 * 1024 * 1024)))
+# Uncompressed bytes queued for / held by workers at any time (per archive)
+COMPRESS_MAX_INFLIGHT_BYTES = int(os.getenv("ZIP_COMPRESS_MAX_INFLIGHT_BYTES", str(128 * 1024 * 1024)))
+
+# Formats that are already compressed: deflating them again burns CPU for ~0% gain
+STORED_EXTENSIONS = {
+    "docx", "xlsx", "pptx", "odt", "ods", "odp",
+    "pdf",
+    "jpg", "jpeg", "png", "gif", "webp", "heic",
+    "mp4", "mov", "avi", "mkv", "webm", "mp3", "m4a", "aac",
+    "zip", "rar", "7z", "gz", "tgz", "bz2", "xz",
+}
+
+# ZIP record signatures / constants
+_LOCAL_HEADER_SIG = 0x04034B50
+_DATA_DESCRIPTOR_SIG = 0x08074B50
+_CENTRAL_HEADER_SIG = 0x02014B50
+_ZIP64_EOCD_SIG = 0x06064B50
+_ZIP64_LOCATOR_SIG = 0x07064B50
+_EOCD_SIG = 0x06054B50
+_ZIP64_EXTRA_ID = 0x0001
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+class ArchiveEntry(NamedTuple):
+    arcname: str
+    oss_key: str
+    local_path: Optional[str]  # Set when the object is on local disk
+    size: int
+    mtime: datetime
+    document_id: Optional[int] = None
+
+class ArchiveIncomplete(Exception):
+    """
+    Raised by stream_zip(strict=True) when a member's content cannot be read.
+    """
+
+class _CentralRecord(NamedTuple):
+    name: bytes
+    flags: int
+    method: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    compress_size: int
+    file_size: int
+    offset: int
+
+def _dos_datetime(dt: datetime):
+    # DOS timestamps cannot represent years before 1980
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    dos_time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    dos_date = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    return dos_time, dos_date
+
+class ZipStreamWriter:
+    """
+    Write-only ZIP encoder that never seeks: every member is emitted as
+    local header + data + data descriptor, so bytes can go to the client as soon
+    as they are produced. ZIP64 records are used when a member (or the archive)
+    exceeds the 32-bit limits. Only the small central directory is held in memory.
+    """
+    def __init__(self):
+        self._offset = 0
+        self._records: List[_CentralRecord] = []
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+    def _local_header(self, name: bytes, flags: int, method: int, dos_time: int, dos_date: int, zip64: bool) -> bytes:
+        extra = b""
+        if zip64:
+            # Sizes are unknown up front; the real values follow in the data descriptor
+            extra = struct.pack("<HHQQ", _ZIP64_EXTRA_ID, 16, 0, 0)
+        size_field = _ZIP32_LIMIT if zip64 else 0
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            _LOCAL_HEADER_SIG, 45 if zip64 else 20, flags, method, dos_time, dos_date,
+            0, size_field, size_field, len(name), len(extra)
+        )
+        return header + name + extra
+
+    def _data_descriptor(self, crc: int, compress_size: int, file_size: int, zip64: bool) -> bytes:
+        if zip64:
+            return struct.pack("<IIQQ", _DATA_DESCRIPTOR_SIG, crc, compress_size, file_size)
+        return struct.pack("<IIII", _DATA_DESCRIPTOR_SIG, crc, compress_size, file_size)
+
+    def write_entry(
+        self,
+        arcname: str,
+        chunks: Iterable[bytes],
+        mtime: datetime,
+        compress: bool = True,
+        size_hint: Optional[int] = None,
+    ) -> Iterator[bytes]:
+        """
+        Stream one member, compressing on the fly. size_hint only decides whether
+        the local header needs ZIP64 fields; pass None when the size is unknown.
+        """
+        name = arcname.encode("utf-8")
+        flags = _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8
+        method = METHOD_DEFLATED if compress else METHOD_STORED
+        dos_time, dos_date = _dos_datetime(mtime)
+        zip64 = size_hint is None or size_hint * 1.05 > _ZIP32_LIMIT
+        offset = self._offset
+
+        yield self._emit(self._local_header(name, flags, method, dos_time, dos_date, zip64))
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            out = compressor.compress(chunk) if compressor else chunk
+            if out:
+                compress_size += len(out)
+                yield self._emit(out)
+        if compressor:
+            out = compressor.flush()
+            if out:
+                compress_size += len(out)
+                yield self._emit(out)
+
+        if not zip64 and max(file_size, compress_size) > _ZIP32_LIMIT:
+            raise ValueError(f"{arcname}: member is larger than its declared size, cannot encode without ZIP64")
+
+        yield self._emit(self._data_descriptor(crc, compress_size, file_size, zip64))
+        self._records.append(_CentralRecord(name, flags, method, dos_time, dos_date, crc, compress_size, file_size, offset))
+
+    def write_raw_entry(
+        self,
+        arcname: str,
+        data: bytes,
+        crc: int,
+        file_size: int,
+        method: int,
+        mtime: datetime,
+    ) -> Iterator[bytes]:
+        """
+        Emit a member whose payload was already encoded elsewhere (e.g. a worker process).
+        """
+        name = arcname.encode("utf-8")
+        flags = _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8
+        dos_time, dos_date = _dos_datetime(mtime)
+        zip64 = max(file_size, len(data)) > _ZIP32_LIMIT
+        offset = self._offset
+
+        yield self._emit(self._local_header(name, flags, method, dos_time, dos_date, zip64))
+        if data:
+            yield self._emit(data)
+        yield self._emit(self._data_descriptor(crc, len(data), file_size, zip64))
+        self._records.append(_CentralRecord(name, flags, method, dos_time, dos_date, crc, len(data), file_size, offset))
+
+    def finish(self) -> Iterator[bytes]:
+        """
+        Emit the central directory and end-of-archive records.
+        """
+        cd_start = self._offset
+        for rec in self._records:
+            zip64_values = []
+            file_size = rec.file_size
+            compress_size = rec.compress_size
+            offset = rec.offset
+            # Order of ZIP64 extra values is fixed by the spec: size, compressed size, offset
+            if file_size > _ZIP32_LIMIT:
+                zip64_values.append(file_size)
+                file_size = _ZIP32_LIMIT
+            if compress_size > _ZIP32_LIMIT:
+                zip64_values.append(compress_size)
+                compress_size = _ZIP32_LIMIT
+            if offset > _ZIP32_LIMIT:
+                zip64_values.append(offset)
+                offset = _ZIP32_LIMIT
+
+            extra = b""
+            if zip64_values:
+                extra = struct.pack("<HH", _ZIP64_EXTRA_ID, 8 * len(zip64_values)) + struct.pack(f"<{len(zip64_values)}Q", *zip64_values)
+            version = 45 if zip64_values else 20
+
+            header = struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                _CENTRAL_HEADER_SIG, (3 << 8) | version, version, rec.flags, rec.method,
+                rec.dos_time, rec.dos_date, rec.crc, compress_size, file_size,
+                len(rec.name), len(extra), 0, 0, 0, (0o100644 << 16), offset
+            )
+            yield self._emit(header + rec.name + extra)
+
+        cd_size = self._offset - cd_start
+        count = len(self._records)
+
+        if count > _ZIP16_LIMIT or cd_start > _ZIP32_LIMIT or cd_size > _ZIP32_LIMIT:
+            zip64_eocd_offset = self._offset
+            yield self._emit(struct.pack(
+                "<IQHHIIQQQQ",
+                _ZIP64_EOCD_SIG, 44, (3 << 8) | 45, 45, 0, 0, count, count, cd_size, cd_start
+            ))
+            yield self._emit(struct.pack("<IIQI", _ZIP64_LOCATOR_SIG, 0, zip64_eocd_offset, 1))
+            yield self._emit(struct.pack(
+                "<IHHHHIIH",
+                _EOCD_SIG, 0, 0, min(count, _ZIP16_LIMIT), min(count, _ZIP16_LIMIT),
+                min(cd_size, _ZIP32_LIMIT), min(cd_start, _ZIP32_LIMIT), 0
+            ))
+        else:
+            yield self._emit(struct.pack("<IHHHHIIH", _EOCD_SIG, 0, 0, count, count, cd_size, cd_start, 0))
+
+def should_compress(name: str) -> bool:
+    ext = os.path.splitext(name)[1].lower().lstrip(".")
+    return ext not in STORED_EXTENSIONS
+
+def resolve_local_path(oss_key: str) -> Optional[str]:
+    """
+    ROBUST PATH RESOLUTION:
+    The file system may have double nesting (uploads/uploads/2026...), or the
+    oss_key may already be the full path relative to CWD.
+    """
+    local_path = os.path.join(UPLOAD_DIR, oss_key)
+    if os.path.exists(local_path):
+        return local_path
+    if os.path.exists(oss_key):
+        return oss_key
+    return None
+
+def collect_folder_entries(session: Session, perm_service: PermissionService, user: User, folder: Folder) -> List[ArchiveEntry]:
+    """
+    Walk the folder tree (depth-first, as the archive lists it) and return what the
+    user may read. All DB work happens here so streaming needs no session.
+    """
+    entries: List[ArchiveEntry] = []
+
+    def walk(folder_obj: Folder, current_path: str):
+        files = session.exec(select(Document).where(Document.folder_id == folder_obj.id, Document.is_deleted == False)).all()
+        for file in files:
+            local_path = resolve_local_path(file.oss_key)
+            size = os.path.getsize(local_path) if local_path else file.size
+            entries.append(ArchiveEntry(
+                arcname=f"{current_path}/{file.name}",
+                oss_key=file.oss_key,
+                local_path=local_path,
+                size=size,
+                mtime=file.updated_at or file.created_at or datetime.now(),
+                document_id=file.id,
+            ))
+
+        subfolders = session.exec(select(Folder).where(Folder.parent_id == folder_obj.id)).all()
+        for sub in subfolders:
+            if perm_service.check_permission(user, sub, 'read'):
+                walk(sub, f"{current_path}/{sub.name}")
+
+    walk(folder, folder.name)
+    return entries
+
+def _read_local(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            yield chunk
+
+def iter_entry_content(entry: ArchiveEntry) -> Optional[Iterator[bytes]]:
+    """
+    Chunk iterator over an entry's bytes from local disk or OSS, or None if missing.
+    """
+    if entry.local_path:
+        return _read_local(entry.local_path)
+    return StorageService.open_stream(entry.oss_key, READ_CHUNK_SIZE)
+
+def _is_prefetchable(entry: ArchiveEntry) -> bool:
+    return entry.local_path is None and entry.size <= PREFETCH_MAX_OBJECT_SIZE
+
+def _read_bounded(chunks: Iterator[bytes], limit: int) -> Tuple[bytes, Optional[Iterator[bytes]]]:
+    """
+    Read chunks until more than limit bytes have arrived.
+    Returns (content, None) if it fits, else (bytes read so far, rest of chunks).
+    """
+    buffered: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return b"".join(buffered), chunks
+    return b"".join(buffered), None
+
+# Returned by a prefetch fetch when the object is bigger than its recorded size allowed
+_TOO_LARGE = object()
+
+def _fetch_small(oss_key: str):
+    """
+    Prefetch worker: the whole object as bytes, None if missing, or _TOO_LARGE once
+    more than PREFETCH_MAX_OBJECT_SIZE bytes arrive (the download is abandoned).
+    """
+    chunks = StorageService.open_stream(oss_key, READ_CHUNK_SIZE)
+    if chunks is None:
+        return None
+    try:
+        data, rest = _read_bounded(chunks, PREFETCH_MAX_OBJECT_SIZE)
+    except Exception as e:
+        print(f"Storage Download Error for key {oss_key}: {e}")
+        return None
+    finally:
+        chunks.close()
+    return data if rest is None else _TOO_LARGE
+
+def prefetch_entries(
+    entries: Iterable[ArchiveEntry],
+    workers: int = PREFETCH_WORKERS,
+    max_inflight_bytes: int = PREFETCH_MAX_BYTES,
+) -> Iterator[Tuple[ArchiveEntry, Optional[Iterator[bytes]]]]:
+    """
+    Pair each entry with a content iterator, in input order.
+    Small OSS objects are fetched by a thread pool while earlier members are still
+    being written, hiding per-object round-trip latency. Fetched-but-unconsumed bytes
+    are capped by max_inflight_bytes: a fetch reserves the recorded document size and
+    is charged its real length once downloaded. Local files, large objects and objects
+    found to be larger than recorded are opened lazily when their turn comes.
+    """
+    source = iter(entries)
+    window: Deque[Tuple[ArchiveEntry, Optional[Future]]] = deque()
+    # Bound the look-ahead so a long run of non-prefetched entries cannot grow it forever
+    max_window = max(1, workers) * 4
+    inflight_bytes = 0
+    budget_lock = threading.Lock()
+    pending = 0
+    held: Optional[ArchiveEntry] = None  # Next entry, waiting for byte budget
+    exhausted = False
+
+    def fetch(entry: ArchiveEntry):
+        nonlocal inflight_bytes
+        data = _fetch_small(entry.oss_key)
+        # Replace the reservation with what is actually held
+        with budget_lock:
+            inflight_bytes += (len(data) if isinstance(data, bytes) else 0) - entry.size
+        return data
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="zip-prefetch")
+    try:
+        while True:
+            # Fill the window ahead of the writer
+            while len(window) < max_window and pending < max(1, workers):
+                if held is not None:
+                    entry, held = held, None
+                elif exhausted:
+                    break
+                else:
+                    try:
+                        entry = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                if not (workers > 0 and _is_prefetchable(entry)):
+                    window.append((entry, None))
+                    continue
+                with budget_lock:
+                    # Always allow one in flight so a small cap cannot stall the stream
+                    if pending and inflight_bytes + entry.size > max_inflight_bytes:
+                        held = entry
+                        break
+                    inflight_bytes += entry.size
+                pending += 1
+                window.append((entry, executor.submit(fetch, entry)))
+
+            if not window:
+                if held is None:
+                    return
+                continue
+
+            entry, future = window.popleft()
+            if future is None:
+                yield entry, iter_entry_content(entry)
+                continue
+
+            data = future.result()
+            pending -= 1
+            if data is _TOO_LARGE:
+                yield entry, iter_entry_content(entry)
+                continue
+            if data is not None:
+                with budget_lock:
+                    inflight_bytes -= len(data)
+            yield entry, (iter((data,)) if data is not None else None)
+    finally:
+        # Client went away or we finished: do not wait for (or start) remaining fetches
+        executor.shutdown(wait=False, cancel_futures=True)
+
+_compress_pool: Optional[ProcessPoolExecutor] = None
+_compress_pool_lock = threading.Lock()
+
+def _get_compress_pool() -> ProcessPoolExecutor:
+    """
+    One process pool for the whole API process, created on first use.
+    'spawn' avoids forking a process that already runs threads (uvicorn, prefetchers).
+    """
+    global _compress_pool
+    with _compress_pool_lock:
+        if _compress_pool is None:
+            _compress_pool = ProcessPoolExecutor(
+                max_workers=COMPRESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _compress_pool
+
+def _skip_missing(entry: ArchiveEntry, strict: bool) -> None:
+    if strict:
+        raise ArchiveIncomplete(f"File missing from storage: {entry.arcname}")
+    # Log missing file but DO NOT rename it to .txt
+    print(f"[Warning] File missing in Local & OSS during zip: {entry.arcname} (Key: {entry.oss_key})")
+
+def _stream_zip_inline(entries: Iterable[ArchiveEntry], writer: ZipStreamWriter, strict: bool) -> Iterator[bytes]:
+    for entry, content in prefetch_entries(entries):
+        if content is None:
+            _skip_missing(entry, strict)
+            continue
+        yield from writer.write_entry(
+            entry.arcname,
+            content,
+            entry.mtime,
+            compress=should_compress(entry.arcname),
+            size_hint=entry.size if entry.local_path else None,
+        )
+
+def _stream_zip_parallel(entries: Iterable[ArchiveEntry], writer: ZipStreamWriter, strict: bool) -> Iterator[bytes]:
+    """
+    Deflate compressible members in the process pool, several at once, and write
+    them strictly in input order. Stored and oversized members are written inline;
+    the queue is drained first so ordering is preserved.
+    """
+    pool = _get_compress_pool()
+    # (entry, size, future) in archive order
+    queue: Deque[Tuple[ArchiveEntry, int, Future]] = deque()
+    queued_bytes = 0
+    max_queue = COMPRESS_WORKERS * 2
+
+    def write_head() -> Iterator[bytes]:
+        nonlocal queued_bytes
+        entry, size, future = queue.popleft()
+        crc, compressed = future.result()
+        queued_bytes -= size
+        yield from writer.write_raw_entry(entry.arcname, compressed, crc, size, METHOD_DEFLATED, entry.mtime)
+
+    try:
+        for entry, content in prefetch_entries(entries):
+            if content is None:
+                _skip_missing(entry, strict)
+                continue
+
+            if not should_compress(entry.arcname) or entry.size > COMPRESS_MAX_MEMBER_SIZE:
+                while queue:
+                    yield from write_head()
+                yield from writer.write_entry(
+                    entry.arcname,
+                    content,
+                    entry.mtime,
+                    compress=should_compress(entry.arcname),
+                    size_hint=entry.size if entry.local_path else None,
+                )
+                continue
+
+            # The recorded size may be wrong: never buffer more than a worker member
+            data, rest = _read_bounded(iter(content), COMPRESS_MAX_MEMBER_SIZE)
+            if rest is not None:
+                while queue:
+                    yield from write_head()
+                yield from writer.write_entry(entry.arcname, itertools.chain((data,), rest), entry.mtime)
+                continue
+            # Keep the pool fed but bounded: write finished heads before queueing more
+            while queue and (len(queue) >= max_queue or queued_bytes + len(data) > COMPRESS_MAX_INFLIGHT_BYTES):
+                yield from write_head()
+            queue.append((entry, len(data), pool.submit(deflate_member, data)))
+            queued_bytes += len(data)
+
+        while queue:
+            yield from write_head()
+    finally:
+        for _, _, future in queue:
+            future.cancel()
+
+def stream_zip(entries: Iterable[ArchiveEntry], strict: bool = False) -> Iterator[bytes]:
+    """
+    Yield the archive incrementally. Memory stays bounded by the prefetch and
+    compression budgets plus the central directory, regardless of archive size.
+    Members missing from storage are skipped, or raise ArchiveIncomplete if strict.
+    """
+    writer = ZipStreamWriter()
+    if COMPRESS_WORKERS > 0:
+        yield from _stream_zip_parallel(entries, writer, strict)
+    else:
+        yield from _stream_zip_inline(entries, writer, strict)
+    yield from writer.finish()
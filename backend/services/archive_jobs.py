@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlmodel import Session, select
+from sqlalchemy import delete
+from models import ArchiveJob
+from services.archive import ArchiveEntry, ArchiveIncomplete, stream_zip
+from services.storage import StorageService
+
+ARCHIVE_CACHE_PREFIX = "archives/"
+# Archive builds are long-running; keep them off the request threadpool and bounded
+ARCHIVE_JOB_WORKERS = int(os.getenv("ZIP_JOB_WORKERS", "2"))
+# Jobs (and cached archives no other job uses) are removed this long after their last update
+ARCHIVE_JOB_TTL_HOURS = int(os.getenv("ZIP_JOB_TTL_HOURS", "24"))
+# Seconds between expiry sweeps; 0 disables the background sweeper
+ARCHIVE_SWEEP_INTERVAL = int(os.getenv("ZIP_JOB_SWEEP_INTERVAL", "3600"))
+EXPIRE_BATCH_SIZE = 500
+
+_executor = ThreadPoolExecutor(max_workers=ARCHIVE_JOB_WORKERS, thread_name_prefix="zip-job")
+# One build per fingerprint at a time within this process (striped by fingerprint)
+_build_locks = [threading.Lock() for _ in range(64)]
+
+def fingerprint_entries(folder_id: int, entries: List[ArchiveEntry]) -> str:
+    """
+    Content fingerprint of what this user would get in the archive.
+    entries are already filtered by the user's ACL, so two users who can read the
+    same documents share a cache entry, and any upload, edit, rename, move, delete
+    or permission change in the subtree produces a new fingerprint.
+    """
+    digest = hashlib.sha256(f"v1\t{folder_id}\n".encode("utf-8"))
+    for entry in entries:
+        line = f"{entry.document_id}\t{entry.mtime.isoformat()}\t{entry.size}\t{entry.oss_key}\t{entry.arcname}\n"
+        digest.update(line.encode("utf-8"))
+    return digest.hexdigest()
+
+def archive_key(fingerprint: str) -> str:
+    return f"{ARCHIVE_CACHE_PREFIX}{fingerprint}.zip"
+
+def create_job(session: Session, folder_id: int, user_id: int, entries: List[ArchiveEntry]) -> ArchiveJob:
+    """
+    Register a job and, unless a cached archive already exists, schedule the build.
+    """
+    fingerprint = fingerprint_entries(folder_id, entries)
+    oss_key = archive_key(fingerprint)
+
+    job = ArchiveJob(
+        id=uuid.uuid4().hex,
+        folder_id=folder_id,
+        user_id=user_id,
+        fingerprint=fingerprint,
+        oss_key=oss_key,
+    )
+    if StorageService.object_exists(oss_key):
+        job.status = "ready"
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+
+    if job.status != "ready":
+        _executor.submit(_run_job, job.id, oss_key, fingerprint, entries)
+    return job
+
+def _set_status(job_id: str, status: str, error: Optional[str] = None):
+    from database import engine
+
+    with Session(engine) as session:
+        job = session.get(ArchiveJob, job_id)
+        if not job:
+            return
+        job.status = status
+        job.error = error
+        job.updated_at = datetime.now()
+        session.add(job)
+        session.commit()
+
+def _run_job(job_id: str, oss_key: str, fingerprint: str, entries: List[ArchiveEntry]):
+    lock = _build_locks[int(fingerprint[:8], 16) % len(_build_locks)]
+    with lock:
+        try:
+            # Another job may have produced the same archive while we waited
+            if not StorageService.object_exists(oss_key):
+                _set_status(job_id, "running")
+                # Cached archives are reused by fingerprint, so a member missing
+                # from storage must fail the build instead of being skipped
+                missing: List[str] = []
+
+                def build():
+                    try:
+                        yield from stream_zip(entries, strict=True)
+                    except ArchiveIncomplete as e:
+                        missing.append(str(e))
+                        raise
+
+                if not StorageService.upload_stream(oss_key, build()):
+                    # Never leave anything under the cache key for the next job to reuse
+                    StorageService.delete_file(oss_key)
+                    _set_status(job_id, "failed", missing[0] if missing else "Failed to store archive")
+                    return
+            _set_status(job_id, "ready")
+        except Exception as e:
+            print(f"[ArchiveJob] {job_id} failed: {e}")
+            _set_status(job_id, "failed", str(e))
+
+def expire_jobs(session: Session, now: Optional[datetime] = None) -> int:
+    """
+    Delete jobs not updated for ARCHIVE_JOB_TTL_HOURS, and the cached archives of
+    those jobs that no remaining job points at. Returns how many jobs were deleted.
+    """
+    cutoff = (now or datetime.now()) - timedelta(hours=ARCHIVE_JOB_TTL_HOURS)
+    total = 0
+    while True:
+        rows = session.exec(
+            # Any status: a pending/running job this old was lost with its process
+            select(ArchiveJob.id, ArchiveJob.oss_key)
+            .where(ArchiveJob.updated_at < cutoff)
+            .limit(EXPIRE_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return total
+        session.exec(delete(ArchiveJob).where(ArchiveJob.id.in_([job_id for job_id, _ in rows])))
+        session.commit()
+        total += len(rows)
+
+        keys = {oss_key for _, oss_key in rows if oss_key}
+        if keys:
+            # A newer job for the same fingerprint keeps the archive
+            keys -= set(session.exec(select(ArchiveJob.oss_key).where(ArchiveJob.oss_key.in_(keys))).all())
+        for key in keys:
+            StorageService.delete_file(key)
+
+def _sweep_loop(stop: threading.Event):
+    from database import engine
+
+    while not stop.wait(ARCHIVE_SWEEP_INTERVAL):
+        try:
+            with Session(engine) as session:
+                expired = expire_jobs(session)
+            if expired:
+                print(f"[ArchiveJob] Expired {expired} jobs")
+        except Exception as e:
+            print(f"[ArchiveJob] Expiry sweep failed: {e}")
+
+_sweeper: Optional[threading.Thread] = None
+_sweeper_stop = threading.Event()
+
+def start_sweeper():
+    """
+    Run expire_jobs every ARCHIVE_SWEEP_INTERVAL seconds on a daemon thread.
+    """
+    global _sweeper
+    if ARCHIVE_SWEEP_INTERVAL <= 0 or (_sweeper and _sweeper.is_alive()):
+        return
+    _sweeper_stop.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, args=(_sweeper_stop,), name="zip-job-sweeper", daemon=True)
+    _sweeper.start()
+
+def stop_sweeper():
+    _sweeper_stop.set()
@@ -0,0 +1,455 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sqlmodel import Session, select
+from sqlalchemy import delete, insert, update
+from models import (ArchiveJob, Collaborator, Department, Document, Folder, Project,
+                    ProjectMember, Role, SpaceType, User)
+from services.permission import PermissionService
+from services.blob import BlobService
+from services.ingest import writable_folders, taken_names
+
+# Items (folders + documents) per batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+# Documents one folder copy may create
+COPY_MAX_DOCUMENTS = int(os.getenv("COPY_MAX_DOCUMENTS", "20000"))
+
+class BatchError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class ItemResult:
+    type: str  # "folder" / "document"
+    id: int
+    status_code: int = 200
+    error: Optional[str] = None
+    new_id: Optional[int] = None  # copies
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def fail(self, status_code: int, error: str):
+        self.status_code = status_code
+        self.error = error
+
+# --- Tree queries ---
+
+def subtree_query(root_ids):
+    """
+    SELECT of the ids of root_ids and all their descendants (recursive CTE),
+    for use in IN (...) subqueries. UNION (not UNION ALL) stops on cycles.
+    """
+    tree = select(Folder.id).where(Folder.id.in_(root_ids)).cte("subtree", recursive=True)
+    tree = tree.union(select(Folder.id).join(tree, Folder.parent_id == tree.c.id))
+    return select(tree.c.id)
+
+def ancestor_ids(session: Session, folder_id: int) -> Set[int]:
+    """
+    folder_id and every folder above it.
+    """
+    up = select(Folder.id, Folder.parent_id).where(Folder.id == folder_id).cte("ancestors", recursive=True)
+    up = up.union(select(Folder.id, Folder.parent_id).join(up, Folder.id == up.c.parent_id))
+    return set(session.exec(select(up.c.id)).all())
+
+def system_folder_ids(session: Session, folder_ids: Set[int]) -> Set[int]:
+    """
+    Space roots, project roots and department roots: never moved or deleted as items.
+    """
+    if not folder_ids:
+        return set()
+    ids = set(session.exec(select(Folder.id).where(Folder.id.in_(folder_ids), Folder.parent_id == None)).all())
+    ids.update(session.exec(select(Project.root_folder_id).where(Project.root_folder_id.in_(folder_ids))).all())
+    ids.update(session.exec(select(Department.root_folder_id).where(Department.root_folder_id.in_(folder_ids))).all())
+    return ids
+
+def _unique_name(name: str, taken: Set[str]) -> str:
+    """
+    name, or "stem (n).ext" for the first n that is free.
+    """
+    if name not in taken:
+        return name
+    stem, ext = os.path.splitext(name)
+    n = 1
+    while f"{stem} ({n}){ext}" in taken:
+        n += 1
+    return f"{stem} ({n}){ext}"
+
+def _inherited_department(target: Folder) -> Optional[int]:
+    if str(target.space_type).lower() == SpaceType.DEPARTMENT.value:
+        return target.department_id
+    return None
+
+# --- Screening ---
+
+class _Selection:
+    """
+    The requested folders and live documents, loaded in one query each, with
+    one result per requested id (request order, folders first).
+    """
+    def __init__(self, session: Session, folder_ids: List[int], document_ids: List[int]):
+        folder_ids = list(dict.fromkeys(folder_ids))
+        document_ids = list(dict.fromkeys(document_ids))
+        if len(folder_ids) + len(document_ids) > BATCH_MAX_ITEMS:
+            raise BatchError(400, f"At most {BATCH_MAX_ITEMS} items per request")
+        self.folders: Dict[int, Folder] = {}
+        self.documents: Dict[int, Document] = {}
+        if folder_ids:
+            self.folders = {f.id: f for f in session.exec(select(Folder).where(Folder.id.in_(folder_ids))).all()}
+        if document_ids:
+            self.documents = {d.id: d for d in session.exec(select(Document).where(
+                Document.id.in_(document_ids), Document.is_deleted == False
+            )).all()}
+        self.folder_results = [ItemResult("folder", fid) for fid in folder_ids]
+        self.document_results = [ItemResult("document", did) for did in document_ids]
+        for r in self.folder_results:
+            if r.id not in self.folders:
+                r.fail(404, "Folder not found")
+        for r in self.document_results:
+            if r.id not in self.documents:
+                r.fail(404, "Document not found")
+
+    @property
+    def results(self) -> List[ItemResult]:
+        return self.folder_results + self.document_results
+
+    def check_folders(self, session: Session, user: User, action: str):
+        pending = {r.id for r in self.folder_results if r.ok}
+        if action == 'write':
+            allowed, _ = writable_folders(session, user, pending)
+        else:
+            perm_service = PermissionService(session)
+            allowed = {fid: f for fid, f in self.folders.items()
+                       if fid in pending and perm_service.check_permission(user, f, 'read')}
+        for r in self.folder_results:
+            if r.ok and r.id not in allowed:
+                r.fail(403, "Permission denied")
+
+    def check_documents(self, session: Session, user: User, action: str):
+        docs = [self.documents[r.id] for r in self.document_results if r.ok]
+        allowed = PermissionService(session).check_documents(user, docs, action) if docs else {}
+        for r in self.document_results:
+            if r.ok and not allowed.get(r.id):
+                r.fail(403, "Permission denied")
+
+    def reject_system_folders(self, session: Session, error: str):
+        system = system_folder_ids(session, {r.id for r in self.folder_results if r.ok})
+        for r in self.folder_results:
+            if r.ok and r.id in system:
+                r.fail(400, error)
+
+def _writable_target(session: Session, user: User, target_id: int) -> Folder:
+    allowed, denied = writable_folders(session, user, {target_id})
+    if target_id in denied:
+        raise BatchError(403, "No write permission on target folder")
+    if target_id not in allowed:
+        raise BatchError(404, "Target folder not found")
+    return allowed[target_id]
+
+def _child_folder_names(session: Session, parent_id: int) -> Set[str]:
+    return set(session.exec(select(Folder.name).where(Folder.parent_id == parent_id)).all())
+
+def _document_names(session: Session, folder_id: int) -> Set[str]:
+    return set(session.exec(select(Document.name).where(
+        Document.folder_id == folder_id, Document.is_deleted == False
+    )).all())
+
+# --- Move ---
+
+def move_items(session: Session, user: User, target_id: int,
+               folder_ids: List[int], document_ids: List[int]) -> List[ItemResult]:
+    """
+    Move folders and documents into target in one transaction.
+    Moved subtrees take on the target's space (and department), like new folders do.
+    """
+    target = _writable_target(session, user, target_id)
+    sel = _Selection(session, folder_ids, document_ids)
+    sel.check_folders(session, user, 'write')
+    sel.check_documents(session, user, 'write')
+    sel.reject_system_folders(session, "System folders cannot be moved")
+
+    # Folders: no cycles, no name clashes among the target's children
+    above_target = ancestor_ids(session, target.id)
+    names = _child_folder_names(session, target.id)
+    moved_folders = []
+    for r in sel.folder_results:
+        if not r.ok:
+            continue
+        folder = sel.folders[r.id]
+        if folder.id in above_target:
+            r.fail(400, "Cannot move a folder into itself or its subfolder")
+        elif folder.parent_id == target.id:
+            continue  # already there
+        elif folder.name in names:
+            r.fail(409, "Folder with this name already exists in target")
+        else:
+            names.add(folder.name)
+            moved_folders.append(folder.id)
+
+    # Documents: one duplicate-name query for the whole batch
+    pending = [sel.documents[r.id] for r in sel.document_results if r.ok]
+    taken = taken_names(session, {target.id}, {d.name for d in pending})
+    moved_documents = []
+    for r in sel.document_results:
+        if not r.ok:
+            continue
+        doc = sel.documents[r.id]
+        if doc.folder_id == target.id:
+            continue
+        if (target.id, doc.name) in taken:
+            r.fail(409, "File with this name already exists in target")
+        else:
+            taken.add((target.id, doc.name))
+            moved_documents.append(doc.id)
+
+    now = datetime.now()
+    if moved_folders:
+        session.exec(
+            update(Folder).where(Folder.id.in_(moved_folders))
+            .values(parent_id=target.id, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        values = {"space_type": target.space_type, "department_id": _inherited_department(target)}
+        if target.is_restricted:
+            values["is_restricted"] = True
+        session.exec(
+            update(Folder).where(Folder.id.in_(subtree_query(moved_folders)))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    if moved_documents:
+        session.exec(
+            update(Document).where(Document.id.in_(moved_documents))
+            .values(folder_id=target.id, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    if target.is_restricted and (moved_folders or moved_documents):
+        # Documents are checked on their own flag: force it, as uploads into a restricted folder do
+        session.exec(
+            update(Document).where(
+                Document.id.in_(moved_documents) | Document.folder_id.in_(subtree_query(moved_folders))
+            )
+            .values(is_restricted=True)
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+    return sel.results
+
+# --- Copy ---
+
+def copy_folder_tree(session: Session, user: User, source: Folder, target: Folder,
+                     name: Optional[str] = None) -> Tuple[Folder, int, int]:
+    """
+    Duplicate source (and everything below it the user can read) under target.
+    New rows share the existing objects: no bytes are copied, blob references
+    are taken in bulk. Caller commits.
+    Returns (new root folder, folders created, documents created).
+    """
+    if source.id in ancestor_ids(session, target.id):
+        raise BatchError(400, "Cannot copy a folder into itself or its subfolder")
+
+    perm_service = PermissionService(session)
+    folders = session.exec(select(Folder).where(Folder.id.in_(subtree_query([source.id])))).all()
+    children: Dict[int, List[Folder]] = {}
+    for folder in folders:
+        if folder.id != source.id:
+            children.setdefault(folder.parent_id, []).append(folder)
+
+    # Breadth-first, one list per depth; unreadable folders are skipped with their subtree
+    levels = [[source]]
+    while True:
+        next_level = [
+            child
+            for folder in levels[-1]
+            for child in sorted(children.get(folder.id, []), key=lambda f: f.id)
+            if perm_service.check_permission(user, child, 'read')
+        ]
+        if not next_level:
+            break
+        levels.append(next_level)
+
+    kept_ids = [f.id for level in levels for f in level]
+    documents = []
+    for j in range(0, len(kept_ids), 500):
+        documents.extend(session.exec(select(Document).where(
+            Document.folder_id.in_(kept_ids[j:j + 500]), Document.is_deleted == False
+        )).all())
+    readable = perm_service.check_documents(user, documents, 'read')
+    documents = [d for d in documents if readable.get(d.id)]
+    if len(documents) > COPY_MAX_DOCUMENTS:
+        raise BatchError(413, f"At most {COPY_MAX_DOCUMENTS} documents per copy")
+
+    department_id = _inherited_department(target)
+    now = datetime.now()
+    id_map: Dict[int, int] = {}
+    restricted: Dict[int, bool] = {}  # source folder id -> is its copy restricted
+    root_name = name or _unique_name(source.name, _child_folder_names(session, target.id))
+
+    # One flush per tree level: inserts are batched and the new ids are known for the next level
+    for level in levels:
+        rows = [Folder(
+            name=root_name if folder.id == source.id else folder.name,
+            parent_id=target.id if folder.id == source.id else id_map[folder.parent_id],
+            space_type=target.space_type,
+            department_id=department_id,
+            is_restricted=folder.is_restricted or target.is_restricted,
+            owner_id=user.id,
+            created_at=now,
+            updated_at=now,
+        ) for folder in level]
+        session.add_all(rows)
+        session.flush()
+        for folder, row in zip(level, rows):
+            id_map[folder.id] = row.id
+            restricted[folder.id] = row.is_restricted
+
+    # Document ids are not needed, so skip the ORM: one executemany per chunk
+    rows = [dict(
+        name=doc.name,
+        oss_key=doc.oss_key,
+        file_type=doc.file_type,
+        size=doc.size,
+        content_hash=doc.content_hash,
+        is_deleted=False,
+        is_restricted=doc.is_restricted or restricted[doc.folder_id],
+        folder_id=id_map[doc.folder_id],
+        author_id=user.id,
+        created_at=now,
+        updated_at=now,
+    ) for doc in documents]
+    for j in range(0, len(rows), 1000):
+        session.exec(insert(Document), params=rows[j:j + 1000])
+    BlobService(session).acquire_many(row["oss_key"] for row in rows)
+    return session.get(Folder, id_map[source.id]), len(id_map), len(rows)
+
+def copy_items(session: Session, user: User, target_id: int,
+               folder_ids: List[int], document_ids: List[int]) -> List[ItemResult]:
+    """
+    Copy folders (whole subtrees) and documents into target in one transaction.
+    Copies share the originals' objects. Name clashes get a " (n)" suffix.
+    """
+    target = _writable_target(session, user, target_id)
+    sel = _Selection(session, folder_ids, document_ids)
+    sel.check_folders(session, user, 'read')
+    sel.check_documents(session, user, 'read')
+
+    folder_names = _child_folder_names(session, target.id)
+    for r in sel.folder_results:
+        if not r.ok:
+            continue
+        source = sel.folders[r.id]
+        try:
+            with session.begin_nested():
+                name = _unique_name(source.name, folder_names)
+                new_root, _, _ = copy_folder_tree(session, user, source, target, name=name)
+        except BatchError as e:
+            r.fail(e.status_code, e.detail)
+            continue
+        folder_names.add(name)
+        r.new_id = new_root.id
+
+    doc_names = _document_names(session, target.id)
+    copies = []
+    for r in sel.document_results:
+        if not r.ok:
+            continue
+        doc = sel.documents[r.id]
+        name = _unique_name(doc.name, doc_names)
+        doc_names.add(name)
+        copies.append((r, Document(
+            name=name,
+            oss_key=doc.oss_key,
+            file_type=doc.file_type,
+            size=doc.size,
+            content_hash=doc.content_hash,
+            is_restricted=doc.is_restricted or target.is_restricted,
+            folder_id=target.id,
+            author_id=user.id,
+        )))
+    if copies:
+        session.add_all([copy for _, copy in copies])
+        session.flush()
+        BlobService(session).acquire_many(copy.oss_key for _, copy in copies)
+        for r, copy in copies:
+            r.new_id = copy.id
+    session.commit()
+    return sel.results
+
+# --- Delete ---
+
+def delete_folder_trees(session: Session, user: User, folder_ids: List[int]) -> int:
+    """
+    Delete folders and their subtrees with set-based statements instead of ORM
+    cascades (which load every row first). Live documents go to the trash, so
+    their blobs are released later by the trash sweeper rather than inline.
+    Every document left in the subtree loses its folder_id (the id may be reused)
+    and keeps the folder name in deleted_from; restoring it needs a new folder.
+    Collaborator rows, archive jobs and projects rooted inside the subtree are
+    deleted with the folders. Caller commits.
+    Returns the number of folders deleted.
+    """
+    if not folder_ids:
+        return 0
+    subtree = subtree_query(folder_ids)
+    ids = list(session.exec(subtree).all())
+    session.exec(
+        update(Document).where(Document.folder_id.in_(subtree), Document.is_deleted == False)
+        .values(is_deleted=True, deleted_at=datetime.now(), deleted_by=user.id)
+        .execution_options(synchronize_session=False)
+    )
+    session.exec(
+        update(Document).where(Document.folder_id.in_(subtree))
+        .values(
+            deleted_from=select(Folder.name).where(Folder.id == Document.folder_id).scalar_subquery(),
+            folder_id=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    for j in range(0, len(ids), 500):
+        chunk = ids[j:j + 500]
+        project_ids = session.exec(select(Project.id).where(Project.root_folder_id.in_(chunk))).all()
+        if project_ids:
+            session.exec(delete(ProjectMember).where(ProjectMember.project_id.in_(project_ids)).execution_options(synchronize_session=False))
+            session.exec(delete(Project).where(Project.id.in_(project_ids)).execution_options(synchronize_session=False))
+        session.exec(
+            update(Department).where(Department.root_folder_id.in_(chunk))
+            .values(root_folder_id=None).execution_options(synchronize_session=False)
+        )
+        session.exec(delete(Collaborator).where(Collaborator.folder_id.in_(chunk)).execution_options(synchronize_session=False))
+        session.exec(delete(ArchiveJob).where(ArchiveJob.folder_id.in_(chunk)).execution_options(synchronize_session=False))
+        session.exec(delete(Folder).where(Folder.id.in_(chunk)).execution_options(synchronize_session=False))
+    return len(ids)
+
+def delete_items(session: Session, user: User, folder_ids: List[int], document_ids: List[int]) -> List[ItemResult]:
+    """
+    Delete folders (with their contents) and move documents to the trash, in one
+    transaction, under the same safe-deletion policy as the single-item endpoints.
+    """
+    sel = _Selection(session, folder_ids, document_ids)
+    sel.check_folders(session, user, 'write')
+    sel.check_documents(session, user, 'write')
+    sel.reject_system_folders(session, "System folders cannot be deleted")
+
+    is_admin = user.role in [Role.SUPER_ADMIN, Role.MANAGER]
+    if not is_admin:
+        for r in sel.folder_results:
+            if r.ok and sel.folders[r.id].owner_id != user.id:
+                r.fail(403, "Safe Deletion: You can only delete your own folders.")
+        for r in sel.document_results:
+            if r.ok and sel.documents[r.id].author_id != user.id:
+                r.fail(403, "Safe Deletion: You can only delete your own files.")
+
+    delete_folder_trees(session, user, [r.id for r in sel.folder_results if r.ok])
+    doc_ids = [r.id for r in sel.document_results if r.ok]
+    if doc_ids:
+        session.exec(
+            update(Document).where(Document.id.in_(doc_ids), Document.is_deleted == False)
+            .values(is_deleted=True, deleted_at=datetime.now(), deleted_by=user.id)
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+    return sel.results
@@ -0,0 +1,232 @@
+from sqlmodel import Session, select
+from sqlalchemy import update, func
+from sqlalchemy.exc import IntegrityError
+from models import Blob, Document, User
+from services.storage import StorageService
+from services.preview import delete_renditions
+from services.permission import PermissionService
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+class BlobService:
+    """
+    Refcounted, content-addressed blobs.
+    Every Document that points at a managed oss_key holds one reference on its Blob.
+    Callers own the transaction: nothing here commits, except release() and
+    release_many() which have to delete objects only after the row change is durable.
+    """
+    def __init__(self, session: Session):
+        self.session = session
+
+    def find_reusable(self, content_hash: str, size: int, user: Optional[User] = None) -> Optional[Blob]:
+        """
+        Look up a live blob with the same content.
+        Size is matched as well so a bare hash is not enough to claim an object.
+        With user (hash declared by a client that has not sent the bytes), only
+        blobs that user can already read qualify, see readable_keys.
+        """
+        if not content_hash:
+            return None
+        stmt = select(Blob).where(
+            Blob.content_hash == content_hash.lower(),
+            Blob.size == size,
+            Blob.ref_count > 0
+        )
+        blobs = self.session.exec(stmt).all()
+        if user is not None and blobs:
+            readable = self.readable_keys(user, [b.oss_key for b in blobs])
+            blobs = [b for b in blobs if b.oss_key in readable]
+        return blobs[0] if blobs else None
+
+    def find_reusable_many(self, candidates: Iterable[Tuple[str, int]],
+                           user: Optional[User] = None) -> Dict[Tuple[str, int], Blob]:
+        """
+        find_reusable for many (content_hash, size) pairs in one query
+        (plus one for the readability check when user is given).
+        """
+        wanted = {(h.lower(), size) for h, size in candidates if h}
+        if not wanted:
+            return {}
+        stmt = select(Blob).where(
+            Blob.content_hash.in_({h for h, _ in wanted}),
+            Blob.ref_count > 0
+        )
+        blobs = [b for b in self.session.exec(stmt).all() if (b.content_hash, b.size) in wanted]
+        if user is not None and blobs:
+            readable = self.readable_keys(user, [b.oss_key for b in blobs])
+            blobs = [b for b in blobs if b.oss_key in readable]
+        found: Dict[Tuple[str, int], Blob] = {}
+        for blob in blobs:
+            found.setdefault((blob.content_hash, blob.size), blob)
+        return found
+
+    def readable_keys(self, user: User, oss_keys: Iterable[str]) -> Set[str]:
+        """
+        The keys that user can already read through some live document.
+        Linking existing content on a client-declared hash is only safe for these:
+        otherwise knowing a file's SHA-256 would be enough to get a copy of it.
+        """
+        keys = set(oss_keys)
+        if not keys:
+            return set()
+        docs = self.session.exec(select(Document).where(
+            Document.oss_key.in_(keys),
+            Document.is_deleted == False
+        )).all()
+        allowed = PermissionService(self.session).check_documents(user, docs, 'read')
+        return {doc.oss_key for doc in docs if allowed.get(doc.id)}
+
+    def acquire(self, oss_key: str, content_hash: str, size: int) -> None:
+        """
+        Add one reference to oss_key, registering the blob on first use.
+        """
+        result = self.session.exec(
+            update(Blob).where(Blob.oss_key == oss_key).values(ref_count=Blob.ref_count + 1)
+        )
+        if result.rowcount:
+            return
+
+        # First reference. Another request may register the same key concurrently,
+        # so insert inside a savepoint and fall back to the increment on conflict.
+        try:
+            with self.session.begin_nested():
+                self.session.add(Blob(
+                    oss_key=oss_key,
+                    content_hash=content_hash.lower(),
+                    size=size,
+                    ref_count=1
+                ))
+        except IntegrityError:
+            self.session.exec(
+                update(Blob).where(Blob.oss_key == oss_key).values(ref_count=Blob.ref_count + 1)
+            )
+
+    def acquire_many(self, oss_keys: Iterable[str]) -> None:
+        """
+        One more reference for each item (a key may repeat) on blobs that are
+        already registered, for rows that share existing objects (copies).
+        Unregistered keys are left alone: their hash was never verified, and
+        release() keeps any object a Document still points at.
+        """
+        counts: Dict[str, int] = {}
+        for key in oss_keys:
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+        for key, n in counts.items():
+            self.session.exec(
+                update(Blob).where(Blob.oss_key == key).values(ref_count=Blob.ref_count + n)
+            )
+
+    def release(self, oss_key: str) -> bool:
+        """
+        Drop one reference to oss_key and commit.
+        Call after the Document row holding the reference is gone.
+        The object is deleted from storage only when no reference is left.
+        Returns True if the object was garbage-collected.
+        """
+        self.session.exec(
+            update(Blob).where(Blob.oss_key == oss_key, Blob.ref_count > 0).values(ref_count=Blob.ref_count - 1)
+        )
+        blob = self.session.exec(select(Blob).where(Blob.oss_key == oss_key)).first()
+
+        if blob is None:
+            # Legacy object that was never registered: it belongs to its documents alone.
+            remaining = self.session.exec(
+                select(func.count()).select_from(Document).where(Document.oss_key == oss_key)
+            ).one()
+            self.session.commit()
+            if remaining:
+                return False
+            delete_renditions(oss_key)
+            return StorageService.delete_file(oss_key)
+
+        if blob.ref_count > 0:
+            self.session.commit()
+            return False
+
+        self.session.delete(blob)
+        # Copies made before the blob was registered share the key without a reference
+        remaining = self.session.exec(
+            select(func.count()).select_from(Document).where(Document.oss_key == oss_key)
+        ).one()
+        self.session.commit()
+        if remaining:
+            return False
+        delete_renditions(oss_key)
+        return StorageService.delete_file(oss_key)
+
+    def release_many(self, oss_keys: Iterable[str]) -> Tuple[int, int]:
+        """
+        release() for many references at once (one per item, so a key may repeat),
+        committed together with whatever the caller has pending in the session.
+        Call after the Document rows holding the references are gone (same transaction).
+        Returns (references dropped, objects garbage-collected).
+        """
+        counts: Dict[str, int] = {}
+        for key in oss_keys:
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+        if not counts:
+            self.session.commit()
+            return 0, 0
+
+        keys = list(counts)
+        # Decrement in SQL so concurrent acquire() increments are not lost
+        for key, n in counts.items():
+            self.session.exec(
+                update(Blob).where(Blob.oss_key == key, Blob.ref_count > 0)
+                .values(ref_count=func.max(Blob.ref_count - n, 0))
+            )
+        stmt = select(Blob).where(Blob.oss_key.in_(keys)).execution_options(populate_existing=True)
+        blobs = {b.oss_key: b for b in self.session.exec(stmt).all()}
+        unreferenced = []
+        for key, blob in blobs.items():
+            if blob.ref_count <= 0:
+                self.session.delete(blob)
+                unreferenced.append(key)
+
+        # Legacy objects that were never registered belong to their documents alone,
+        # and a released blob may still be shared by copies that hold no reference
+        unreferenced.extend(key for key in keys if key not in blobs)
+        collect = []
+        if unreferenced:
+            still_used = set(self.session.exec(
+                select(Document.oss_key).where(Document.oss_key.in_(unreferenced))
+            ).all())
+            collect = [key for key in unreferenced if key not in still_used]
+        self.session.commit()
+
+        removed = 0
+        for key in collect:
+            delete_renditions(key)
+            if StorageService.delete_file(key):
+                removed += 1
+        return sum(counts.values()), removed
+
+def verify_and_register(document_id: int) -> None:
+    """
+    Background step after a direct upload: hash the stored object and register it.
+    The client-declared hash and size are only hints; dedup matches are made against
+    these server-computed values, so a wrong hint cannot poison the blob table.
+    """
+    from database import engine
+
+    with Session(engine) as session:
+        doc = session.get(Document, document_id)
+        if not doc:
+            return
+        verified = StorageService.compute_sha256(doc.oss_key)
+        if verified is None:
+            print(f"[Blob] Could not hash {doc.oss_key} for document {document_id}")
+            return
+        actual_hash, actual_size = verified
+        if doc.content_hash and doc.content_hash.lower() != actual_hash:
+            print(f"[Blob] Declared hash mismatch for document {document_id}, using stored content hash")
+        if doc.size != actual_size:
+            print(f"[Blob] Declared size mismatch for document {document_id}, using stored object size")
+        doc.content_hash = actual_hash
+        doc.size = actual_size
+        session.add(doc)
+        BlobService(session).acquire(doc.oss_key, actual_hash, actual_size)
+        # A retried completion may find the blob already registered with the declared size
+        session.exec(update(Blob).where(Blob.oss_key == doc.oss_key).values(size=actual_size))
+        session.commit()
@@ -0,0 +1,62 @@
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+from fastapi import Request
+from fastapi.responses import Response
+
+# Opt-in compact format for large list responses. Instead of repeating every key
+# per row, each field becomes one column array; columns with few distinct strings
+# (or repeated nested values like ancestors) are dictionary-encoded:
+#   {"count": 2, "columns": [
+#       {"name": "id", "values": [1, 2]},
+#       {"name": "space_type", "dictionary": ["public"], "indices": [0, 0]}]}
+# A null in indices is a null value. Clients ask for it with the Accept header.
+COLUMNAR_MEDIA_TYPE = "application/vnd.sdh.columnar+json"
+
+def wants_columnar(request: Request) -> bool:
+    return COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _to_dict(item: Any) -> Dict[str, Any]:
+    if isinstance(item, Mapping):
+        return dict(item)
+    # Pydantic / SQLModel objects, dumped JSON-ready (datetimes as ISO strings)
+    return item.model_dump(mode="json")
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def _encode_column(name: str, values: List[Any]) -> Dict[str, Any]:
+    # Only strings and nested values are worth a dictionary: ids/sizes rarely repeat
+    if not any(isinstance(v, (str, list, dict)) for v in values):
+        return {"name": name, "values": values}
+    dictionary: List[Any] = []
+    codes: Dict[Any, int] = {}
+    indices: List[Optional[int]] = []
+    for value in values:
+        if value is None:
+            indices.append(None)
+            continue
+        key = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=_json_default)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(dictionary)
+            dictionary.append(value)
+        indices.append(code)
+    if len(dictionary) * 2 > len(values):
+        return {"name": name, "values": values}
+    return {"name": name, "dictionary": dictionary, "indices": indices}
+
+def encode_columnar(items: Iterable[Any]) -> Dict[str, Any]:
+    rows = [_to_dict(item) for item in items]
+    names: Dict[str, None] = {}
+    for row in rows:
+        for key in row:
+            names.setdefault(key, None)
+    columns = [_encode_column(name, [row.get(name) for row in rows]) for name in names]
+    return {"count": len(rows), "columns": columns}
+
+def columnar_response(items: Iterable[Any], headers: Optional[Mapping[str, str]] = None) -> Response:
+    body = json.dumps(encode_columnar(items), ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    return Response(content=body, media_type=COLUMNAR_MEDIA_TYPE, headers=dict(headers or {}))
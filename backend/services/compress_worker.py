@@ -0,0 +1,11 @@
+import zlib
+from typing import Tuple
+
+# Kept free of app imports: this module is loaded in every compression worker process.
+
+def deflate_member(data: bytes, level: int = 6) -> Tuple[int, bytes]:
+    """
+    Raw-deflate one archive member. Returns (crc32, compressed bytes).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
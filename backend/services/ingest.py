@@ -0,0 +1,341 @@
+import hashlib
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from sqlmodel import Session, select
+from models import User, Folder, Document, SpaceType
+from services.permission import PermissionService
+from services.blob import BlobService
+from services.storage import StorageService
+
+# One bulk request: at most this many files / uncompressed bytes
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "1000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Concurrent hash / storage uploads per request
+BULK_UPLOAD_WORKERS = int(os.getenv("BULK_UPLOAD_WORKERS", "8"))
+# Files up to this size are uploaded as one body (retried on transient errors), larger ones streamed
+BULK_BUFFER_MAX_SIZE = 32 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Archive noise that should not become documents
+IGNORED_NAMES = {".DS_Store", "Thumbs.db", "desktop.ini"}
+IGNORED_DIRS = {"__MACOSX"}
+
+class IngestError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class IngestItem(NamedTuple):
+    dirs: Tuple[str, ...]   # folder names below the target folder
+    name: str
+    size: int
+    open: Callable[[], BinaryIO]  # fresh reader positioned at the start
+
+class _Prepared(NamedTuple):
+    item: IngestItem
+    content_hash: str
+    size: int
+
+def split_relative_path(path: str) -> Optional[Tuple[Tuple[str, ...], str]]:
+    """
+    'a/b/c.txt' -> (('a', 'b'), 'c.txt'). Backslashes count as separators.
+    None for paths that escape the target ('..'), are absolute-only, or are ignorable noise.
+    """
+    parts = [p for p in path.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    if parts[-1] in IGNORED_NAMES or parts[-1].startswith("._") or any(p in IGNORED_DIRS for p in parts):
+        return None
+    return tuple(parts[:-1]), parts[-1]
+
+def _zip_member_name(info: zipfile.ZipInfo) -> str:
+    # Without the UTF-8 flag zipfile decodes names as cp437; archives made on
+    # Chinese Windows use GBK, so try that before accepting mojibake.
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+class _BoundedReader:
+    """
+    Reader that refuses to produce more than the declared size (lying zip headers).
+    """
+    def __init__(self, f: BinaryIO, limit: int):
+        self.f = f
+        self.remaining = limit
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size if size >= 0 else -1)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise IngestError(400, "Archive member is larger than declared")
+        return data
+
+    def close(self):
+        self.f.close()
+
+def items_from_zip(zf: zipfile.ZipFile) -> List[IngestItem]:
+    items = []
+    total = 0
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        split = split_relative_path(_zip_member_name(info))
+        if split is None:
+            continue
+        total += info.file_size
+        if total > BULK_MAX_BYTES:
+            raise IngestError(413, "Archive is too large")
+        dirs, name = split
+        items.append(IngestItem(dirs, name, info.file_size,
+                                lambda info=info: _BoundedReader(zf.open(info), info.file_size)))
+    return items
+
+class _SpoolReader:
+    """
+    Read view over an uploaded file's spool that can be opened several times
+    (hashing, then upload) without closing the underlying file.
+    """
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.f.seek(0)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.f.read(size)
+
+    def close(self):
+        pass
+
+def items_from_files(files: List[Tuple[str, BinaryIO]]) -> List[IngestItem]:
+    """
+    (relative path, file object) pairs from a multipart batch.
+    """
+    items = []
+    for path, f in files:
+        split = split_relative_path(path)
+        if split is None:
+            continue
+        f.seek(0, os.SEEK_END)
+        dirs, name = split
+        items.append(IngestItem(dirs, name, f.tell(), lambda f=f: _SpoolReader(f)))
+    return items
+
+def _read_chunks(item: IngestItem) -> Iterator[bytes]:
+    f = item.open()
+    try:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            yield chunk
+    finally:
+        f.close()
+
+def _hash_item(item: IngestItem) -> _Prepared:
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in _read_chunks(item):
+        digest.update(chunk)
+        size += len(chunk)
+    return _Prepared(item, digest.hexdigest(), size)
+
+def _upload_item(oss_key: str, prepared: _Prepared) -> bool:
+    if prepared.size <= BULK_BUFFER_MAX_SIZE:
+        return StorageService.upload_file(oss_key, b"".join(_read_chunks(prepared.item)))
+    return StorageService.upload_stream(oss_key, _read_chunks(prepared.item))
+
+def writable_folders(session: Session, user: User, folder_ids: Set[int]) -> Tuple[Dict[int, Folder], Set[int]]:
+    """
+    Load folders in one query and check write permission once per folder.
+    Returns ({folder_id: folder} for writable folders, ids that are denied).
+    Ids that do not exist appear in neither.
+    """
+    if not folder_ids:
+        return {}, set()
+    folders = session.exec(select(Folder).where(Folder.id.in_(folder_ids))).all()
+    perm_service = PermissionService(session)
+    allowed: Dict[int, Folder] = {}
+    denied: Set[int] = set()
+    for folder in folders:
+        if perm_service.check_permission(user, folder, 'write'):
+            allowed[folder.id] = folder
+        else:
+            denied.add(folder.id)
+    return allowed, denied
+
+def taken_names(session: Session, folder_ids: Set[int], names: Set[str]) -> Set[Tuple[int, str]]:
+    """
+    (folder_id, name) pairs already used by live documents, in one query.
+    """
+    if not folder_ids or not names:
+        return set()
+    rows = session.exec(select(Document.folder_id, Document.name).where(
+        Document.folder_id.in_(folder_ids),
+        Document.name.in_(names),
+        Document.is_deleted == False
+    )).all()
+    return set(rows)
+
+class _FolderPlan:
+    """
+    Resolves relative directory paths below the target folder.
+    Existing folders are looked up with one query per parent; missing ones are
+    created only in create_missing(), after permissions have been checked.
+    """
+    def __init__(self, session: Session, root: Folder):
+        self.session = session
+        self.root = root
+        self.resolved: Dict[Tuple[str, ...], Folder] = {(): root}
+        self._children: Dict[int, Dict[str, Folder]] = {}
+        self.missing: Dict[Tuple[str, ...], None] = {}  # insertion-ordered set
+
+    def _child_map(self, parent: Folder) -> Dict[str, Folder]:
+        if parent.id not in self._children:
+            children = self.session.exec(select(Folder).where(Folder.parent_id == parent.id)).all()
+            self._children[parent.id] = {child.name: child for child in children}
+        return self._children[parent.id]
+
+    def add(self, dirs: Tuple[str, ...]):
+        for depth in range(1, len(dirs) + 1):
+            path = dirs[:depth]
+            if path in self.resolved or path in self.missing:
+                continue
+            parent = self.resolved.get(path[:-1])
+            existing = self._child_map(parent).get(path[-1]) if parent is not None else None
+            if existing is not None:
+                self.resolved[path] = existing
+            else:
+                self.missing[path] = None
+
+    def write_targets(self, file_dirs: Set[Tuple[str, ...]]) -> List[Folder]:
+        """
+        Existing folders that receive a new file or a new subfolder.
+        """
+        targets: Dict[int, Folder] = {}
+        for dirs in file_dirs:
+            if dirs in self.resolved:
+                targets[self.resolved[dirs].id] = self.resolved[dirs]
+        for path in self.missing:
+            parent = self.resolved.get(path[:-1])
+            if parent is not None:
+                targets[parent.id] = parent
+        return list(targets.values())
+
+    def create_missing(self, user: User, is_restricted: bool) -> int:
+        # Parents sort before their children
+        for path in sorted(self.missing, key=len):
+            parent = self.resolved[path[:-1]]
+            folder = Folder(
+                name=path[-1],
+                parent_id=parent.id,
+                space_type=parent.space_type,
+                is_restricted=is_restricted or parent.is_restricted,
+                owner_id=user.id,
+            )
+            if str(parent.space_type).lower() == SpaceType.DEPARTMENT.value and parent.department_id:
+                folder.department_id = parent.department_id
+            self.session.add(folder)
+            self.session.flush()
+            self.resolved[path] = folder
+        return len(self.missing)
+
+def ingest_batch(session: Session, user: User, target: Folder, items: List[IngestItem],
+                 is_restricted: bool = False) -> Tuple[List[Document], int]:
+    """
+    Create folders and documents for items below target in one transaction.
+    Order: plan folders (read-only) -> one write check per receiving folder ->
+    one duplicate-name query -> hash + upload concurrently -> insert rows, single commit.
+    Objects uploaded by a failed batch are removed again.
+    Returns (documents, number of folders created).
+    """
+    if not items:
+        raise IngestError(400, "No files to upload")
+    if len(items) > BULK_MAX_FILES:
+        raise IngestError(413, f"At most {BULK_MAX_FILES} files per request")
+    if sum(item.size for item in items) > BULK_MAX_BYTES:
+        raise IngestError(413, "Batch is too large")
+
+    seen: Set[Tuple[Tuple[str, ...], str]] = set()
+    for item in items:
+        if (item.dirs, item.name) in seen:
+            raise IngestError(400, f"Duplicate path in batch: {'/'.join(item.dirs + (item.name,))}")
+        seen.add((item.dirs, item.name))
+
+    # 1. Folders and permissions
+    plan = _FolderPlan(session, target)
+    for item in items:
+        plan.add(item.dirs)
+    perm_service = PermissionService(session)
+    for folder in plan.write_targets({item.dirs for item in items}):
+        if not perm_service.check_permission(user, folder, 'write'):
+            raise IngestError(403, f"Permission denied for folder {folder.name}")
+
+    # 2. Name conflicts with live documents, in one query
+    existing_folder_ids = {plan.resolved[item.dirs].id for item in items if item.dirs in plan.resolved}
+    if existing_folder_ids:
+        taken = taken_names(session, existing_folder_ids, {item.name for item in items})
+        conflicts = [
+            "/".join(item.dirs + (item.name,)) for item in items
+            if item.dirs in plan.resolved and (plan.resolved[item.dirs].id, item.name) in taken
+        ]
+        if conflicts:
+            raise IngestError(409, {"message": "File with this name already exists", "conflicts": conflicts})
+
+    uploaded: List[str] = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, BULK_UPLOAD_WORKERS), thread_name_prefix="bulk-upload") as executor:
+            # 3. Hash everything, then dedupe against stored blobs (and within the batch)
+            prepared = list(executor.map(_hash_item, items))
+            blob_service = BlobService(session)
+            reusable = blob_service.find_reusable_many((p.content_hash, p.size) for p in prepared)
+
+            keys: Dict[Tuple[str, int], str] = {k: blob.oss_key for k, blob in reusable.items()}
+            to_upload: List[Tuple[str, _Prepared]] = []
+            for p in prepared:
+                content = (p.content_hash, p.size)
+                if content not in keys:
+                    keys[content] = StorageService.generate_oss_key(p.item.name)
+                    to_upload.append((keys[content], p))
+
+            # 4. Upload new content concurrently
+            def upload(job: Tuple[str, _Prepared]) -> bool:
+                ok = _upload_item(*job)
+                if ok:
+                    uploaded.append(job[0])
+                return ok
+
+            if not all(list(executor.map(upload, to_upload))):
+                raise IngestError(500, "Failed to upload file to storage")
+
+        # 5. Rows, one transaction
+        folders_created = plan.create_missing(user, is_restricted)
+        documents = []
+        for p in prepared:
+            folder = plan.resolved[p.item.dirs]
+            ext = os.path.splitext(p.item.name)[1].lower()
+            oss_key = keys[(p.content_hash, p.size)]
+            doc = Document(
+                name=p.item.name,
+                oss_key=oss_key,
+                file_type=ext[1:] if ext else "unknown",
+                size=p.size,
+                content_hash=p.content_hash,
+                folder_id=folder.id,
+                author_id=user.id,
+                is_restricted=is_restricted or folder.is_restricted,
+            )
+            session.add(doc)
+            blob_service.acquire(oss_key, p.content_hash, p.size)
+            documents.append(doc)
+        session.commit()
+    except BaseException:
+        session.rollback()
+        for key in uploaded:
+            StorageService.delete_file(key)
+        raise
+
+    for doc in documents:
+        session.refresh(doc)
+    return documents, folders_created
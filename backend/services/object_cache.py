@@ -0,0 +1,242 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional
+from services.storage_backends import StorageBackend, ObjectData, ObjectInfo, ObjectNotFound, RangeReader
+
+# Node-local read-through cache for remote objects. oss_keys are never rewritten with
+# different content (new uploads get new keys), so cached copies need no revalidation.
+CACHE_DIR = os.getenv("OBJECT_CACHE_DIR", os.path.join("cache", "objects"))
+# Total bytes kept on disk; 0 disables the cache
+CACHE_MAX_BYTES = int(os.getenv("OBJECT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Larger objects (videos, big archives) are always read straight from the backend
+CACHE_MAX_OBJECT_SIZE = int(os.getenv("OBJECT_CACHE_MAX_OBJECT_SIZE", str(64 * 1024 * 1024)))
+FILL_CHUNK_SIZE = 1024 * 1024
+
+class _Fill:
+    """
+    One in-progress download; concurrent readers of the same key wait on it.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+
+class CachedBackend(StorageBackend):
+    """
+    LRU disk cache in front of another backend.
+    Reads of objects up to CACHE_MAX_OBJECT_SIZE are served from a local copy,
+    downloading it once on a miss (other threads asking for the same key wait for
+    that download instead of starting their own). Writes and deletes go to the
+    backend and drop the local copy. Everything else is passed through.
+    """
+    def __init__(self, inner: StorageBackend, root: str = CACHE_DIR,
+                 max_bytes: int = CACHE_MAX_BYTES, max_object_size: int = CACHE_MAX_OBJECT_SIZE):
+        self.inner = inner
+        self.name = f"{inner.name}+cache"
+        self.remote = inner.remote
+        self.requires_proxy = inner.requires_proxy
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # path -> size, oldest first
+        self._total = 0
+        self._fills: Dict[str, _Fill] = {}
+        # Keys known to exceed max_object_size (sizes never change for a key), to skip the HEAD
+        self._oversized: "OrderedDict[str, None]" = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """
+        Pick up copies left by a previous run (or another worker on this node),
+        oldest access first.
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.endswith(".part"):
+                    # Interrupted download
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total += size
+        self._evict()
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _touch(self, path: str) -> bool:
+        """
+        Mark path as recently used. False if it is not cached.
+        """
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                cached = True
+            else:
+                cached = False
+        if not cached:
+            # Another process on this node may have filled it
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return False
+            self._add(path, size)
+        try:
+            # mtime carries the LRU order across restarts
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def _add(self, path: str, size: int):
+        with self._lock:
+            if path in self._entries:
+                self._total -= self._entries[path]
+            self._entries[path] = size
+            self._entries.move_to_end(path)
+            self._total += size
+        self._evict()
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self._total > self.max_bytes and self._entries:
+                path, size = self._entries.popitem(last=False)
+                self._total -= size
+                victims.append(path)
+        for path in victims:
+            # Readers that already opened the file keep their handle (POSIX unlink semantics)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _discard(self, key: str):
+        path = self.path(key)
+        with self._lock:
+            size = self._entries.pop(path, None)
+            if size is not None:
+                self._total -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _download(self, key: str, path: str, expected_size: int) -> bool:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        written = 0
+        try:
+            reader = self.inner.open_object(key)
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in iter(lambda: reader.read(FILL_CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        written += len(chunk)
+            finally:
+                reader.close()
+            if written != expected_size:
+                print(f"[ObjectCache] Size mismatch for {key}: expected {expected_size}, got {written}")
+                return False
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._add(path, written)
+        return True
+
+    def _fill(self, key: str, path: str) -> bool:
+        """
+        Make sure key is on disk. Returns False when it should be read uncached
+        (too large, or the download failed). Raises ObjectNotFound.
+        """
+        with self._lock:
+            fill = self._fills.get(key)
+            owner = fill is None
+            if owner:
+                fill = _Fill()
+                self._fills[key] = fill
+
+        if not owner:
+            fill.done.wait()
+            return fill.ok and os.path.exists(path)
+
+        try:
+            meta = self.inner.head_object(key)
+            if meta is None:
+                raise ObjectNotFound(key)
+            if meta["size"] > self.max_object_size:
+                with self._lock:
+                    self._oversized[key] = None
+                    while len(self._oversized) > 10000:
+                        self._oversized.popitem(last=False)
+                return False
+            fill.ok = self._download(key, path, meta["size"])
+            return fill.ok
+        except ObjectNotFound:
+            raise
+        except Exception as e:
+            print(f"[ObjectCache] Fill failed for {key}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._fills.pop(key, None)
+            fill.done.set()
+
+    # --- StorageBackend ---
+
+    def open_object(self, key: str, start: int = 0, end: Optional[int] = None):
+        path = self.path(key)
+        with self._lock:
+            oversized = key in self._oversized
+        if not oversized and (self._touch(path) or self._fill(key, path)):
+            try:
+                return RangeReader(open(path, "rb"), start, end)
+            except FileNotFoundError:
+                # Evicted between the check and the open
+                pass
+        return self.inner.open_object(key, start, end)
+
+    def put_object(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        self._discard(key)
+        self.inner.put_object(key, data, content_type)
+
+    def delete_object(self, key: str) -> None:
+        self._discard(key)
+        self.inner.delete_object(key)
+
+    def head_object(self, key: str) -> Optional[dict]:
+        return self.inner.head_object(key)
+
+    def object_exists(self, key: str) -> bool:
+        return self.inner.object_exists(key)
+
+    def sign_url(self, method, key, expires, params=None, headers=None) -> str:
+        return self.inner.sign_url(method, key, expires, params=params, headers=headers)
+
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        return self.inner.list_objects(prefix)
+
+def with_object_cache(backend: StorageBackend) -> StorageBackend:
+    """
+    Put the disk cache in front of remote backends (not the in-memory stand-in),
+    unless OBJECT_CACHE_MAX_BYTES=0.
+    """
+    if not backend.remote or backend.requires_proxy or CACHE_MAX_BYTES <= 0:
+        return backend
+    return CachedBackend(backend)
@@ -1,6 +1,6 @@
 from sqlmodel import Session, select
 from models import User, Folder, Document, SpaceType, Role, ProjectRole, CollaboratorRole, Project, ProjectMember, Collaborator, Department
-from typing import Union, Optional
+from typing import Union, Optional, List, Dict
 
 class PermissionService:
     def __init__(self, session: Session):
@@ -83,6 +83,34 @@ class PermissionService:
         else: # Department or Default
             return self._check_department_permission(user, folder, action, resource)
 
+    def check_documents(self, user: User, documents: List[Document], action: str) -> Dict[int, bool]:
+        """
+        Bulk variant of check_permission for documents.
+        Apart from authorship, a document's result only depends on its folder and
+        is_restricted, so the full check runs once per (folder_id, is_restricted)
+        and the folders are loaded in one query.
+        Returns {document_id: allowed}.
+        """
+        if user.role == Role.SUPER_ADMIN:
+            return {doc.id: True for doc in documents}
+
+        folder_ids = {doc.folder_id for doc in documents if doc.folder_id is not None}
+        if folder_ids:
+            # Populate the identity map so doc.folder below does not query per document
+            self.session.exec(select(Folder).where(Folder.id.in_(folder_ids))).all()
+
+        results: Dict[int, bool] = {}
+        memo: Dict[tuple, bool] = {}
+        for doc in documents:
+            if doc.author_id == user.id:
+                results[doc.id] = True
+                continue
+            key = (doc.folder_id, bool(doc.is_restricted))
+            if key not in memo:
+                memo[key] = self.check_permission(user, doc, action)
+            results[doc.id] = memo[key]
+        return results
+
     def get_effective_role(self, user: User, resource: Union[Folder, Document]) -> str:
         """
         Returns 'admin', 'editor', or 'viewer' for the UI.
@@ -126,6 +154,69 @@ class PermissionService:
             
         return 'viewer'
 
+    def effective_roles(self, user: User, folders: List[Folder]) -> Dict[int, str]:
+        """
+        Bulk variant of get_effective_role for folders.
+        The user's folder collaborations and the folders' ancestor chains are loaded
+        in one query each; the space check (what remains without a collaborator role)
+        runs once per (space, department, restricted, owner, is-root) for department
+        and public folders, and per folder for project folders (their project depends
+        on the ancestors). Returns {folder_id: 'admin' | 'editor' | 'viewer'}.
+        """
+        if user.role == Role.SUPER_ADMIN:
+            return {f.id: 'admin' for f in folders}
+
+        collab_roles: Dict[int, str] = {}
+        for folder_id, role in self.session.exec(select(Collaborator.folder_id, Collaborator.role).where(
+            Collaborator.user_id == user.id, Collaborator.folder_id != None
+        )).all():
+            raw = role.value if hasattr(role, 'value') else str(role)
+            collab_roles[folder_id] = raw.lower()
+
+        parents: Dict[int, Optional[int]] = {}
+        if collab_roles:
+            # Ancestor chains, only needed to find inherited collaborator roles
+            ids = [f.id for f in folders]
+            for i in range(0, len(ids), 500):
+                up = select(Folder.id, Folder.parent_id).where(Folder.id.in_(ids[i:i + 500])).cte("ancestors", recursive=True)
+                up = up.union(select(Folder.id, Folder.parent_id).join(up, Folder.id == up.c.parent_id))
+                parents.update(self.session.exec(select(up.c.id, up.c.parent_id)).all())
+
+        def inherited_role(folder_id: int) -> Optional[str]:
+            # Same walk as _get_collaborator_role: nearest share, at most 10 levels up
+            current = folder_id
+            for _ in range(10):
+                if current is None:
+                    break
+                if current in collab_roles:
+                    return collab_roles[current]
+                current = parents.get(current)
+            return None
+
+        roles: Dict[int, str] = {}
+        can_write: Dict[tuple, bool] = {}
+        for folder in folders:
+            if folder.owner_id == user.id:
+                roles[folder.id] = 'admin'
+                continue
+            role = inherited_role(folder.id)
+            if role in ('admin', 'editor', 'viewer'):
+                roles[folder.id] = role
+                continue
+
+            space_type = str(folder.space_type).lower()
+            if space_type == SpaceType.PROJECT.value:
+                key = ('folder', folder.id)
+            else:
+                key = (space_type, folder.department_id, bool(folder.is_restricted), folder.parent_id is None)
+            if key not in can_write:
+                can_write[key] = self.check_permission(user, folder, 'write')
+            if can_write[key]:
+                roles[folder.id] = 'admin' if user.role == Role.MANAGER and space_type == SpaceType.DEPARTMENT.value else 'editor'
+            else:
+                roles[folder.id] = 'viewer'
+        return roles
+
     def _check_project_permission(self, user: User, folder: Folder, action: str) -> bool:
         """
         Project Logic: Ignore department/collaborator table. Only ProjectMember.
@@ -0,0 +1,403 @@
+import io
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree as ET
+from services.storage import StorageService
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it images are previewed as the original
+    Image = None
+    ImageOps = None
+
+# Renditions live under their own prefix, derived from the original's oss_key.
+# oss_keys are immutable (and shared by deduplicated documents), so a rendition never
+# goes stale; bump RENDITION_VERSION when the renderers change.
+PREVIEW_PREFIX = "previews/"
+RENDITION_VERSION = "v1"
+
+# Sources above this size are not rendered (the client downloads the original instead)
+PREVIEW_MAX_SOURCE_SIZE = int(os.getenv("PREVIEW_MAX_SOURCE_SIZE", str(50 * 1024 * 1024)))
+# Cap on decompressed XML read from a docx/xlsx part (zip bombs)
+PREVIEW_MAX_XML_SIZE = int(os.getenv("PREVIEW_MAX_XML_SIZE", str(64 * 1024 * 1024)))
+PREVIEW_MAX_ROWS = int(os.getenv("PREVIEW_MAX_ROWS", "500"))
+PREVIEW_MAX_COLS = int(os.getenv("PREVIEW_MAX_COLS", "50"))
+THUMBNAIL_SIZE = int(os.getenv("PREVIEW_THUMBNAIL_SIZE", "1024"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+
+HTML_TYPES = {"docx", "xlsx"}
+IMAGE_TYPES = {"jpg", "jpeg", "png", "gif", "webp", "bmp"}
+
+_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="preview")
+# One render per source at a time within this process (striped by key)
+_render_locks = [threading.Lock() for _ in range(64)]
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+S = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PR = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+class PreviewError(Exception):
+    pass
+
+def rendition_for(file_type: str) -> Optional[Tuple[str, str]]:
+    """
+    (key suffix, media type) of the rendition for a file type, or None if not previewable.
+    """
+    file_type = (file_type or "").lower()
+    if file_type in HTML_TYPES:
+        return ".html", "text/html; charset=utf-8"
+    if file_type in IMAGE_TYPES and Image is not None:
+        return ".jpg", "image/jpeg"
+    return None
+
+def rendition_key(oss_key: str, suffix: str) -> str:
+    return f"{PREVIEW_PREFIX}{RENDITION_VERSION}/{oss_key}{suffix}"
+
+def rendition_keys(oss_key: str) -> List[str]:
+    return [rendition_key(oss_key, suffix) for suffix in (".html", ".jpg")]
+
+# --- docx ---
+
+def _read_part(zf: zipfile.ZipFile, name: str) -> Optional[bytes]:
+    try:
+        info = zf.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > PREVIEW_MAX_XML_SIZE:
+        raise PreviewError(f"{name} is too large to preview")
+    with zf.open(info) as f:
+        # file_size comes from the archive itself, so also cap what is actually inflated
+        data = f.read(PREVIEW_MAX_XML_SIZE + 1)
+    if len(data) > PREVIEW_MAX_XML_SIZE:
+        raise PreviewError(f"{name} is too large to preview")
+    return data
+
+def _on(el: Optional[ET.Element]) -> bool:
+    # <w:b/> is on; <w:b w:val="0"/> / "false" is off
+    return el is not None and el.get(f"{W}val", "true").lower() not in ("0", "false", "none")
+
+def _docx_runs(paragraph: ET.Element) -> str:
+    parts = []
+    for run in paragraph.iter(f"{W}r"):
+        text = []
+        for child in run:
+            if child.tag == f"{W}t":
+                text.append(escape(child.text or ""))
+            elif child.tag == f"{W}tab":
+                text.append("&emsp;")
+            elif child.tag in (f"{W}br", f"{W}cr"):
+                text.append("<br>")
+            elif child.tag == f"{W}drawing":
+                text.append('<span class="ph">[图片]</span>')
+        if not text:
+            continue
+        html = "".join(text)
+        props = run.find(f"{W}rPr")
+        if props is not None:
+            if _on(props.find(f"{W}b")):
+                html = f"<b>{html}</b>"
+            if _on(props.find(f"{W}i")):
+                html = f"<i>{html}</i>"
+            if _on(props.find(f"{W}u")):
+                html = f"<u>{html}</u>"
+        parts.append(html)
+    return "".join(parts)
+
+_HEADING_STYLE = re.compile(r"^(?:heading|标题)\s*(\d)$", re.IGNORECASE)
+
+def _docx_paragraph(paragraph: ET.Element) -> str:
+    content = _docx_runs(paragraph)
+    props = paragraph.find(f"{W}pPr")
+    tag = "p"
+    if props is not None:
+        style = props.find(f"{W}pStyle")
+        style_id = style.get(f"{W}val", "") if style is not None else ""
+        match = _HEADING_STYLE.match(style_id)
+        if match:
+            tag = f"h{min(int(match.group(1)), 6)}"
+        elif style_id.lower() == "title":
+            tag = "h1"
+        if props.find(f"{W}numPr") is not None:
+            content = f"&bull;&nbsp;{content}"
+    if not content:
+        return "<p>&nbsp;</p>"
+    return f"<{tag}>{content}</{tag}>"
+
+def _number(text: Optional[str], what: str, minimum: int = 0) -> int:
+    """
+    An integer attribute of the document XML; PreviewError if malformed.
+    """
+    try:
+        value = int(text)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or value < minimum:
+        raise PreviewError(f"Malformed {what}: {text!r}")
+    return value
+
+def _docx_table(table: ET.Element) -> str:
+    rows = []
+    for tr in table.findall(f"{W}tr"):
+        cells = []
+        for tc in tr.findall(f"{W}tc"):
+            span = tc.find(f"{W}tcPr/{W}gridSpan")
+            colspan = f' colspan="{_number(span.get(f"{W}val", "1"), "gridSpan", minimum=1)}"' if span is not None else ""
+            inner = "<br>".join(_docx_runs(p) for p in tc.findall(f"{W}p"))
+            cells.append(f"<td{colspan}>{inner}</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    return f"<table>{''.join(rows)}</table>"
+
+def render_docx(data: bytes) -> str:
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            xml = _read_part(zf, "word/document.xml")
+    except zipfile.BadZipFile:
+        raise PreviewError("Not a valid docx file")
+    if xml is None:
+        raise PreviewError("Not a valid docx file")
+
+    body = ET.fromstring(xml).find(f"{W}body")
+    blocks = []
+    for el in (body if body is not None else []):
+        if el.tag == f"{W}p":
+            blocks.append(_docx_paragraph(el))
+        elif el.tag == f"{W}tbl":
+            blocks.append(_docx_table(el))
+    return "\n".join(blocks)
+
+# --- xlsx ---
+
+def _column_index(ref: str) -> int:
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + (ord(ch.upper()) - 64)
+    return index - 1
+
+def _column_name(index: int) -> str:
+    name = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+def _shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    xml = _read_part(zf, "xl/sharedStrings.xml")
+    if xml is None:
+        return []
+    return ["".join(t.text or "" for t in si.iter(f"{S}t")) for si in ET.fromstring(xml).findall(f"{S}si")]
+
+def _sheet_parts(zf: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """
+    (sheet name, part path) in workbook order.
+    """
+    workbook = _read_part(zf, "xl/workbook.xml")
+    rels = _read_part(zf, "xl/_rels/workbook.xml.rels")
+    if workbook is None or rels is None:
+        raise PreviewError("Not a valid xlsx file")
+    targets = {}
+    for rel in ET.fromstring(rels).findall(f"{PR}Relationship"):
+        target = rel.get("Target", "")
+        target = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        targets[rel.get("Id")] = target
+    sheets = []
+    for sheet in ET.fromstring(workbook).iter(f"{S}sheet"):
+        part = targets.get(sheet.get(f"{R}id"))
+        if part:
+            sheets.append((sheet.get("name", ""), part))
+    return sheets
+
+def _sheet_cells(xml: bytes, strings: List[str], max_rows: int, max_cols: int) -> Tuple[Dict[int, Dict[int, str]], bool]:
+    """
+    Non-empty cell values as {row: {col: text}} (0-based), and whether the sheet
+    was cut at max_rows / max_cols.
+    """
+    rows: Dict[int, Dict[int, str]] = {}
+    truncated = False
+    for row in ET.fromstring(xml).iter(f"{S}row"):
+        row_index = _number(row.get("r", str(len(rows) + 1)), "row number", minimum=1) - 1
+        if row_index >= max_rows:
+            truncated = True
+            break
+        cells: Dict[int, str] = {}
+        for position, cell in enumerate(row.findall(f"{S}c")):
+            ref = cell.get("r")
+            col = _column_index(ref) if ref else position
+            if col >= max_cols:
+                truncated = True
+                continue
+            kind = cell.get("t", "n")
+            if kind == "inlineStr":
+                value = "".join(t.text or "" for t in cell.iter(f"{S}t"))
+            else:
+                v = cell.find(f"{S}v")
+                value = v.text if v is not None and v.text is not None else ""
+                if kind == "s" and value:
+                    index = _number(value, "shared string index")
+                    value = strings[index] if index < len(strings) else ""
+                elif kind == "b":
+                    value = "TRUE" if value == "1" else "FALSE"
+            if value != "":
+                cells[col] = value
+        if cells:
+            rows[row_index] = cells
+    return rows, truncated
+
+def _render_sheet(xml: bytes, strings: List[str]) -> Tuple[str, bool]:
+    rows, truncated = _sheet_cells(xml, strings, PREVIEW_MAX_ROWS, PREVIEW_MAX_COLS)
+    if not rows:
+        return '<p class="ph">(空工作表)</p>', truncated
+    last_row = max(rows)
+    last_col = max(col for cells in rows.values() for col in cells)
+    header = "".join(f"<th>{_column_name(c)}</th>" for c in range(last_col + 1))
+    lines = [f"<table><tr><th></th>{header}</tr>"]
+    for r in range(last_row + 1):
+        cells = rows.get(r, {})
+        tds = "".join(f"<td>{escape(cells.get(c, ''))}</td>" for c in range(last_col + 1))
+        lines.append(f"<tr><th>{r + 1}</th>{tds}</tr>")
+    lines.append("</table>")
+    return "".join(lines), truncated
+
+def render_xlsx(data: bytes) -> str:
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise PreviewError("Not a valid xlsx file")
+    with zf:
+        strings = _shared_strings(zf)
+        sections = []
+        for name, part in _sheet_parts(zf):
+            xml = _read_part(zf, part)
+            if xml is None:
+                continue
+            table, truncated = _render_sheet(xml, strings)
+            note = f'<p class="ph">仅显示前 {PREVIEW_MAX_ROWS} 行 / {PREVIEW_MAX_COLS} 列</p>' if truncated else ""
+            sections.append(f'<section class="sheet"><h2>{escape(name)}</h2>{table}{note}</section>')
+    return "\n".join(sections)
+
+def read_xlsx_rows(data: bytes, max_rows: int, max_cols: int = PREVIEW_MAX_COLS) -> List[List[str]]:
+    """
+    Cell text of the first worksheet as a list of rows (blank rows kept, so row
+    numbers line up with the spreadsheet). Raises PreviewError on a bad file or
+    when the sheet has more than max_rows rows.
+    """
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise PreviewError("Not a valid xlsx file")
+    with zf:
+        sheets = _sheet_parts(zf)
+        xml = _read_part(zf, sheets[0][1]) if sheets else None
+        if xml is None:
+            return []
+        # One extra row tells "exactly max_rows" from "too many"
+        rows, _ = _sheet_cells(xml, _shared_strings(zf), max_rows + 1, max_cols)
+    if not rows:
+        return []
+    if max(rows) >= max_rows:
+        raise PreviewError(f"More than {max_rows} rows")
+    width = max(col for cells in rows.values() for col in cells) + 1
+    return [[rows.get(r, {}).get(c, "") for c in range(width)] for r in range(max(rows) + 1)]
+
+_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>预览</title>
+<style>
+body{{font-family:-apple-system,"Segoe UI","PingFang SC","Microsoft YaHei",sans-serif;font-size:14px;line-height:1.6;color:#222;max-width:960px;margin:24px auto;padding:0 16px}}
+table{{border-collapse:collapse;margin:8px 0;font-size:13px}}
+td,th{{border:1px solid #ddd;padding:4px 8px;vertical-align:top}}
+th{{background:#f5f5f5;font-weight:500;color:#666}}
+.sheet{{overflow-x:auto;margin-bottom:24px}}
+.ph{{color:#999}}
+</style></head><body>
+{body}
+</body></html>"""
+
+def render_html(file_type: str, data: bytes) -> bytes:
+    # No document name in the page: deduplicated documents share one rendition
+    body = render_docx(data) if file_type == "docx" else render_xlsx(data)
+    return _PAGE.format(body=body).encode("utf-8")
+
+# --- images ---
+
+def render_thumbnail(data: bytes) -> bytes:
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                rgba = img.convert("RGBA")
+                flat = Image.new("RGB", rgba.size, (255, 255, 255))
+                flat.paste(rgba, mask=rgba.split()[-1])
+                img = flat
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=82, optimize=True)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise PreviewError(f"Cannot read image: {e}")
+
+# --- pipeline ---
+
+def ensure_rendition(oss_key: str, file_type: str, size: int) -> Optional[Tuple[str, str]]:
+    """
+    Return (rendition key, media type), rendering and storing it first if needed.
+    None when the type is not previewable, the source is too large, or rendering fails.
+    """
+    file_type = (file_type or "").lower()
+    target = rendition_for(file_type)
+    if target is None or size > PREVIEW_MAX_SOURCE_SIZE:
+        return None
+    suffix, media_type = target
+    key = rendition_key(oss_key, suffix)
+
+    if StorageService.object_exists(key):
+        return key, media_type
+
+    lock = _render_locks[hash(oss_key) % len(_render_locks)]
+    with lock:
+        # Another request or the upload worker may have rendered it while we waited
+        if StorageService.object_exists(key):
+            return key, media_type
+        data = StorageService.get_file_content(oss_key)
+        if data is None:
+            return None
+        try:
+            if suffix == ".html":
+                rendered = render_html(file_type, data)
+            else:
+                rendered = render_thumbnail(data)
+        except (PreviewError, ET.ParseError, zipfile.BadZipFile, ValueError, IndexError, KeyError) as e:
+            print(f"[Preview] Cannot render {oss_key}: {e}")
+            return None
+        if not StorageService.upload_file(key, rendered):
+            return None
+    return key, media_type
+
+def schedule_rendition(oss_key: str, file_type: str, size: int) -> None:
+    """
+    Render in the background right after upload, so the first preview is instant.
+    """
+    if rendition_for(file_type) is None or size > PREVIEW_MAX_SOURCE_SIZE:
+        return
+
+    def run():
+        try:
+            ensure_rendition(oss_key, file_type, size)
+        except Exception as e:
+            print(f"[Preview] Background render failed for {oss_key}: {e}")
+
+    _executor.submit(run)
+
+def delete_renditions(oss_key: str) -> None:
+    for key in rendition_keys(oss_key):
+        if StorageService.object_exists(key):
+            StorageService.delete_file(key)
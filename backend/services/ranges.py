@@ -0,0 +1,305 @@
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from secrets import token_hex
+from typing import Callable, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from services.storage import StorageService, get_backend
+
+# More ranges than this in one request is treated as abuse and served as a full 200
+MAX_RANGES = 16
+CHUNK_SIZE = 256 * 1024
+
+ByteRange = Tuple[int, int]  # [start, end) in bytes
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[ByteRange]]:
+    """
+    Parse an RFC 9110 'bytes=' Range header against a representation of `size` bytes.
+    Returns None when the header should be ignored (absent, malformed, other unit,
+    too many ranges) -> serve 200. Raises RangeNotSatisfiable -> 416.
+    Ranges are returned sorted, with overlapping ones coalesced (RFC 9110 14.2 allows this).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges: List[ByteRange] = []
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    if not parts or len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first == "":
+                # Suffix range: last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size
+            else:
+                start = int(first)
+                end = size if last == "" else min(int(last) + 1, size)
+                if last != "" and int(last) < start:
+                    return None
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start >= size or start >= end:
+            continue
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ordered = sorted(ranges)
+    merged = [ordered[0]]
+    for start, end in ordered[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def if_range_allows(if_range: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """
+    If-Range: honour the Range only if the validator still matches
+    (strong ETag comparison, or exact Last-Modified date).
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return etag is not None and not if_range.startswith("W/") and if_range == etag
+    if not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(if_range) == parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    return f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+def multipart_layout(ranges: List[ByteRange], size: int, content_type: str) -> Tuple[str, int, Callable[[int, int], bytes], bytes]:
+    """
+    Precompute a multipart/byteranges body layout.
+    Returns (boundary, total content length, part_header(start, end), closing delimiter).
+    """
+    boundary = token_hex(13)
+
+    def part_header(start: int, end: int) -> bytes:
+        return (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+        ).encode("latin-1")
+
+    closing = f"--{boundary}--\r\n".encode("latin-1")
+    length = sum(len(part_header(s, e)) + (e - s) + 2 for s, e in ranges) + len(closing)
+    return boundary, length, part_header, closing
+
+def range_headers(ranges: Optional[List[ByteRange]], size: int, content_type: str) -> Tuple[int, Mapping[str, str], Optional[Tuple]]:
+    """
+    Status code and headers for a (possibly ranged) response.
+    For multipart responses also returns the layout from multipart_layout().
+    """
+    if not ranges:
+        return 200, {"content-length": str(size), "content-type": content_type}, None
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return 206, {
+            "content-length": str(end - start),
+            "content-range": f"bytes {start}-{end - 1}/{size}",
+            "content-type": content_type,
+        }, None
+    layout = multipart_layout(ranges, size, content_type)
+    boundary, length, _, _ = layout
+    return 206, {
+        "content-length": str(length),
+        "content-type": f"multipart/byteranges; boundary={boundary}",
+    }, layout
+
+def iter_ranged_body(
+    ranges: Optional[List[ByteRange]],
+    size: int,
+    layout: Optional[Tuple],
+    read_range: Callable[[int, int], Iterator[bytes]],
+) -> Iterator[bytes]:
+    """
+    Body generator shared by local and proxied responses.
+    read_range(start, end) yields the bytes of [start, end).
+    """
+    if not ranges:
+        yield from read_range(0, size)
+        return
+    if layout is None:
+        start, end = ranges[0]
+        yield from read_range(start, end)
+        return
+    _, _, part_header, closing = layout
+    for start, end in ranges:
+        yield part_header(start, end)
+        yield from read_range(start, end)
+        yield b"\r\n"
+    yield closing
+
+class RangeFileResponse(Response):
+    """
+    Local file response with Range / If-Range / multipart support.
+    Bytes go out through the ASGI 'http.response.zerocopysend' extension (os.sendfile
+    in the server) when the server offers it, otherwise through pread()-style chunks.
+    """
+    def __init__(self, path: str, filename: str, media_type: str = "application/octet-stream",
+                 disposition: str = "attachment", headers: Optional[Mapping[str, str]] = None):
+        self.path = path
+        self.filename = filename
+        self.media_type = media_type
+        self.disposition = disposition
+        self.extra_headers = dict(headers or {})
+        self.background = None
+        self.status_code = 200
+
+    @staticmethod
+    def validators(st: os.stat_result) -> Tuple[str, str]:
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        return etag, last_modified
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        st = await anyio.to_thread.run_sync(os.stat, self.path)
+        if not stat.S_ISREG(st.st_mode):
+            raise RuntimeError(f"{self.path} is not a file")
+        size = st.st_size
+        etag, last_modified = self.validators(st)
+
+        request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        method = scope.get("method", "GET").upper()
+
+        ranges = None
+        try:
+            if if_range_allows(request_headers.get("if-range"), etag, last_modified):
+                ranges = parse_range_header(request_headers.get("range"), size)
+        except RangeNotSatisfiable:
+            await send({"type": "http.response.start", "status": 416, "headers": [
+                (b"content-range", f"bytes */{size}".encode("latin-1")),
+                (b"content-length", b"0"),
+            ]})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        status_code, headers, layout = range_headers(ranges, size, self.media_type)
+        headers = dict(headers)
+        headers.update({
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-disposition": content_disposition(self.filename, self.disposition),
+        })
+        headers.update(self.extra_headers)
+        raw_headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+        await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+
+        if method == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        spans = ranges or [(0, size)]
+        with open(self.path, "rb") as f:
+            fd = f.fileno()
+            for index, (start, end) in enumerate(spans):
+                is_last = index == len(spans) - 1
+                if layout is not None:
+                    _, _, part_header, _ = layout
+                    await send({"type": "http.response.body", "body": part_header(start, end), "more_body": True})
+
+                if zerocopy and end > start:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": fd,
+                        "offset": start,
+                        "count": end - start,
+                        "more_body": layout is not None or not is_last,
+                    })
+                else:
+                    offset = start
+                    while offset < end:
+                        chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, end - offset), offset)
+                        if not chunk:
+                            raise RuntimeError(f"{self.path} is shorter than expected")
+                        offset += len(chunk)
+                        more = offset < end or layout is not None or not is_last
+                        await send({"type": "http.response.body", "body": chunk, "more_body": more})
+                    if end == start and layout is None and is_last:
+                        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+                if layout is not None:
+                    _, _, _, closing = layout
+                    tail = b"\r\n" + (closing if is_last else b"")
+                    await send({"type": "http.response.body", "body": tail, "more_body": not is_last})
+
+async def proxy_object_response(request: Request, oss_key: str, filename: str,
+                                media_type: Optional[str] = None, disposition: str = "attachment") -> Response:
+    """
+    Stream an OSS object through the backend with the same Range semantics as local files.
+    Each requested range is fetched upstream as its own ranged GET over the pooled
+    connection and relayed chunk by chunk; the next chunk is only read once the client
+    has taken the previous one, so nothing is buffered whole.
+    """
+    try:
+        meta = await get_backend().head(oss_key)
+    except Exception as e:
+        print(f"Storage Head Error for key {oss_key}: {e}")
+        meta = None
+    if meta is None:
+        return Response(status_code=404, content="Object not found")
+
+    size = meta["size"]
+    etag = meta["etag"]
+    if etag and not etag.startswith('"'):
+        etag = f'"{etag}"'
+    last_modified = formatdate(meta["last_modified"], usegmt=True) if meta["last_modified"] else None
+    content_type = media_type or meta["content_type"] or "application/octet-stream"
+
+    ranges = None
+    try:
+        if if_range_allows(request.headers.get("if-range"), etag, last_modified):
+            ranges = parse_range_header(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+
+    status_code, headers, layout = range_headers(ranges, size, content_type)
+    headers = dict(headers)
+    headers["accept-ranges"] = "bytes"
+    headers["content-disposition"] = content_disposition(filename, disposition)
+    if etag:
+        headers["etag"] = etag
+    if last_modified:
+        headers["last-modified"] = last_modified
+
+    if request.method == "HEAD":
+        response = Response(status_code=status_code, headers=headers)
+        # Response() would recompute Content-Length for the empty body
+        response.headers["content-length"] = headers["content-length"]
+        return response
+
+    body = iter_ranged_body(
+        ranges, size, layout,
+        lambda start, end: StorageService.open_range_stream(oss_key, start, end, CHUNK_SIZE)
+    )
+    media = headers.pop("content-type")
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type=media)
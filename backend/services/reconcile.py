@@ -0,0 +1,189 @@
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Set
+from sqlmodel import Session, select
+from sqlalchemy import union
+from models import ArchiveJob, Blob, Document
+from services.storage import get_backend
+from services.storage_backends import ObjectInfo
+from services.preview import PREVIEW_PREFIX, RENDITION_VERSION
+from services.archive_jobs import ARCHIVE_CACHE_PREFIX
+
+# Storage vs database reconciliation.
+# Both sides are streamed in key order and merged, so memory stays bounded by the
+# page/batch sizes below no matter how many objects the bucket holds.
+
+DB_PAGE_SIZE = 2000
+# Orphan candidates are re-checked against the database in batches this size
+CHECK_BATCH_SIZE = 500
+# How many example keys to keep per category in the report
+SAMPLE_SIZE = 20
+# Objects younger than this are never deleted: an upload-token PUT lands before its
+# Document row exists, and a rendition or archive may be written before its job row.
+DEFAULT_GRACE_SECONDS = 24 * 3600
+
+_CURRENT_PREVIEW_PREFIX = f"{PREVIEW_PREFIX}{RENDITION_VERSION}/"
+_PREVIEW_SUFFIXES = (".html", ".jpg")
+
+@dataclass
+class ReconcileReport:
+    scanned: int = 0
+    scanned_bytes: int = 0
+    referenced: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    too_new: int = 0           # orphans still inside the grace period
+    deleted: int = 0
+    deleted_bytes: int = 0
+    delete_errors: int = 0
+    missing: int = 0           # keys referenced by the database but absent from storage
+    orphan_samples: List[str] = field(default_factory=list)
+    missing_samples: List[str] = field(default_factory=list)
+
+    def add_sample(self, samples: List[str], key: str):
+        if len(samples) < SAMPLE_SIZE:
+            samples.append(key)
+
+def iter_referenced_keys(session: Session, prefix: str = "", page_size: int = DB_PAGE_SIZE) -> Iterator[str]:
+    """
+    Distinct oss_keys referenced by documents or live blobs, ascending, under prefix.
+    Keyset pagination over the oss_key indexes, one page in memory at a time.
+    """
+    last = None
+    while True:
+        doc_keys = select(Document.oss_key)
+        blob_keys = select(Blob.oss_key).where(Blob.ref_count > 0)
+        if last is not None:
+            doc_keys = doc_keys.where(Document.oss_key > last)
+            blob_keys = blob_keys.where(Blob.oss_key > last)
+        elif prefix:
+            doc_keys = doc_keys.where(Document.oss_key >= prefix)
+            blob_keys = blob_keys.where(Blob.oss_key >= prefix)
+        stmt = union(doc_keys, blob_keys).order_by("oss_key").limit(page_size)
+        keys = session.exec(stmt).scalars().all()
+        for key in keys:
+            if not key:
+                continue
+            if not key.startswith(prefix):
+                return
+            yield key
+        if len(keys) < page_size:
+            return
+        last = keys[-1]
+
+def _preview_source(key: str) -> Optional[str]:
+    """
+    The oss_key a current-version rendition was made from, or None for stale
+    (older RENDITION_VERSION) or unrecognised preview objects.
+    """
+    if not key.startswith(_CURRENT_PREVIEW_PREFIX):
+        return None
+    for suffix in _PREVIEW_SUFFIXES:
+        if key.endswith(suffix):
+            return key[len(_CURRENT_PREVIEW_PREFIX):-len(suffix)]
+    return None
+
+def _still_referenced(session: Session, objects: List[ObjectInfo]) -> Set[str]:
+    """
+    Of the orphan candidates, the keys that are referenced after all: renditions of a
+    live source, cached archives of a known job, legacy "uploads/"-prefixed document
+    keys, and anything registered since the merge saw it (uploads in flight).
+    """
+    plain = {}
+    previews = {}
+    archives = set()
+    for obj in objects:
+        if obj.key.startswith(PREVIEW_PREFIX):
+            source = _preview_source(obj.key)
+            if source:
+                previews.setdefault(source, []).append(obj.key)
+        elif obj.key.startswith(ARCHIVE_CACHE_PREFIX):
+            archives.add(obj.key)
+        else:
+            plain[obj.key] = obj.key
+            # Local dev trees mix "uploads/"-prefixed and bare keys (see archive.resolve_local_path)
+            plain["uploads/" + obj.key] = obj.key
+            if obj.key.startswith("uploads/"):
+                plain[obj.key[len("uploads/"):]] = obj.key
+
+    kept = set()
+    lookup = list(plain) + list(previews)
+    if lookup:
+        found = set(session.exec(select(Document.oss_key).where(Document.oss_key.in_(lookup))).all())
+        found.update(session.exec(
+            select(Blob.oss_key).where(Blob.oss_key.in_(lookup), Blob.ref_count > 0)
+        ).all())
+        for key in found:
+            if key in plain:
+                kept.add(plain[key])
+            if key in previews:
+                kept.update(previews[key])
+    if archives:
+        kept.update(session.exec(
+            select(ArchiveJob.oss_key).where(ArchiveJob.oss_key.in_(archives))
+        ).all())
+    return kept
+
+def reconcile(session: Session, prefix: str = "", delete: bool = False,
+              grace_seconds: int = DEFAULT_GRACE_SECONDS,
+              log=print) -> ReconcileReport:
+    """
+    Merge the storage listing against the database and report orphans (objects
+    nothing references) and missing objects (references with no object).
+    With delete=True, orphans older than grace_seconds are removed.
+    """
+    backend = get_backend()
+    report = ReconcileReport()
+    cutoff = time.time() - grace_seconds
+    candidates: List[ObjectInfo] = []
+
+    def flush():
+        kept = _still_referenced(session, candidates)
+        for obj in candidates:
+            if obj.key in kept:
+                report.referenced += 1
+                continue
+            report.orphans += 1
+            report.orphan_bytes += obj.size
+            report.add_sample(report.orphan_samples, obj.key)
+            if obj.last_modified > cutoff:
+                report.too_new += 1
+                continue
+            if not delete:
+                continue
+            try:
+                backend.delete_object(obj.key)
+                report.deleted += 1
+                report.deleted_bytes += obj.size
+            except Exception as e:
+                report.delete_errors += 1
+                log(f"[Reconcile] Failed to delete {obj.key}: {e}")
+        candidates.clear()
+
+    def missing(key: str):
+        report.missing += 1
+        report.add_sample(report.missing_samples, key)
+
+    referenced = iter_referenced_keys(session, prefix)
+    ref = next(referenced, None)
+    for obj in backend.list_objects(prefix):
+        report.scanned += 1
+        report.scanned_bytes += obj.size
+        while ref is not None and ref < obj.key:
+            missing(ref)
+            ref = next(referenced, None)
+        if ref == obj.key:
+            report.referenced += 1
+            ref = next(referenced, None)
+        else:
+            candidates.append(obj)
+            if len(candidates) >= CHECK_BATCH_SIZE:
+                flush()
+        if report.scanned % 10000 == 0:
+            log(f"[Reconcile] Scanned {report.scanned} objects...")
+    while ref is not None:
+        missing(ref)
+        ref = next(referenced, None)
+    if candidates:
+        flush()
+    return report
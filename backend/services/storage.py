@@ -1,25 +1,60 @@
 import uuid
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 import os
-import oss2
-from typing import Optional
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
 from dotenv import load_dotenv
 
-# Load env from .env file
+# Load env from .env file (before the backend reads its settings)
 load_dotenv()
 
-ACCESS_KEY_ID = os.getenv("OSS_ACCESS_KEY_ID")
-ACCESS_KEY_SECRET = os.getenv("OSS_ACCESS_KEY_SECRET")
-ENDPOINT = os.getenv("OSS_ENDPOINT")
-BUCKET_NAME = os.getenv("OSS_BUCKET_NAME")
+from services.storage_backends import StorageBackend, ObjectNotFound, backend_from_env
+from services.object_cache import with_object_cache
 
-# Initialize Bucket if credentials exist
-bucket = None
-if ACCESS_KEY_ID and ACCESS_KEY_SECRET and ENDPOINT and BUCKET_NAME:
-    auth = oss2.Auth(ACCESS_KEY_ID, ACCESS_KEY_SECRET)
-    bucket = oss2.Bucket(auth, ENDPOINT, BUCKET_NAME)
+# How document downloads reach the client for remote objects:
+# "redirect" (default) -> 302 to a presigned URL; "proxy" -> streamed through this backend
+DOWNLOAD_MODE = os.getenv("OSS_DOWNLOAD_MODE", "redirect").lower()
+
+# Presigned GET URLs are reused within aligned windows so browsers/CDNs see stable URLs.
+# A URL signed in window [t, t+W) expires at t+2W, i.e. it stays valid for at least W seconds.
+URL_SIGN_WINDOW = int(os.getenv("OSS_URL_SIGN_WINDOW", "1800"))
+URL_CACHE_SIZE = int(os.getenv("OSS_URL_CACHE_SIZE", "20000"))
+
+_url_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_url_cache_lock = threading.Lock()
+
+# Process-wide backend (OSS client + connection pool behind the disk cache, or local disk)
+_backend: StorageBackend = with_object_cache(backend_from_env())
+
+def get_backend() -> StorageBackend:
+    return _backend
+
+def set_backend(backend: StorageBackend) -> None:
+    """
+    Swap the storage backend (tests, scripts). Cached URLs belong to the old one.
+    """
+    global _backend
+    _backend = backend
+    with _url_cache_lock:
+        _url_cache.clear()
 
 class StorageService:
+    """
+    Synchronous facade over the configured StorageBackend.
+    Errors are logged and reported as False/None, as callers expect.
+    Async handlers should prefer the backend's async methods (get_backend()).
+    """
+    @staticmethod
+    def proxy_downloads() -> bool:
+        """
+        True when remote downloads should be streamed through the backend instead of redirected.
+        """
+        return _backend.remote and (DOWNLOAD_MODE == "proxy" or _backend.requires_proxy)
+
     @staticmethod
     def generate_oss_key(filename: str) -> str:
         """
@@ -34,69 +69,60 @@ class StorageService:
     @staticmethod
     def upload_file(oss_key: str, data: bytes) -> bool:
         """
-        Upload data to OSS. Returns True if successful.
-        If OSS is not configured, fallback to local (or return False). 
-        To allow seamless switch, we check 'bucket'.
+        Upload data to storage. Returns True if successful.
         """
-        if bucket:
-            try:
-                bucket.put_object(oss_key, data)
-                return True
-            except Exception as e:
-                print(f"OSS Upload Error: {e}")
-                return False
-        else:
-            # Fallback to local 'uploads' directory
-            local_path = os.path.join("uploads", oss_key)
-            try:
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                with open(local_path, "wb") as f:
-                    f.write(data)
-                return True
-            except Exception as e:
-                print(f"Local Upload Error: {e}")
-                return False
+        try:
+            _backend.put_object(oss_key, data)
+            return True
+        except Exception as e:
+            print(f"Storage Upload Error ({_backend.name}): {e}")
+            return False
 
     @staticmethod
     def delete_file(oss_key: str) -> bool:
-        if bucket:
-            try:
-                bucket.delete_object(oss_key)
-                return True
-            except Exception as e:
-                print(f"OSS Delete Error: {e}")
-                return False
-        else:
-             # Fallback
-            local_path = os.path.join("uploads", oss_key)
-            if os.path.exists(local_path):
-                try:
-                    os.remove(local_path)
-                    return True
-                except Exception as e:
-                    print(f"Local Delete Error: {e}")
-                    return False
+        try:
+            _backend.delete_object(oss_key)
             return True
+        except Exception as e:
+            print(f"Storage Delete Error ({_backend.name}): {e}")
+            return False
 
     @staticmethod
     def get_presigned_url(oss_key: str, download_name: Optional[str] = None) -> str:
         """
         Generate presigned URL for secure access.
         If download_name is provided, force download (Content-Disposition: attachment).
+        URLs are cached per (oss_key, disposition) and share an aligned expiry, so the
+        same object gets the same URL for a whole window (cacheable by browser/CDN).
         """
-        if bucket:
-            params = {}
-            if download_name:
-                from urllib.parse import quote
-                encoded_name = quote(download_name)
-                # OSS specific param to force download with filename
-                params['response-content-disposition'] = f"attachment; filename*=UTF-8''{encoded_name}"
-            
-            # Generate URL valid for 1 hour (3600 seconds)
-            return bucket.sign_url('GET', oss_key, 3600, params=params)
-        else:
-            # Local dev fallback
-            return f"http://localhost:8001/static/uploads/{oss_key}"
+        if not _backend.remote:
+            # Local dev: static URL, nothing to sign or cache
+            return _backend.sign_url('GET', oss_key, 0)
+
+        now = int(time.time())
+        window_start = now - now % URL_SIGN_WINDOW
+        cache_key = (oss_key, download_name, window_start)
+        with _url_cache_lock:
+            url = _url_cache.get(cache_key)
+            if url is not None:
+                _url_cache.move_to_end(cache_key)
+                return url
+
+        params = {}
+        if download_name:
+            # OSS specific param to force download with filename
+            params['response-content-disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+        # Expire at the end of the next window (valid for URL_SIGN_WINDOW..2*URL_SIGN_WINDOW seconds)
+        expires_at = window_start + 2 * URL_SIGN_WINDOW
+        url = _backend.sign_url('GET', oss_key, expires_at - now, params=params)
+
+        with _url_cache_lock:
+            _url_cache[cache_key] = url
+            _url_cache.move_to_end(cache_key)
+            while len(_url_cache) > URL_CACHE_SIZE:
+                _url_cache.popitem(last=False)
+        return url
 
     @staticmethod
     def generate_upload_url(oss_key: str, content_type: str = "application/octet-stream") -> str:
@@ -104,28 +130,109 @@ class StorageService:
         Generate presigned URL for PUT (Upload).
         Valid for 600 seconds (10 minutes).
         """
-        if bucket:
-            # Generate URL for PUT
-            # CRITICAL: Content-Type MUST be included in the headers for the signature 
-            # if the client sends it, otherwise OSS returns 403 Forbidden.
-            headers = {'Content-Type': content_type}
-            return bucket.sign_url('PUT', oss_key, 600, headers=headers)
-        else:
-            # Local Dev Fallback:
-            # Return a URL that points to our backend's /files/local-upload/{key}
-            return f"http://localhost:8001/files/local-upload/{oss_key}"
+        # CRITICAL: Content-Type MUST be included in the headers for the signature
+        # if the client sends it, otherwise OSS returns 403 Forbidden.
+        headers = {'Content-Type': content_type}
+        return _backend.sign_url('PUT', oss_key, 600, headers=headers)
 
     @staticmethod
     def get_file_content(oss_key: str) -> "Optional[bytes]":
         """
-        Retrieve file content from OSS.
+        Retrieve the whole object.
         Returns bytes if found, None otherwise.
         """
-        if bucket:
+        try:
+            reader = _backend.open_object(oss_key)
             try:
-                result = bucket.get_object(oss_key)
-                return result.read()
-            except Exception as e:
-                print(f"OSS Download Error for key {oss_key}: {e}")
-                return None
-        return None
+                return reader.read()
+            finally:
+                reader.close()
+        except ObjectNotFound:
+            return None
+        except Exception as e:
+            print(f"Storage Download Error for key {oss_key}: {e}")
+            return None
+
+    @staticmethod
+    def compute_sha256(oss_key: str) -> "Optional[Tuple[str, int]]":
+        """
+        Hash a stored object in chunks (never loads it whole).
+        Returns (hex digest, size in bytes), or None if the object cannot be read.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        chunks = StorageService.open_stream(oss_key, 1024 * 1024)
+        if chunks is None:
+            return None
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+        except Exception as e:
+            print(f"Storage Hash Error for key {oss_key}: {e}")
+            return None
+        return digest.hexdigest(), size
+
+    @staticmethod
+    def open_stream(oss_key: str, chunk_size: int = 64 * 1024) -> "Optional[Iterator[bytes]]":
+        """
+        Open an object for chunked reading without buffering it whole.
+        Returns None if the object does not exist / cannot be opened.
+        """
+        try:
+            reader = _backend.open_object(oss_key)
+        except ObjectNotFound:
+            return None
+        except Exception as e:
+            print(f"Storage Download Error for key {oss_key}: {e}")
+            return None
+        return _iter_reader(reader, chunk_size)
+
+    @staticmethod
+    def object_exists(oss_key: str) -> bool:
+        try:
+            return _backend.object_exists(oss_key)
+        except Exception as e:
+            print(f"Storage Head Error for key {oss_key}: {e}")
+            return False
+
+    @staticmethod
+    def upload_stream(oss_key: str, chunks: "Iterator[bytes]") -> bool:
+        """
+        Upload data produced incrementally (e.g. a generated archive) without
+        holding it in memory. A partial object is never visible under oss_key.
+        """
+        try:
+            _backend.put_object(oss_key, chunks)
+            return True
+        except Exception as e:
+            print(f"Storage Upload Error ({_backend.name}): {e}")
+            return False
+
+    @staticmethod
+    def head_object(oss_key: str) -> "Optional[dict]":
+        """
+        Object metadata without the body: size, etag, last_modified (epoch seconds), content_type.
+        """
+        try:
+            return _backend.head_object(oss_key)
+        except Exception as e:
+            print(f"Storage Head Error for key {oss_key}: {e}")
+            return None
+
+    @staticmethod
+    def open_range_stream(oss_key: str, start: int, end: int, chunk_size: int = 256 * 1024) -> "Iterator[bytes]":
+        """
+        Stream bytes [start, end) of an object. The upstream response is read chunk by
+        chunk as the consumer asks for more, and released even if the consumer stops early.
+        """
+        if end <= start:
+            return
+        yield from _iter_reader(_backend.open_object(oss_key, start, end), chunk_size)
+
+def _iter_reader(reader, chunk_size: int) -> Iterator[bytes]:
+    try:
+        for chunk in iter(lambda: reader.read(chunk_size), b""):
+            yield chunk
+    finally:
+        reader.close()
@@ -0,0 +1,384 @@
+import io
+import mimetypes
+import os
+import random
+import threading
+import time
+import uuid
+from typing import AsyncIterator, BinaryIO, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, TypeVar, Union
+import anyio
+import oss2
+
+T = TypeVar("T")
+
+ObjectData = Union[bytes, Iterable[bytes]]
+
+# Retry policy for transient remote errors (network failures, 5xx, 429)
+MAX_RETRIES = int(os.getenv("STORAGE_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("STORAGE_RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("STORAGE_RETRY_MAX_DELAY", "5"))
+
+class ObjectNotFound(Exception):
+    pass
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+    last_modified: float  # epoch seconds
+
+def with_retry(fn: Callable[[], T], is_transient: Callable[[Exception], bool],
+               retries: int = MAX_RETRIES, base_delay: float = RETRY_BASE_DELAY) -> T:
+    """
+    Call fn(), retrying transient failures with exponential backoff and full jitter.
+    Only use for idempotent calls (or uploads whose body can be replayed).
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = min(RETRY_MAX_DELAY, base_delay * (2 ** attempt))
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+class RangeReader:
+    """
+    File-like view of [start, end) of an open file: read() stops at end.
+    """
+    def __init__(self, f: BinaryIO, start: int, end: Optional[int]):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = None if end is None else max(0, end - start)
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining is None:
+            return self.f.read(size)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+class StorageBackend:
+    """
+    Object storage interface.
+    Subclasses implement the blocking primitives (put_object, open_object, head_object,
+    delete_object, sign_url); the async methods (put_stream, get_stream, head, delete,
+    sign) run them off the event loop and are what async handlers should use.
+    Sync callers that already run in a worker thread (archives, background jobs)
+    may call the primitives directly.
+    """
+    name = "base"
+    # True when objects do not live on this node's disk
+    remote = False
+    # True when presigned URLs are not reachable by clients, so downloads must be proxied
+    requires_proxy = False
+
+    # --- Blocking primitives ---
+
+    def put_object(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def open_object(self, key: str, start: int = 0, end: Optional[int] = None):
+        """
+        Open [start, end) of an object for reading. The returned object has read(n)
+        and close(). Raises ObjectNotFound.
+        """
+        raise NotImplementedError
+
+    def head_object(self, key: str) -> Optional[dict]:
+        """
+        size, etag, last_modified (epoch seconds), content_type; None if missing.
+        """
+        raise NotImplementedError
+
+    def delete_object(self, key: str) -> None:
+        raise NotImplementedError
+
+    def object_exists(self, key: str) -> bool:
+        return self.head_object(key) is not None
+
+    def sign_url(self, method: str, key: str, expires: int,
+                 params: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> str:
+        raise NotImplementedError
+
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        """
+        Every object under prefix, in ascending key order (code point order, which is
+        also UTF-8 byte order, as OSS and SQLite's BINARY collation use). Streamed page
+        by page, never materialized.
+        """
+        raise NotImplementedError
+
+    # --- Async interface ---
+
+    async def put_stream(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        await anyio.to_thread.run_sync(self.put_object, key, data, content_type)
+
+    async def get_stream(self, key: str, start: int = 0, end: Optional[int] = None,
+                         chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+        """
+        Async chunk iterator over [start, end). Each read runs in a worker thread,
+        so the next chunk is only fetched once the consumer asks for it.
+        """
+        reader = await anyio.to_thread.run_sync(self.open_object, key, start, end)
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(reader.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            reader.close()
+
+    async def head(self, key: str) -> Optional[dict]:
+        return await anyio.to_thread.run_sync(self.head_object, key)
+
+    async def delete(self, key: str) -> None:
+        await anyio.to_thread.run_sync(self.delete_object, key)
+
+    async def sign(self, key: str, method: str = "GET", expires: int = 3600,
+                   params: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> str:
+        # Signing is local computation for every backend, no thread hop needed
+        return self.sign_url(method, key, expires, params=params, headers=headers)
+
+class LocalBackend(StorageBackend):
+    """
+    Objects as files under root (the "uploads" directory for local dev).
+    Writes go to a temp file renamed on success, so partial objects are never visible.
+    """
+    name = "local"
+
+    def __init__(self, root: str = "uploads", public_base_url: str = "http://localhost:8001"):
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put_object(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        local_path = self.path(key)
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.part"
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    f.write(data)
+                else:
+                    for chunk in data:
+                        f.write(chunk)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open_object(self, key: str, start: int = 0, end: Optional[int] = None):
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        return RangeReader(f, start, end)
+
+    def head_object(self, key: str) -> Optional[dict]:
+        try:
+            st = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            "size": st.st_size,
+            "etag": f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+            "last_modified": int(st.st_mtime),
+            "content_type": mimetypes.guess_type(key)[0],
+        }
+
+    def delete_object(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def object_exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def sign_url(self, method: str, key: str, expires: int,
+                 params: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> str:
+        # No signing locally: GET is served by the static mount, PUT by /files/local-upload
+        if method.upper() == "PUT":
+            return f"{self.public_base_url}/files/local-upload/{key}"
+        return f"{self.public_base_url}/static/uploads/{key}"
+
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        def walk(directory: str, key_prefix: str) -> Iterator[ObjectInfo]:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                return
+            # A directory's keys continue with "/", so it sorts as name + "/"
+            entries.sort(key=lambda e: e.name + "/" if e.is_dir(follow_symlinks=False) else e.name)
+            for entry in entries:
+                key = key_prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if key.startswith(prefix) or prefix.startswith(key + "/"):
+                        yield from walk(entry.path, key + "/")
+                elif key.startswith(prefix):
+                    st = entry.stat()
+                    yield ObjectInfo(key, st.st_size, st.st_mtime)
+
+        yield from walk(self.root, "")
+
+def _oss_transient(e: Exception) -> bool:
+    if isinstance(e, oss2.exceptions.RequestError):
+        return True
+    if isinstance(e, oss2.exceptions.OssError):
+        return e.status >= 500 or e.status == 429
+    return False
+
+class OSSBackend(StorageBackend):
+    """
+    Aliyun OSS through one oss2 Bucket whose HTTP session (keep-alive pool) is
+    shared by every request in the process. Idempotent calls retry transient errors.
+    """
+    name = "oss"
+    remote = True
+
+    def __init__(self, bucket: oss2.Bucket):
+        self.bucket = bucket
+
+    @classmethod
+    def from_env(cls) -> Optional["OSSBackend"]:
+        access_key_id = os.getenv("OSS_ACCESS_KEY_ID")
+        access_key_secret = os.getenv("OSS_ACCESS_KEY_SECRET")
+        endpoint = os.getenv("OSS_ENDPOINT")
+        bucket_name = os.getenv("OSS_BUCKET_NAME")
+        if not (access_key_id and access_key_secret and endpoint and bucket_name):
+            return None
+        # Size the pool for concurrent request threads + archive prefetch workers
+        pool_size = int(os.getenv("OSS_POOL_SIZE", "32"))
+        connect_timeout = float(os.getenv("OSS_CONNECT_TIMEOUT", "10"))
+        auth = oss2.Auth(access_key_id, access_key_secret)
+        bucket = oss2.Bucket(auth, endpoint, bucket_name,
+                             session=oss2.Session(pool_size=pool_size),
+                             connect_timeout=connect_timeout)
+        return cls(bucket)
+
+    def _retry(self, fn: Callable[[], T]) -> T:
+        return with_retry(fn, _oss_transient)
+
+    def put_object(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        headers = {"Content-Type": content_type} if content_type else None
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self._retry(lambda: self.bucket.put_object(key, data, headers=headers))
+        else:
+            # A consumed iterator cannot be replayed, so streamed uploads are not retried.
+            # oss2 sends iterables with chunked transfer encoding.
+            self.bucket.put_object(key, data, headers=headers)
+
+    def open_object(self, key: str, start: int = 0, end: Optional[int] = None):
+        byte_range: Optional[Tuple[Optional[int], Optional[int]]] = None
+        if start or end is not None:
+            byte_range = (start, None if end is None else end - 1)
+        try:
+            return self._retry(lambda: self.bucket.get_object(key, byte_range=byte_range))
+        except oss2.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+
+    def head_object(self, key: str) -> Optional[dict]:
+        try:
+            result = self._retry(lambda: self.bucket.head_object(key))
+        except oss2.exceptions.NotFound:
+            return None
+        return {
+            "size": result.content_length,
+            "etag": result.etag,
+            "last_modified": result.last_modified,
+            "content_type": result.content_type,
+        }
+
+    def delete_object(self, key: str) -> None:
+        self._retry(lambda: self.bucket.delete_object(key))
+
+    def object_exists(self, key: str) -> bool:
+        return self._retry(lambda: self.bucket.object_exists(key))
+
+    def sign_url(self, method: str, key: str, expires: int,
+                 params: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> str:
+        return self.bucket.sign_url(method, key, expires, params=params or {}, headers=headers)
+
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        # ObjectIterator pages through ListObjects (retrying each page) in key order
+        for obj in oss2.ObjectIterator(self.bucket, prefix=prefix, max_keys=1000):
+            yield ObjectInfo(obj.key, obj.size, obj.last_modified)
+
+class MemoryBackend(StorageBackend):
+    """
+    In-process object store for tests and throwaway environments.
+    URLs it signs are not reachable, so downloads go through the proxy path.
+    """
+    name = "memory"
+    remote = True
+    requires_proxy = True
+
+    def __init__(self):
+        self._objects: Dict[str, Tuple[bytes, float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, key: str, data: ObjectData, content_type: Optional[str] = None) -> None:
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = b"".join(data)
+        with self._lock:
+            self._objects[key] = (bytes(data), time.time(), content_type)
+
+    def open_object(self, key: str, start: int = 0, end: Optional[int] = None):
+        with self._lock:
+            item = self._objects.get(key)
+        if item is None:
+            raise ObjectNotFound(key)
+        return io.BytesIO(item[0][start:end])
+
+    def head_object(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._objects.get(key)
+        if item is None:
+            return None
+        data, mtime, content_type = item
+        return {
+            "size": len(data),
+            "etag": f'"{hash(data) & 0xffffffffffff:x}-{len(data):x}"',
+            "last_modified": int(mtime),
+            "content_type": content_type or mimetypes.guess_type(key)[0],
+        }
+
+    def delete_object(self, key: str) -> None:
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def sign_url(self, method: str, key: str, expires: int,
+                 params: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None) -> str:
+        return f"memory://{key}?method={method.upper()}&expires={int(time.time()) + expires}"
+
+    def list_objects(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        with self._lock:
+            items = sorted((k, len(v[0]), v[1]) for k, v in self._objects.items() if k.startswith(prefix))
+        for key, size, mtime in items:
+            yield ObjectInfo(key, size, mtime)
+
+def backend_from_env() -> StorageBackend:
+    """
+    STORAGE_BACKEND=oss|local|memory. Default: OSS when credentials are set, else local.
+    """
+    kind = os.getenv("STORAGE_BACKEND", "").lower()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind in ("", "oss"):
+        oss_backend = OSSBackend.from_env()
+        if oss_backend:
+            return oss_backend
+        if kind == "oss":
+            print("[Storage] STORAGE_BACKEND=oss but OSS credentials are missing, using local storage")
+    return LocalBackend(os.getenv("LOCAL_STORAGE_ROOT", "uploads"),
+                        os.getenv("LOCAL_PUBLIC_BASE_URL", "http://localhost:8001"))
@@ -0,0 +1,111 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlmodel import Session, select
+from sqlalchemy import delete, func, insert, literal
+from sqlalchemy.exc import IntegrityError
+from models import Collaborator, Document, DocumentArchive
+from services.blob import BlobService
+
+# Deleted documents stay restorable this long, then the sweeper archives them
+TRASH_RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS", "30"))
+# Seconds between sweeps; 0 disables the background sweeper
+TRASH_SWEEP_INTERVAL = int(os.getenv("TRASH_SWEEP_INTERVAL", "3600"))
+PURGE_BATCH_SIZE = 500
+
+_ARCHIVED_COLUMNS = [
+    "id", "name", "oss_key", "file_type", "size", "content_hash", "is_restricted",
+    "folder_id", "author_id", "created_at", "updated_at", "deleted_at", "deleted_by",
+]
+
+def trashed_at(doc: Document) -> datetime:
+    # Rows trashed before deleted_at existed fall back to their last update
+    return doc.deleted_at or doc.updated_at or doc.created_at
+
+def expires_at(doc: Document) -> datetime:
+    return trashed_at(doc) + timedelta(days=TRASH_RETENTION_DAYS)
+
+def purge_documents(session: Session, document_ids: List[int]) -> int:
+    """
+    Move trashed documents to DocumentArchive and release their blobs, in one
+    transaction (set-based: one INSERT ... SELECT and one DELETE per batch).
+    Ids that are not in the trash are ignored. Returns how many were purged.
+    """
+    purged = 0
+    for i in range(0, len(document_ids), PURGE_BATCH_SIZE):
+        batch = document_ids[i:i + PURGE_BATCH_SIZE]
+        in_trash = (Document.id.in_(batch), Document.is_deleted == True)
+        source = select(
+            *[getattr(Document, name) for name in _ARCHIVED_COLUMNS],
+            literal(datetime.now()).label("archived_at"),
+        ).where(*in_trash)
+        try:
+            # The INSERT takes the write lock first, so the rows read below cannot be
+            # restored or archived by anyone else before this transaction commits.
+            result = session.exec(insert(DocumentArchive).from_select(_ARCHIVED_COLUMNS + ["archived_at"], source))
+        except IntegrityError:
+            # Another worker archived the same rows first
+            session.rollback()
+            continue
+        if not result.rowcount:
+            session.rollback()
+            continue
+        rows = session.exec(select(Document.id, Document.oss_key).where(*in_trash)).all()
+        ids = [doc_id for doc_id, _ in rows]
+        session.exec(delete(Collaborator).where(Collaborator.document_id.in_(ids)))
+        session.exec(delete(Document).where(Document.id.in_(ids)))
+        # Commits the move together with the refcount changes
+        BlobService(session).release_many(oss_key for _, oss_key in rows)
+        purged += len(ids)
+    return purged
+
+def sweep_expired(session: Session, now: Optional[datetime] = None) -> int:
+    """
+    Purge every document that has been in the trash longer than TRASH_RETENTION_DAYS.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=TRASH_RETENTION_DAYS)
+    total = 0
+    last_id = 0
+    while True:
+        ids = session.exec(
+            select(Document.id).where(
+                Document.is_deleted == True,
+                func.coalesce(Document.deleted_at, Document.updated_at) < cutoff,
+                Document.id > last_id,
+            ).order_by(Document.id).limit(PURGE_BATCH_SIZE)
+        ).all()
+        if not ids:
+            return total
+        total += purge_documents(session, list(ids))
+        last_id = ids[-1]
+
+def _sweep_loop(stop: threading.Event):
+    from database import engine
+
+    while not stop.wait(TRASH_SWEEP_INTERVAL):
+        try:
+            with Session(engine) as session:
+                purged = sweep_expired(session)
+            if purged:
+                print(f"[Trash] Archived {purged} expired documents")
+        except Exception as e:
+            print(f"[Trash] Sweep failed: {e}")
+
+_sweeper: Optional[threading.Thread] = None
+_sweeper_stop = threading.Event()
+
+def start_sweeper():
+    """
+    Run sweep_expired every TRASH_SWEEP_INTERVAL seconds on a daemon thread.
+    Safe with several workers: a row can only be archived once.
+    """
+    global _sweeper
+    if TRASH_SWEEP_INTERVAL <= 0 or (_sweeper and _sweeper.is_alive()):
+        return
+    _sweeper_stop.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, args=(_sweeper_stop,), name="trash-sweeper", daemon=True)
+    _sweeper.start()
+
+def stop_sweeper():
+    _sweeper_stop.set()
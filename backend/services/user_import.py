@@ -0,0 +1,235 @@
+import csv
+import io
+import multiprocessing
+import os
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+from models import Department, Role, User
+from auth_utils import get_password_hash
+from services.preview import PreviewError, read_xlsx_rows
+from services.user_search import index_users
+
+# One import: at most this many users
+USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", "10000"))
+# Processes hashing passwords (each hash is ~0.3s of CPU); 0 = one per core
+USER_IMPORT_WORKERS = int(os.getenv("USER_IMPORT_WORKERS", "0")) or os.cpu_count() or 1
+INSERT_BATCH_SIZE = 500
+
+# Accepted header names (English or as shown in the Organization page) -> field
+HEADER_ALIASES = {
+    "username": "username", "用户名": "username", "姓名": "username",
+    "password": "password", "密码": "password", "初始密码": "password",
+    "employee_id": "employee_id", "工号": "employee_id",
+    "email": "email", "邮箱": "email",
+    "department": "department", "部门": "department",
+    "role": "role", "角色": "role",
+}
+ROLE_ALIASES = {
+    "系统运维": Role.SUPER_ADMIN,
+    "管理员": Role.MANAGER,
+    "协作成员": Role.EDITOR,
+    "只读成员": Role.VIEWER,
+}
+
+class UserImportError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class ImportRowResult:
+    row: int                      # spreadsheet row number (header is row 1)
+    username: Optional[str]
+    status: str                   # "created" / "valid" (dry run) / "error"
+    error: Optional[str] = None
+    user_id: Optional[int] = None
+
+def read_table(filename: str, data: bytes) -> List[List[str]]:
+    """
+    Rows of a .csv (UTF-8 with or without BOM, or GBK as saved by Excel) or .xlsx upload.
+    """
+    if filename.lower().endswith(".xlsx"):
+        try:
+            return read_xlsx_rows(data, USER_IMPORT_MAX_ROWS + 1)
+        except PreviewError as e:
+            raise UserImportError(400, str(e))
+        except (ET.ParseError, ValueError, IndexError, KeyError):
+            raise UserImportError(400, "Not a valid xlsx file")
+    if not filename.lower().endswith(".csv"):
+        raise UserImportError(400, "Only .csv and .xlsx files can be imported")
+    for encoding in ("utf-8-sig", "gbk"):
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise UserImportError(400, "CSV must be UTF-8 or GBK encoded")
+    return list(csv.reader(io.StringIO(text)))
+
+def _department_resolver(session: Session):
+    """
+    Department lookup by name or by "Parent/Child" path, from one query.
+    Returns resolve(text) -> (department_id, error).
+    """
+    depts = session.exec(select(Department.id, Department.name, Department.parent_id)).all()
+    by_id = {dept_id: (name, parent_id) for dept_id, name, parent_id in depts}
+    by_name: Dict[str, List[int]] = {}
+    by_path: Dict[str, int] = {}
+    for dept_id, name, _ in depts:
+        by_name.setdefault(name.strip(), []).append(dept_id)
+        parts, current, seen = [], dept_id, set()
+        while current is not None and current in by_id and current not in seen:
+            seen.add(current)
+            parts.append(by_id[current][0].strip())
+            current = by_id[current][1]
+        by_path["/".join(reversed(parts))] = dept_id
+
+    def resolve(text: str) -> Tuple[Optional[int], Optional[str]]:
+        text = "/".join(part.strip() for part in text.split("/"))
+        if "/" in text:
+            if text in by_path:
+                return by_path[text], None
+            return None, f"Department not found: {text}"
+        ids = by_name.get(text, [])
+        if len(ids) == 1:
+            return ids[0], None
+        if not ids:
+            return None, f"Department not found: {text}"
+        return None, f"Department name is ambiguous, use the full path (e.g. Parent/{text})"
+
+    return resolve
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+
+def _get_hash_pool() -> ProcessPoolExecutor:
+    """
+    One process pool for the whole API process, created on first use.
+    'spawn' avoids forking a process that already runs threads (uvicorn, sweeper).
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=USER_IMPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _hash_pool
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """
+    get_password_hash for many passwords, spread over a process pool (the hash is
+    CPU-bound and holds the GIL, so threads would not help).
+    """
+    if USER_IMPORT_WORKERS < 2 or len(passwords) < 2:
+        return [get_password_hash(p) for p in passwords]
+    chunksize = max(1, len(passwords) // (USER_IMPORT_WORKERS * 4))
+    return list(_get_hash_pool().map(get_password_hash, passwords, chunksize=chunksize))
+
+def import_users(session: Session, rows: List[List[str]], dry_run: bool = False) -> List[ImportRowResult]:
+    """
+    Validate every row, then (unless dry_run or nothing is valid) create the valid
+    users in one transaction. Invalid rows are reported and skipped.
+    """
+    if not rows:
+        raise UserImportError(400, "The file is empty")
+    header = [HEADER_ALIASES.get(h.strip().lower(), HEADER_ALIASES.get(h.strip())) for h in rows[0]]
+    for required in ("username", "password"):
+        if required not in header:
+            raise UserImportError(400, f"Missing column: {required}")
+    body = rows[1:]
+    if len(body) > USER_IMPORT_MAX_ROWS:
+        raise UserImportError(400, f"At most {USER_IMPORT_MAX_ROWS} users per import")
+
+    records = []
+    for index, values in enumerate(body):
+        record = {"row": index + 2}
+        for field, value in zip(header, values):
+            if field:
+                record[field] = (value or "").strip()
+        if any(record.get(f) for f in HEADER_ALIASES.values()):
+            records.append(record)
+
+    # Existing usernames, one query per batch
+    names = list({r["username"] for r in records if r.get("username")})
+    existing = set()
+    for i in range(0, len(names), INSERT_BATCH_SIZE):
+        existing.update(session.exec(select(User.username).where(User.username.in_(names[i:i + INSERT_BATCH_SIZE]))).all())
+    resolve_department = _department_resolver(session)
+
+    results: List[ImportRowResult] = []
+    valid = []
+    seen = set()
+    for record in records:
+        username = record.get("username")
+        result = ImportRowResult(row=record["row"], username=username or None, status="error")
+        results.append(result)
+        if not username:
+            result.error = "Username is required"
+            continue
+        if username in existing:
+            result.error = "Username already registered"
+            continue
+        if username in seen:
+            result.error = "Duplicate username in file"
+            continue
+        if not record.get("password"):
+            result.error = "Password is required"
+            continue
+        role_text = record.get("role") or Role.VIEWER.value
+        role = ROLE_ALIASES.get(role_text)
+        if role is None:
+            try:
+                role = Role(role_text.lower())
+            except ValueError:
+                result.error = f"Unknown role: {role_text}"
+                continue
+        department_id = None
+        if record.get("department"):
+            department_id, error = resolve_department(record["department"])
+            if error:
+                result.error = error
+                continue
+        seen.add(username)
+        result.status = "valid"
+        valid.append((result, User(
+            username=username,
+            hashed_password="",
+            employee_id=record.get("employee_id") or None,
+            email=record.get("email") or None,
+            department_id=department_id,
+            role=role,
+        ), record["password"]))
+
+    if dry_run or not valid:
+        return results
+
+    hashes = hash_passwords([password for _, _, password in valid])
+    try:
+        for i in range(0, len(valid), INSERT_BATCH_SIZE):
+            batch = valid[i:i + INSERT_BATCH_SIZE]
+            users = []
+            for (_, user, _), hashed in zip(batch, hashes[i:i + INSERT_BATCH_SIZE]):
+                user.hashed_password = hashed
+                users.append(user)
+            session.add_all(users)
+            session.flush()
+            index_users(session, users)
+            # Read the ids now: after commit each access would reload the row
+            for result, user, _ in batch:
+                result.user_id = user.id
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise UserImportError(409, "Some usernames were registered while importing, nothing was imported. Please retry.")
+
+    for result, _, _ in valid:
+        result.status = "created"
+    return results
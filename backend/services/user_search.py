@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, List, Optional
+from sqlmodel import Session, select
+from sqlalchemy import delete, func, insert
+from models import User, UserSearchTerm
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # pypinyin is optional: without it Chinese names are matched by characters only
+    lazy_pinyin = None
+    Style = None
+
+# Longest field value that is indexed (longer values are cut) and longest query used
+MAX_TERM_LENGTH = 64
+INDEX_BATCH_SIZE = 500
+# Upper bound for "starts with" range scans: sorts after any character
+_RANGE_END = "\U0010ffff"
+
+def _pinyin(text: str) -> List[str]:
+    """
+    Full pinyin and initials of a name with Chinese characters ("zhangsan", "zs").
+    """
+    if lazy_pinyin is None or text.isascii():
+        return []
+    full = "".join(lazy_pinyin(text)).lower()
+    initials = "".join(lazy_pinyin(text, style=Style.FIRST_LETTER)).lower()
+    return [full, initials]
+
+def search_terms(user: User) -> Dict[str, int]:
+    """
+    Every suffix of every searchable field, with its smallest offset.
+    """
+    values = [user.username, user.employee_id, user.email]
+    values += _pinyin(user.username or "")
+    terms: Dict[str, int] = {}
+    for value in values:
+        value = (value or "").strip().lower()[:MAX_TERM_LENGTH]
+        for position in range(len(value)):
+            suffix = value[position:]
+            if position < terms.get(suffix, MAX_TERM_LENGTH):
+                terms[suffix] = position
+    return terms
+
+def index_users(session: Session, users: Iterable[User]) -> None:
+    """
+    (Re)build the search terms of these users. Call after they are flushed (ids
+    assigned) and whenever a searchable field changes; the caller commits.
+    """
+    users = list(users)
+    for i in range(0, len(users), INDEX_BATCH_SIZE):
+        batch = users[i:i + INDEX_BATCH_SIZE]
+        session.exec(delete(UserSearchTerm).where(UserSearchTerm.user_id.in_([u.id for u in batch])))
+        rows = [
+            {"user_id": u.id, "term": term, "position": position}
+            for u in batch
+            for term, position in search_terms(u).items()
+        ]
+        if rows:
+            session.exec(insert(UserSearchTerm), params=rows)
+
+def remove_users(session: Session, user_ids: List[int]) -> None:
+    session.exec(delete(UserSearchTerm).where(UserSearchTerm.user_id.in_(user_ids)))
+
+def backfill(session: Session) -> int:
+    """
+    Index users that have no search terms yet (existing databases, users created by
+    scripts). Returns how many were indexed.
+    """
+    # Keyset on id: a user whose fields give no terms (e.g. a blank username)
+    # stays "unindexed", so filtering on that alone would return it forever
+    indexed = select(UserSearchTerm.user_id).distinct()
+    total = 0
+    last_id = 0
+    while True:
+        users = session.exec(
+            select(User).where(User.id > last_id, User.id.not_in(indexed))
+            .order_by(User.id).limit(INDEX_BATCH_SIZE)
+        ).all()
+        if not users:
+            return total
+        last_id = users[-1].id
+        index_users(session, users)
+        session.commit()
+        total += len(users)
+
+def matching_users(q: str):
+    """
+    Subquery (user_id, rank) of users matching q anywhere in an indexed field;
+    rank 0 when some field starts with q, 1 for substring-only matches.
+    """
+    q = q.strip().lower()[:MAX_TERM_LENGTH]
+    return (
+        select(
+            UserSearchTerm.user_id,
+            func.min(func.min(UserSearchTerm.position), 1).label("rank")
+        )
+        .where(UserSearchTerm.term >= q, UserSearchTerm.term < q + _RANGE_END)
+        .group_by(UserSearchTerm.user_id)
+        .subquery()
+    )
@@ -0,0 +1,61 @@
+import os
+import sys
+
+# Modules are imported the way main.py imports them (backend/ on sys.path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+import models  # noqa: F401  (registers the tables)
+from models import Role, User
+from services import storage as storage_module
+from services.storage_backends import MemoryBackend
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as s:
+        yield s
+    engine.dispose()
+
+@pytest.fixture
+def storage():
+    previous = storage_module.get_backend()
+    backend = MemoryBackend()
+    storage_module.set_backend(backend)
+    yield backend
+    storage_module.set_backend(previous)
+
+@pytest.fixture
+def admin(session):
+    user = User(username="admin", hashed_password="x", role=Role.SUPER_ADMIN)
+    session.add(user)
+    session.commit()
+    return user
+
+@pytest.fixture
+def editor(session):
+    user = User(username="editor", hashed_password="x", role=Role.EDITOR)
+    session.add(user)
+    session.commit()
+    return user
+
+@pytest.fixture
+def client_as(session):
+    """
+    client_as(user) -> TestClient calling the API as user, on the test database.
+    """
+    from fastapi.testclient import TestClient
+    import main
+
+    def make(user):
+        main.app.dependency_overrides[main.get_session] = lambda: session
+        main.app.dependency_overrides[main.get_current_user] = lambda: user
+        return TestClient(main.app)
+
+    yield make
+    main.app.dependency_overrides.clear()
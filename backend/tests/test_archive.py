@@ -0,0 +1,147 @@
+import io
+import zipfile
+import zlib
+from datetime import datetime
+
+from services.archive import METHOD_DEFLATED, METHOD_STORED, ZipStreamWriter
+
+MTIME = datetime(2024, 5, 6, 7, 8, 10)
+
+def build(write):
+    writer = ZipStreamWriter()
+    out = b"".join(write(writer)) + b"".join(writer.finish())
+    return zipfile.ZipFile(io.BytesIO(out))
+
+def chunked(data, size=1000):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+def test_entries_read_back():
+    text = b"hello world\n" * 5000
+    binary = bytes(range(256)) * 40
+
+    def write(writer):
+        yield from writer.write_entry("docs/readme.txt", chunked(text), MTIME, compress=True, size_hint=len(text))
+        yield from writer.write_entry("img/raw.bin", chunked(binary), MTIME, compress=False, size_hint=len(binary))
+        yield from writer.write_entry("empty.txt", iter(()), MTIME, size_hint=0)
+
+    with build(write) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["docs/readme.txt", "img/raw.bin", "empty.txt"]
+        assert zf.read("docs/readme.txt") == text
+        assert zf.read("img/raw.bin") == binary
+        assert zf.read("empty.txt") == b""
+        assert zf.getinfo("docs/readme.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("img/raw.bin").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("docs/readme.txt").date_time == (2024, 5, 6, 7, 8, 10)
+
+def test_unknown_size_uses_zip64_local_header():
+    data = b"streamed " * 1000
+
+    def write(writer):
+        yield from writer.write_entry("stream.txt", chunked(data), MTIME, size_hint=None)
+
+    with build(write) as zf:
+        assert zf.read("stream.txt") == data
+
+def test_utf8_names_and_old_dates():
+    def write(writer):
+        yield from writer.write_entry("报告/季度总结.txt", [b"x"], datetime(1970, 1, 1), size_hint=1)
+
+    with build(write) as zf:
+        info = zf.getinfo("报告/季度总结.txt")
+        assert info.flag_bits & 0x800
+        assert info.date_time[0] == 1980
+
+def test_raw_entries_from_workers():
+    data = b"compressed elsewhere " * 200
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    def write(writer):
+        yield from writer.write_raw_entry("deflated.txt", deflated, zlib.crc32(data), len(data), METHOD_DEFLATED, MTIME)
+        yield from writer.write_raw_entry("stored.txt", data, zlib.crc32(data), len(data), METHOD_STORED, MTIME)
+
+    with build(write) as zf:
+        assert zf.testzip() is None
+        assert zf.read("deflated.txt") == data
+        assert zf.read("stored.txt") == data
+
+def test_more_than_65535_entries_use_zip64_end_records():
+    count = 70000
+
+    def write(writer):
+        for i in range(count):
+            yield from writer.write_entry(f"f{i}", [b"%d" % i], MTIME, compress=False, size_hint=8)
+
+    with build(write) as zf:
+        names = zf.namelist()
+        assert len(names) == count
+        assert zf.read(names[-1]) == b"%d" % (count - 1)
+
+def test_prefetch_streams_objects_larger_than_recorded(storage, monkeypatch):
+    from services import archive
+    from services.archive import ArchiveEntry, prefetch_entries
+    monkeypatch.setattr(archive, "PREFETCH_MAX_OBJECT_SIZE", 100)
+    monkeypatch.setattr(archive, "READ_CHUNK_SIZE", 1000)
+    storage.put_object("small.txt", b"s" * 10)
+    # Recorded as 10 bytes (e.g. a client-declared size), actually much bigger
+    storage.put_object("big.txt", b"b" * 5000)
+    entries = [ArchiveEntry(name, name, None, 10, MTIME) for name in ("small.txt", "big.txt")]
+
+    fetched = {entry.arcname: content for entry, content in prefetch_entries(entries, workers=2)}
+
+    assert b"".join(fetched["small.txt"]) == b"s" * 10
+    big = list(fetched["big.txt"])
+    # Streamed in place rather than buffered whole by the prefetcher
+    assert len(big) > 1 and b"".join(big) == b"b" * 5000
+
+def test_parallel_compression_streams_members_larger_than_recorded(storage, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from services import archive
+    from services.archive import ArchiveEntry, stream_zip
+    submitted = []
+
+    class RecordingPool(ThreadPoolExecutor):
+        def submit(self, fn, data):
+            submitted.append(len(data))
+            return super().submit(fn, data)
+
+    pool = RecordingPool(max_workers=2)
+    monkeypatch.setattr(archive, "COMPRESS_WORKERS", 2)
+    monkeypatch.setattr(archive, "COMPRESS_MAX_MEMBER_SIZE", 100)
+    monkeypatch.setattr(archive, "READ_CHUNK_SIZE", 1000)
+    monkeypatch.setattr(archive, "_get_compress_pool", lambda: pool)
+    contents = {"a.txt": b"a" * 10, "big.txt": b"b" * 5000, "c.txt": b"c" * 20}
+    for name, data in contents.items():
+        storage.put_object(name, data)
+    # All recorded as small, e.g. from client-declared sizes
+    entries = [ArchiveEntry(name, name, None, 10, MTIME) for name in contents]
+
+    out = b"".join(stream_zip(entries))
+    pool.shutdown()
+
+    with zipfile.ZipFile(io.BytesIO(out)) as zf:
+        assert zf.namelist() == list(contents)
+        assert {name: zf.read(name) for name in contents} == contents
+    assert sorted(submitted) == [10, 20]
+
+def test_cached_archive_build_fails_on_missing_members(session, storage, monkeypatch):
+    import database
+    from models import ArchiveJob
+    from services.archive import ArchiveEntry
+    from services.archive_jobs import _run_job, archive_key
+    monkeypatch.setattr(database, "engine", session.get_bind())
+    storage.put_object("present.txt", b"here")
+    entries = [ArchiveEntry(f"f/{name}", name, None, 4, MTIME) for name in ("present.txt", "gone.txt")]
+
+    for job_id, fingerprint, members in (("complete", "a" * 64, entries[:1]), ("incomplete", "b" * 64, entries)):
+        session.add(ArchiveJob(id=job_id, folder_id=1, user_id=1, fingerprint=fingerprint, oss_key=archive_key(fingerprint)))
+        session.commit()
+        _run_job(job_id, archive_key(fingerprint), fingerprint, members)
+
+    session.expire_all()
+    assert session.get(ArchiveJob, "complete").status == "ready"
+    assert storage.object_exists(archive_key("a" * 64))
+    failed = session.get(ArchiveJob, "incomplete")
+    assert failed.status == "failed" and "f/gone.txt" in failed.error
+    assert not storage.object_exists(archive_key("b" * 64))
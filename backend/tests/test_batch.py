@@ -0,0 +1,203 @@
+import pytest
+from sqlmodel import select
+
+from models import (ArchiveJob, Blob, Collaborator, CollaboratorRole, Department, Document, Folder,
+                    Project, ProjectMember, ProjectRole, Role, User)
+from services.batch import (BatchError, copy_items, delete_folder_trees, delete_items, move_items,
+                            subtree_query)
+from services.blob import BlobService
+from services.permission import PermissionService
+
+@pytest.fixture
+def tree(session, storage, admin):
+    """
+    public/                 (space root)
+      A/  a.txt
+        B/  b.txt
+      T/                    (target)
+    """
+    root = Folder(name="public", space_type="public", owner_id=admin.id)
+    session.add(root)
+    session.commit()
+    a = Folder(name="A", space_type="public", parent_id=root.id, owner_id=admin.id)
+    t = Folder(name="T", space_type="public", parent_id=root.id, owner_id=admin.id)
+    session.add_all([a, t])
+    session.commit()
+    b = Folder(name="B", space_type="public", parent_id=a.id, owner_id=admin.id)
+    session.add(b)
+    session.commit()
+    docs = {}
+    for name, folder in (("a.txt", a), ("b.txt", b)):
+        storage.put_object(name, b"data")
+        doc = Document(name=name, oss_key=name, file_type="txt", size=4, folder_id=folder.id, author_id=admin.id)
+        session.add(doc)
+        BlobService(session).acquire(name, "h-" + name, 4)
+        session.commit()
+        docs[name] = doc.id
+    return {"root": root.id, "A": a.id, "B": b.id, "T": t.id, **docs}
+
+def ref_count(session, key):
+    return session.exec(select(Blob.ref_count).where(Blob.oss_key == key)).one()
+
+def test_copy_shares_objects_and_takes_references(session, admin, tree):
+    results = copy_items(session, admin, tree["T"], [tree["A"]], [tree["a.txt"]])
+
+    assert [r.status_code for r in results] == [200, 200]
+    copy_root = session.get(Folder, results[0].new_id)
+    assert (copy_root.name, copy_root.parent_id) == ("A", tree["T"])
+    copied_doc = session.get(Document, results[1].new_id)
+    assert (copied_doc.folder_id, copied_doc.oss_key) == (tree["T"], "a.txt")
+
+    # a.txt: original + folder copy + document copy; b.txt: original + folder copy
+    assert ref_count(session, "a.txt") == 3
+    assert ref_count(session, "b.txt") == 2
+    nested = session.exec(select(Folder).where(Folder.parent_id == copy_root.id)).one()
+    assert nested.name == "B"
+    assert session.exec(select(Document.oss_key).where(Document.folder_id == nested.id)).all() == ["b.txt"]
+
+def test_copy_renames_on_clash(session, admin, tree):
+    copy_items(session, admin, tree["T"], [tree["A"]], [])
+    results = copy_items(session, admin, tree["T"], [tree["A"]], [])
+
+    assert session.get(Folder, results[0].new_id).name == "A (1)"
+
+def test_move_rejects_cycles_and_system_folders(session, admin, tree):
+    results = move_items(session, admin, tree["B"], [tree["A"], tree["root"]], [])
+
+    assert [r.status_code for r in results] == [400, 400]
+    assert session.get(Folder, tree["A"]).parent_id == tree["root"]
+
+def test_move_reports_each_item(session, admin, tree):
+    results = move_items(session, admin, tree["T"], [tree["B"], 9999], [tree["a.txt"]])
+
+    assert [r.status_code for r in results] == [200, 404, 200]
+    session.expire_all()
+    assert session.get(Folder, tree["B"]).parent_id == tree["T"]
+    assert session.get(Document, tree["a.txt"]).folder_id == tree["T"]
+    # Moves never touch references
+    assert ref_count(session, "a.txt") == 1
+
+def test_unwritable_target_fails_the_whole_batch(session, editor, tree):
+    with pytest.raises(BatchError) as exc:
+        copy_items(session, editor, 9999, [tree["A"]], [])
+    assert exc.value.status_code == 404
+
+def test_delete_folder_trees_trashes_documents_and_removes_the_subtree(session, admin, editor, storage, tree):
+    project_root = Folder(name="P", space_type="project", parent_id=tree["B"], owner_id=admin.id)
+    session.add(project_root)
+    session.commit()
+    project = Project(name="P", root_folder_id=project_root.id)
+    session.add(project)
+    session.commit()
+    session.add_all([
+        ProjectMember(project_id=project.id, user_id=editor.id, role=ProjectRole.EDITOR),
+        Collaborator(user_id=editor.id, folder_id=tree["B"], role=CollaboratorRole.VIEWER),
+        ArchiveJob(id="job", folder_id=tree["A"], user_id=admin.id, fingerprint="f"),
+    ])
+    session.commit()
+    project_id = project.id
+
+    assert delete_folder_trees(session, admin, [tree["A"]]) == 3
+    session.commit()
+    session.expire_all()
+
+    remaining = set(session.exec(select(Folder.id)).all())
+    assert remaining == {tree["root"], tree["T"]}
+    for name, folder in (("a.txt", "A"), ("b.txt", "B")):
+        doc = session.get(Document, tree[name])
+        assert doc.is_deleted and doc.deleted_by == admin.id
+        assert (doc.folder_id, doc.deleted_from) == (None, folder)
+        # Released by the trash sweeper on purge, not here
+        assert ref_count(session, name) == 1
+        assert storage.object_exists(name)
+    assert session.get(Project, project_id) is None
+    assert session.exec(select(ProjectMember)).all() == []
+    assert session.exec(select(Collaborator)).all() == []
+    assert session.exec(select(ArchiveJob)).all() == []
+
+def test_documents_of_a_deleted_folder_need_a_new_folder_to_restore(session, admin, client_as, tree):
+    client = client_as(admin)
+    assert client.delete(f"/documents/{tree['b.txt']}").status_code == 200
+    assert client.delete(f"/folders/{tree['A']}").status_code == 200
+    session.expire_all()
+    # Already-trashed documents in the subtree are detached too
+    assert session.get(Document, tree["b.txt"]).folder_id is None
+
+    # A new folder may get the deleted folder's id back
+    reused = Folder(id=tree["B"], name="Other", space_type="public", parent_id=tree["root"], owner_id=admin.id)
+    session.add(reused)
+    session.commit()
+
+    listing = {item["id"]: item for item in client.get("/trash").json()["items"]}
+    assert listing[tree["b.txt"]]["folder_name"] == "B"
+    assert client.post(f"/trash/{tree['b.txt']}/restore").status_code == 409
+    restored = client.post(f"/trash/{tree['b.txt']}/restore", params={"folder_id": tree["T"]})
+    assert restored.status_code == 200
+    session.expire_all()
+    doc = session.get(Document, tree["b.txt"])
+    assert (doc.folder_id, doc.is_deleted, doc.deleted_from) == (tree["T"], False, None)
+
+def test_delete_items_applies_safe_deletion(session, admin, editor, tree):
+    results = delete_items(session, editor, [tree["A"]], [tree["a.txt"]])
+
+    assert [r.status_code for r in results] == [403, 403]
+    session.expire_all()
+    assert session.get(Folder, tree["A"]) is not None
+    assert not session.get(Document, tree["a.txt"]).is_deleted
+
+def test_delete_items_keeps_system_folders(session, admin, tree):
+    results = delete_items(session, admin, [tree["root"], tree["B"]], [])
+
+    assert [r.status_code for r in results] == [400, 200]
+    session.expire_all()
+    assert session.get(Folder, tree["root"]) is not None
+    assert session.get(Folder, tree["B"]) is None
+    assert session.get(Document, tree["b.txt"]).is_deleted
+
+@pytest.fixture
+def restricted_target(session, admin):
+    """
+    A restricted department folder, and a VIEWER of that department.
+    """
+    dept = Department(name="R&D")
+    session.add(dept)
+    session.commit()
+    root = Folder(name="R&D", space_type="department", department_id=dept.id, owner_id=admin.id)
+    session.add(root)
+    session.commit()
+    target = Folder(name="Confidential", space_type="department", department_id=dept.id,
+                    parent_id=root.id, owner_id=admin.id, is_restricted=True)
+    viewer = User(username="viewer", hashed_password="x", role=Role.VIEWER, department_id=dept.id)
+    session.add_all([target, viewer])
+    session.commit()
+    return target, viewer
+
+def readable_by(session, user, doc_ids):
+    session.expire_all()
+    perm = PermissionService(session)
+    return {doc_id for doc_id in doc_ids if perm.check_permission(user, session.get(Document, doc_id), 'read')}
+
+def test_move_into_restricted_folder_restricts_documents(session, admin, tree, restricted_target):
+    target, viewer = restricted_target
+    results = move_items(session, admin, target.id, [tree["A"]], [])
+    assert [r.status_code for r in results] == [200]
+    loose = copy_items(session, admin, tree["T"], [], [tree["a.txt"]])[0].new_id
+    move_items(session, admin, target.id, [], [loose])
+
+    moved = [tree["a.txt"], tree["b.txt"], loose]
+    assert all(session.get(Document, doc_id).is_restricted for doc_id in moved)
+    assert readable_by(session, viewer, moved) == set()
+
+def test_copy_into_restricted_folder_restricts_documents(session, admin, tree, restricted_target):
+    target, viewer = restricted_target
+    results = copy_items(session, admin, target.id, [tree["A"]], [tree["a.txt"]])
+    new_root = results[0].new_id
+
+    copied = set(session.exec(select(Document.id).where(
+        Document.folder_id.in_(subtree_query([new_root])) | (Document.id == results[1].new_id)
+    )).all())
+    assert len(copied) == 3
+    assert all(session.get(Document, doc_id).is_restricted for doc_id in copied)
+    assert readable_by(session, viewer, copied) == set()
+    # The originals keep their flags
+    assert not session.get(Document, tree["a.txt"]).is_restricted
@@ -0,0 +1,144 @@
+from sqlmodel import select
+
+from models import Blob, Department, Document, Folder
+from services.blob import BlobService
+from services.preview import rendition_key
+
+def put(storage, key, data=b"data"):
+    storage.put_object(key, data)
+    return key
+
+def add_document(session, key, folder_id=None, author_id=None, **fields):
+    doc = Document(name=key, oss_key=key, file_type="txt", size=4,
+                   folder_id=folder_id, author_id=author_id, **fields)
+    session.add(doc)
+    session.commit()
+    return doc
+
+def ref_count(session, key):
+    blob = session.exec(select(Blob).where(Blob.oss_key == key).execution_options(populate_existing=True)).first()
+    return blob.ref_count if blob else None
+
+def test_release_keeps_object_with_references_left(session, storage):
+    key = put(storage, "a.txt")
+    blobs = BlobService(session)
+    blobs.acquire(key, "h", 4)
+    blobs.acquire(key, "h", 4)
+    session.commit()
+
+    assert blobs.release(key) is False
+    assert ref_count(session, key) == 1
+    assert storage.object_exists(key)
+
+    assert blobs.release(key) is True
+    assert ref_count(session, key) is None
+    assert not storage.object_exists(key)
+
+def test_release_keeps_object_still_used_by_a_document(session, storage):
+    # A copy made before the blob was registered shares the key without a reference
+    key = put(storage, "shared.txt")
+    add_document(session, key)
+    blobs = BlobService(session)
+    blobs.acquire(key, "h", 4)
+    session.commit()
+
+    assert blobs.release(key) is False
+    assert storage.object_exists(key)
+
+def test_release_unregistered_object_only_without_documents(session, storage):
+    kept = put(storage, "legacy.txt")
+    add_document(session, kept)
+    gone = put(storage, "legacy-orphan.txt")
+    blobs = BlobService(session)
+
+    assert blobs.release(kept) is False
+    assert storage.object_exists(kept)
+    assert blobs.release(gone) is True
+    assert not storage.object_exists(gone)
+
+def test_release_many_counts_repeated_keys(session, storage):
+    key = put(storage, "k.txt")
+    other = put(storage, "other.txt")
+    blobs = BlobService(session)
+    for _ in range(3):
+        blobs.acquire(key, "h1", 4)
+    blobs.acquire(other, "h2", 4)
+    session.commit()
+
+    assert blobs.release_many([key, key, other]) == (3, 1)
+    assert ref_count(session, key) == 1
+    assert storage.object_exists(key)
+    assert not storage.object_exists(other)
+
+def test_release_many_keeps_objects_referenced_by_documents(session, storage):
+    key = put(storage, "doc.txt")
+    add_document(session, key)
+    blobs = BlobService(session)
+    blobs.acquire(key, "h", 4)
+    session.commit()
+
+    assert blobs.release_many([key]) == (1, 0)
+    assert storage.object_exists(key)
+
+def test_release_many_removes_renditions_with_the_object(session, storage):
+    key = put(storage, "sheet.xlsx")
+    preview = put(storage, rendition_key(key, ".html"))
+    blobs = BlobService(session)
+    blobs.acquire(key, "h", 4)
+    session.commit()
+
+    assert blobs.release_many([key]) == (1, 1)
+    assert not storage.object_exists(key)
+    assert not storage.object_exists(preview)
+
+def test_find_reusable_requires_size_match(session, storage):
+    blobs = BlobService(session)
+    blobs.acquire(put(storage, "x.txt"), "ABC", 4)
+    session.commit()
+
+    assert blobs.find_reusable("abc", 4).oss_key == "x.txt"
+    assert blobs.find_reusable("abc", 5) is None
+
+def test_find_reusable_for_user_only_matches_readable_content(session, storage, admin, editor):
+    dept = Department(name="R&D")
+    session.add(dept)
+    session.commit()
+    root = Folder(name="dept", space_type="department", department_id=dept.id, owner_id=admin.id)
+    session.add(root)
+    session.commit()
+    private = Folder(name="private", space_type="department", department_id=dept.id,
+                     parent_id=root.id, owner_id=admin.id, is_restricted=True)
+    public = Folder(name="public", space_type="public", owner_id=admin.id)
+    session.add_all([private, public])
+    session.commit()
+
+    secret = put(storage, "secret.txt")
+    add_document(session, secret, folder_id=private.id, author_id=admin.id, is_restricted=True)
+    blobs = BlobService(session)
+    blobs.acquire(secret, "s", 4)
+    session.commit()
+
+    assert blobs.find_reusable("s", 4, editor) is None
+    assert blobs.find_reusable_many([("s", 4)], editor) == {}
+    assert blobs.find_reusable("s", 4, admin).oss_key == secret
+
+    # Once a copy is readable by the editor, the content may be linked again
+    add_document(session, secret, folder_id=public.id, author_id=admin.id)
+    assert blobs.find_reusable("s", 4, editor).oss_key == secret
+
+def test_verify_and_register_records_the_stored_size(session, storage, monkeypatch):
+    import database
+    from services.blob import verify_and_register
+    monkeypatch.setattr(database, "engine", session.get_bind())
+
+    # The client declared 4 bytes and a bogus hash; the object holds 10
+    key = put(storage, "direct.bin", b"0123456789")
+    doc = add_document(session, key, content_hash="bogus")
+    verify_and_register(doc.id)
+
+    session.expire_all()
+    doc = session.get(Document, doc.id)
+    blob = session.exec(select(Blob).where(Blob.oss_key == key)).one()
+    assert doc.size == blob.size == 10
+    assert doc.content_hash == blob.content_hash != "bogus"
+    assert BlobService(session).find_reusable(blob.content_hash, 4) is None
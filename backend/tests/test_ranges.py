@@ -0,0 +1,91 @@
+import pytest
+
+from services.ranges import (MAX_RANGES, RangeNotSatisfiable, iter_ranged_body, parse_range_header,
+                             range_headers)
+
+SIZE = 1000
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 100)]),
+    ("bytes=900-", [(900, 1000)]),
+    ("bytes=-100", [(900, 1000)]),
+    ("bytes=-5000", [(0, 1000)]),             # suffix longer than the file
+    ("bytes=990-5000", [(990, 1000)]),        # end clamped to the size
+    ("BYTES = 0-0", [(0, 1)]),
+    ("bytes=500-599, 0-99", [(0, 100), (500, 600)]),
+    ("bytes=0-99,50-149", [(0, 150)]),        # overlapping -> coalesced
+    ("bytes=0-99,100-199", [(0, 200)]),       # adjacent -> coalesced
+    ("bytes=0-99,-100", [(0, 100), (900, 1000)]),
+    ("bytes=0-99,2000-3000", [(0, 100)]),     # unsatisfiable parts are dropped
+])
+def test_parse_satisfiable(header, expected):
+    assert parse_range_header(header, SIZE) == expected
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-10",
+    "bytes=",
+    "bytes=abc-def",
+    "bytes=10",
+    "bytes=100-50",                            # last < first: syntactically invalid
+    "bytes=-1-5",
+    "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES + 1)),
+])
+def test_parse_ignored(header):
+    assert parse_range_header(header, SIZE) is None
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", SIZE),
+    ("bytes=1000-2000,5000-", SIZE),
+    ("bytes=-0", SIZE),
+    ("bytes=0-", 0),
+    ("bytes=-10", 0),
+])
+def test_parse_unsatisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, size)
+
+def read_range(data):
+    def read(start, end):
+        for i in range(start, end, 64):
+            yield data[i:min(i + 64, end)]
+    return read
+
+def test_single_range_body_and_headers():
+    data = bytes(range(256)) * 4
+    ranges = parse_range_header("bytes=10-19", len(data))
+    status, headers, layout = range_headers(ranges, len(data), "application/pdf")
+    body = b"".join(iter_ranged_body(ranges, len(data), layout, read_range(data)))
+
+    assert status == 206
+    assert headers["content-range"] == f"bytes 10-19/{len(data)}"
+    assert body == data[10:20]
+    assert int(headers["content-length"]) == len(body)
+
+def test_full_body_without_ranges():
+    data = b"x" * 300
+    status, headers, layout = range_headers(None, len(data), "text/plain")
+    body = b"".join(iter_ranged_body(None, len(data), layout, read_range(data)))
+
+    assert status == 200
+    assert body == data
+    assert int(headers["content-length"]) == len(data)
+
+def test_multipart_body_matches_declared_length():
+    data = bytes(range(256)) * 4
+    ranges = parse_range_header("bytes=0-9,500-599,-20", len(data))
+    status, headers, layout = range_headers(ranges, len(data), "application/pdf")
+    body = b"".join(iter_ranged_body(ranges, len(data), layout, read_range(data)))
+
+    assert status == 206
+    boundary = headers["content-type"].split("boundary=")[1]
+    assert int(headers["content-length"]) == len(body)
+    assert body.endswith(f"--{boundary}--\r\n".encode())
+
+    parts = body.split(f"--{boundary}".encode())[1:-1]
+    assert len(parts) == 3
+    for part, (start, end) in zip(parts, ranges):
+        head, _, payload = part.partition(b"\r\n\r\n")
+        assert f"Content-Range: bytes {start}-{end - 1}/{len(data)}".encode() in head
+        assert payload == data[start:end] + b"\r\n"
@@ -0,0 +1,99 @@
+from models import ArchiveJob, Blob, Document
+from services.archive_jobs import archive_key
+from services.preview import PREVIEW_PREFIX, rendition_key
+from services.reconcile import reconcile
+
+DAY = 24 * 3600
+
+def put(storage, key, age=0):
+    storage.put_object(key, b"0123456789")
+    if age:
+        data, mtime, content_type = storage._objects[key]
+        storage._objects[key] = (data, mtime - age, content_type)
+    return key
+
+def add_document(session, key, **fields):
+    fields.setdefault("file_type", "txt")
+    session.add(Document(name=key, oss_key=key, size=10, **fields))
+    session.commit()
+
+def run(session, **kwargs):
+    return reconcile(session, delete=True, log=lambda *_: None, **kwargs)
+
+def test_never_deletes_referenced_objects(session, storage):
+    live = put(storage, "2024/01/live.docx", age=30 * DAY)
+    trashed = put(storage, "2024/01/trashed.txt", age=30 * DAY)
+    blob_only = put(storage, "2024/01/blob-only.txt", age=30 * DAY)
+    add_document(session, live, file_type="docx")
+    add_document(session, trashed, is_deleted=True)
+    session.add(Blob(oss_key=blob_only, content_hash="h", size=10, ref_count=1))
+    session.commit()
+
+    report = run(session)
+
+    assert report.deleted == 0
+    assert report.orphans == 0
+    assert report.referenced == 3
+    for key in (live, trashed, blob_only):
+        assert storage.object_exists(key)
+
+def test_keeps_previews_of_live_documents_and_known_archives(session, storage):
+    live = put(storage, "2024/01/sheet.xlsx", age=30 * DAY)
+    add_document(session, live, file_type="xlsx")
+    preview = put(storage, rendition_key(live, ".html"), age=30 * DAY)
+    job_archive = put(storage, archive_key("f" * 64), age=30 * DAY)
+    session.add(ArchiveJob(id="job", folder_id=1, user_id=1, fingerprint="f" * 64, oss_key=job_archive))
+    session.commit()
+
+    report = run(session)
+
+    assert report.deleted == 0
+    assert storage.object_exists(preview)
+    assert storage.object_exists(job_archive)
+
+def test_deletes_old_orphans_only(session, storage):
+    old = put(storage, "2024/01/old-orphan.txt", age=30 * DAY)
+    fresh = put(storage, "2024/01/in-flight-upload.txt", age=60)
+    stale_preview = put(storage, rendition_key("2024/01/gone.docx", ".html"), age=30 * DAY)
+    old_version = put(storage, f"{PREVIEW_PREFIX}v0/2024/01/x.docx.html", age=30 * DAY)
+    stale_archive = put(storage, archive_key("0" * 64), age=30 * DAY)
+
+    report = run(session)
+
+    assert report.orphans == 5
+    assert report.too_new == 1
+    assert report.deleted == 4
+    assert storage.object_exists(fresh)
+    for key in (old, stale_preview, old_version, stale_archive):
+        assert not storage.object_exists(key)
+
+def test_dry_run_and_missing_objects(session, storage):
+    orphan = put(storage, "2024/01/orphan.txt", age=30 * DAY)
+    add_document(session, "2024/01/missing.txt")
+
+    report = reconcile(session, delete=False, log=lambda *_: None)
+
+    assert report.orphans == 1
+    assert report.deleted == 0
+    assert storage.object_exists(orphan)
+    assert report.missing == 1
+    assert report.missing_samples == ["2024/01/missing.txt"]
+
+def test_prefix_limits_the_scan(session, storage):
+    inside = put(storage, "2024/01/orphan.txt", age=30 * DAY)
+    outside = put(storage, "2023/12/orphan.txt", age=30 * DAY)
+    add_document(session, "2023/12/missing.txt")
+
+    report = run(session, prefix="2024/")
+
+    assert report.scanned == 1
+    assert report.missing == 0
+    assert not storage.object_exists(inside)
+    assert storage.object_exists(outside)
+
+def test_grace_period_is_configurable(session, storage):
+    key = put(storage, "2024/01/recent.txt", age=120)
+
+    assert run(session).deleted == 0
+    assert run(session, grace_seconds=60).deleted == 1
+    assert not storage.object_exists(key)
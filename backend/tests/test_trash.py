@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import select
+
+from models import (Blob, Collaborator, CollaboratorRole, Department, Document, DocumentArchive, Folder,
+                    Role, User)
+from services.blob import BlobService
+from services.trash import TRASH_RETENTION_DAYS, purge_documents, sweep_expired
+
+NOW = datetime(2024, 6, 1, 12, 0)
+EXPIRED = NOW - timedelta(days=TRASH_RETENTION_DAYS + 1)
+RECENT = NOW - timedelta(days=1)
+
+def add_document(session, storage, key, deleted_at=None, is_deleted=None, register=True):
+    storage.put_object(key, b"data")
+    doc = Document(
+        name=key, oss_key=key, file_type="txt", size=4,
+        is_deleted=deleted_at is not None if is_deleted is None else is_deleted,
+        deleted_at=deleted_at,
+    )
+    session.add(doc)
+    if register:
+        BlobService(session).acquire(key, "h-" + key, 4)
+    session.commit()
+    return doc.id
+
+def live_ids(session):
+    return set(session.exec(select(Document.id)).all())
+
+def archived_ids(session):
+    return set(session.exec(select(DocumentArchive.id)).all())
+
+def test_sweep_archives_only_expired_trash(session, storage):
+    expired = add_document(session, storage, "expired.txt", deleted_at=EXPIRED)
+    recent = add_document(session, storage, "recent.txt", deleted_at=RECENT)
+    live = add_document(session, storage, "live.txt")
+
+    assert sweep_expired(session, now=NOW) == 1
+
+    assert live_ids(session) == {recent, live}
+    assert archived_ids(session) == {expired}
+    assert not storage.object_exists("expired.txt")
+    assert storage.object_exists("recent.txt")
+    assert storage.object_exists("live.txt")
+
+def test_sweep_falls_back_to_updated_at_for_old_rows(session, storage):
+    doc_id = add_document(session, storage, "legacy.txt", is_deleted=True)
+    doc = session.get(Document, doc_id)
+    doc.updated_at = EXPIRED
+    session.add(doc)
+    session.commit()
+
+    assert sweep_expired(session, now=NOW) == 1
+    assert archived_ids(session) == {doc_id}
+
+def test_purge_keeps_objects_shared_with_live_documents(session, storage):
+    trashed = add_document(session, storage, "shared.txt", deleted_at=EXPIRED)
+    # A live copy pointing at the same object holds its own reference
+    add_document(session, storage, "shared.txt")
+
+    assert purge_documents(session, [trashed]) == 1
+    assert storage.object_exists("shared.txt")
+    blob = session.exec(select(Blob).where(Blob.oss_key == "shared.txt")).one()
+    assert blob.ref_count == 1
+
+def test_purge_keeps_unregistered_objects_shared_with_live_documents(session, storage):
+    trashed = add_document(session, storage, "legacy-shared.txt", deleted_at=EXPIRED, register=False)
+    add_document(session, storage, "legacy-shared.txt", register=False)
+
+    assert purge_documents(session, [trashed]) == 1
+    assert storage.object_exists("legacy-shared.txt")
+
+def test_purge_ignores_documents_not_in_the_trash(session, storage):
+    live = add_document(session, storage, "live.txt")
+
+    assert purge_documents(session, [live, 12345]) == 0
+    assert live_ids(session) == {live}
+    assert archived_ids(session) == set()
+    assert storage.object_exists("live.txt")
+
+def test_purge_removes_collaborators_and_keeps_the_audit_row(session, storage, editor):
+    doc_id = add_document(session, storage, "shared-with.txt", deleted_at=EXPIRED)
+    session.add(Collaborator(user_id=editor.id, document_id=doc_id, role=CollaboratorRole.VIEWER))
+    session.commit()
+
+    assert purge_documents(session, [doc_id]) == 1
+    assert session.exec(select(Collaborator)).all() == []
+    row = session.get(DocumentArchive, doc_id)
+    assert row.oss_key == "shared-with.txt"
+    assert row.deleted_at == EXPIRED
+
+def test_trash_is_scoped_by_folder_permission(session, storage, client_as, admin):
+    dept_a, dept_b = Department(name="A"), Department(name="B")
+    session.add_all([dept_a, dept_b])
+    session.commit()
+    manager_b = User(username="manager-b", hashed_password="x", role=Role.MANAGER, department_id=dept_b.id)
+    session.add(manager_b)
+    session.commit()
+    folders = {}
+    for dept in (dept_a, dept_b):
+        root = Folder(name=f"{dept.name} root", space_type="department", department_id=dept.id, owner_id=admin.id)
+        session.add(root)
+        session.commit()
+        folder = Folder(name=f"{dept.name} docs", space_type="department", department_id=dept.id,
+                        parent_id=root.id, owner_id=admin.id)
+        session.add(folder)
+        session.commit()
+        folders[dept.name] = folder.id
+    docs = {}
+    for name in ("A", "B"):
+        doc = Document(name=f"{name}.txt", oss_key=f"{name}.txt", file_type="txt", size=4,
+                       folder_id=folders[name], author_id=admin.id,
+                       is_deleted=True, deleted_at=RECENT, deleted_by=admin.id)
+        session.add(doc)
+        session.commit()
+        docs[name] = doc.id
+
+    client = client_as(manager_b)
+    listing = client.get("/trash").json()
+    assert [item["id"] for item in listing["items"]] == [docs["B"]]
+    assert listing["total"] == 1
+    assert client.delete(f"/trash/{docs['A']}").status_code == 404
+    assert client.post(f"/trash/{docs['A']}/restore").status_code == 404
+    assert session.get(Document, docs["A"]) is not None
+
+    assert client.delete(f"/trash/{docs['B']}").status_code == 200
+    assert archived_ids(session) == {docs["B"]}
+
+    everything = client_as(admin).get("/trash").json()
+    assert [item["id"] for item in everything["items"]] == [docs["A"]]
@@ -322,7 +322,7 @@ export function PermissionDialog({
                 setSearchResults([]);
                 return;
             }
-            const { data } = await api.get<UserResult[]>(`/users?q=${encodeURIComponent(searchQuery)}`);
+            const { data } = await api.get<UserResult[]>(`/users?q=${encodeURIComponent(searchQuery)}&limit=50`);
             if (data) setSearchResults(data);
         };
         const debounce = setTimeout(searchUsers, 300);
@@ -51,7 +51,8 @@ interface ShareHistoryItem {
     resource_name: string;
     target_user_name: string;
     role: string;
-    shared_at: string;
+    share_id: number;
+    shared_at: string | null;
 }
 
 export function UserDetailDialog({ open, onOpenChange, user }: UserDetailDialogProps) {
@@ -73,7 +74,7 @@ export function UserDetailDialog({ open, onOpenChange, user }: UserDetailDialogP
         setLoading(true);
         try {
             // Fetch Permissions
-            const { data: permData, error: permError } = await api.get<PermissionItem[]>(`/users/${user.id}/permissions`);
+            const { data: permData, error: permError } = await api.getList<PermissionItem>(`/users/${user.id}/permissions`);
             if (!permError && permData) {
                 setPermissions(permData);
             }
@@ -317,7 +318,7 @@ export function UserDetailDialog({ open, onOpenChange, user }: UserDetailDialogP
                                             </div>
                                             <div className="text-right">
                                                 <Badge variant="secondary" className="mb-1 capitalize">{item.role}</Badge>
-                                                <p className="text-[10px] text-muted-foreground">{item.shared_at}</p>
+                                                <p className="text-[10px] text-muted-foreground">{item.shared_at ? new Date(item.shared_at).toLocaleString() : '-'}</p>
                                             </div>
                                         </div>
                                     ))}
@@ -94,6 +94,34 @@ const formatFileSize = (bytes: number) => {
   return (bytes / (1024 * 1024)).toFixed(1) + ' MB';
 };
 
+// Files above this size are not hashed in the browser (whole file would be read into memory)
+const MAX_HASH_SIZE = 256 * 1024 * 1024;
+// Server-side cap per batch request (/files/upload-token/batch, /files/upload-complete/batch)
+const UPLOAD_BATCH_SIZE = 500;
+
+interface UploadBatchItem {
+  filename: string;
+  folder_id: number;
+  upload_url: string;
+  oss_key?: string | null;
+  method?: string | null;
+  instant: boolean;
+  document_id?: number | null;
+  status_code: number;
+  error?: string | null;
+}
+
+// SHA-256 hex digest for instant upload. Returns undefined when WebCrypto is unavailable (non-HTTPS).
+const computeSha256 = async (file: File): Promise<string | undefined> => {
+  if (!window.crypto?.subtle || file.size > MAX_HASH_SIZE) return undefined;
+  try {
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+  } catch {
+    return undefined;
+  }
+};
+
 const getPermissionIcon = (type: string) => {
   switch (type) {
     case 'private': return Lock;
@@ -454,149 +482,160 @@ export function UploadDialog({ open, onOpenChange, currentPath, currentFolderId,
       }
     }
 
-    // Process files
-    for (const f of files) {
-      if (f.status === 'pending') {
-        // Determine target folder ID
-        let targetFolderId = currentFolderId;
-        if (f.file.webkitRelativePath) {
-          const parts = f.file.webkitRelativePath.split('/');
-          parts.pop();
-          const dirPath = parts.join('/');
-
-          if (dirPath) {
-            if (pathIdMap[dirPath]) {
-              targetFolderId = pathIdMap[dirPath];
-            } else {
-              setFiles(prev => prev.map(file =>
-                file.id === f.id ? { ...file, status: 'error', progress: 0, errorMessage: '父文件夹创建失败' } : file
-              ));
-              continue;
-            }
+    const setStatus = (id: string, patch: Partial<UploadFile>) =>
+      setFiles(prev => prev.map(file => file.id === id ? { ...file, ...patch } : file));
+
+    const fail = (id: string, message?: string | null) => {
+      let errorMsg = message || '网络或系统异常';
+      if (errorMsg.includes('409') || errorMsg.includes('already exists')) {
+        errorMsg = '文件已存在';
+      }
+      // Do not toast for every error if it is duplicate
+      if (errorMsg !== '文件已存在') toast.error(errorMsg);
+      setStatus(id, { status: 'error', errorMessage: errorMsg });
+    };
+
+    // Determine target folder ID per file
+    const targets: { f: UploadFile; folderId: string }[] = [];
+    for (const f of pendingFiles) {
+      let targetFolderId = currentFolderId;
+      if (f.file.webkitRelativePath) {
+        const parts = f.file.webkitRelativePath.split('/');
+        parts.pop();
+        const dirPath = parts.join('/');
+
+        if (dirPath) {
+          if (pathIdMap[dirPath]) {
+            targetFolderId = pathIdMap[dirPath];
+          } else {
+            setStatus(f.id, { status: 'error', progress: 0, errorMessage: '父文件夹创建失败' });
+            continue;
           }
         }
+      }
+      targets.push({ f, folderId: targetFolderId });
+    }
+    if (targets.length === 0) return;
+
+    targets.forEach(t => setStatus(t.f.id, { status: 'uploading', progress: 0 }));
 
-        // Initialize progress
+    // --- SIMULATED PROGRESS LOGIC ---
+    const startProgress = (f: UploadFile) => {
+      const assumedSpeed = 3 * 1024 * 1024; // 3MB/s
+      const calculatedDuration = f.file.size / assumedSpeed;
+      const durationSeconds = Math.max(1.5, Math.min(targets.length > 1 ? 2 : 10, calculatedDuration));
+      const incrementPerStep = 95 / (durationSeconds * 20);
+      const timer = setInterval(() => {
         setFiles(prev => prev.map(file =>
-          file.id === f.id ? { ...file, status: 'uploading', progress: 0 } : file
+          file.id === f.id && file.status === 'uploading'
+            ? { ...file, progress: Math.min(95, file.progress + incrementPerStep) }
+            : file
         ));
+      }, 50);
+      return () => clearInterval(timer);
+    };
 
+    // STEP 1: Upload tokens for the whole drop, a few requests instead of one per file
+    // (content hashes let the server skip files it already has)
+    const hashes: (string | undefined)[] = [];
+    for (const t of targets) {
+      hashes.push(await computeSha256(t.f.file));
+    }
 
-        // --- SIMULATED PROGRESS LOGIC ---
-        const assumedSpeed = 3 * 1024 * 1024; // 3MB/s
-        const calculatedDuration = f.file.size / assumedSpeed;
-        const durationSeconds = Math.max(1.5, Math.min(files.length > 1 ? 2 : 10, calculatedDuration));
-        const totalSteps = durationSeconds * 20;
-        const incrementPerStep = 95 / totalSteps;
-
-        let visualProgress = 0;
-        let uploadComplete = false;
-        let apiComplete = false;
-        let isError = false;
-
-        // Start Animation Timer
-        const progressTimer = setInterval(() => {
-          setFiles(prev => prev.map(file => {
-            if (file.id !== f.id) return file;
-
-            if (uploadComplete && !isError) {
-              let next = file.progress + 5;
-              if (next >= 100) next = 100;
-              return { ...file, progress: next };
-            }
-
-            if (isError) return file;
-
-            let next = file.progress + incrementPerStep;
-            if (next > 95) next = 95;
-            visualProgress = next;
-
-            return { ...file, progress: next };
-          }));
-        }, 50);
+    const tokenItems: (UploadBatchItem | null)[] = [];
+    for (let i = 0; i < targets.length; i += UPLOAD_BATCH_SIZE) {
+      const chunk = targets.slice(i, i + UPLOAD_BATCH_SIZE);
+      const { data, error } = await api.post<{ items: UploadBatchItem[] }>('/files/upload-token/batch', {
+        files: chunk.map((t, j) => ({
+          filename: t.f.file.name,
+          file_size: t.f.file.size,
+          folder_id: parseInt(t.folderId),
+          content_type: t.f.file.type || 'application/octet-stream',
+          content_hash: hashes[i + j],
+          is_restricted: permission === 'private'
+        }))
+      });
+      if (error || !data) {
+        chunk.forEach(t => fail(t.f.id, error?.message || '获取上传凭证失败'));
+        tokenItems.push(...chunk.map(() => null));
+        continue;
+      }
+      tokenItems.push(...data.items);
+    }
 
-        try {
-          // STEP 1: Get Upload Token
-          const { data: tokenData, error: tokenError } = await api.post<{ upload_url: string; oss_key: string; method: string }>('/files/upload-token', {
-            filename: f.file.name,
-            file_size: f.file.size,
-            folder_id: parseInt(targetFolderId),
-            content_type: f.file.type || 'application/octet-stream'
-          });
+    // STEP 2: Direct Upload to OSS (or Local Proxy)
+    const completions: { id: string; stop: () => void; payload: object }[] = [];
+    let succeeded = 0;
+    for (let i = 0; i < targets.length; i++) {
+      const { f, folderId } = targets[i];
+      const tokenData = tokenItems[i];
+      if (!tokenData) continue;
+      if (tokenData.error) {
+        fail(f.id, tokenData.status_code === 409 ? 'already exists' : tokenData.error);
+        continue;
+      }
+      // Instant upload: server already has this content and created the record
+      if (tokenData.instant) {
+        setStatus(f.id, { status: 'complete', progress: 100 });
+        succeeded++;
+        continue;
+      }
 
-          if (tokenError || !tokenData) {
-            throw new Error(tokenError?.message || '获取上传凭证失败');
+      const stop = startProgress(f);
+      try {
+        const uploadResponse = await fetch(tokenData.upload_url, {
+          method: tokenData.method || 'PUT',
+          body: f.file,
+          headers: {
+            // Only set Content-Type if signed, usually required for PUT
+            'Content-Type': f.file.type || 'application/octet-stream'
           }
+        });
 
-          // STEP 2: Direct Upload to OSS (or Local Proxy)
-          const uploadResponse = await fetch(tokenData.upload_url, {
-            method: tokenData.method, // usually PUT
-            body: f.file,
-            headers: {
-              // Only set Content-Type if signed, usually required for PUT
-              'Content-Type': f.file.type || 'application/octet-stream'
-            }
-          });
-
-          if (!uploadResponse.ok) {
-            throw new Error(`Upload Failed: ${uploadResponse.statusText}`);
-          }
+        if (!uploadResponse.ok) {
+          throw new Error(`Upload Failed: ${uploadResponse.statusText}`);
+        }
 
-          // STEP 3: Complete Upload (Save Metadata)
-          const { error: completeError } = await api.post('/files/upload-complete', {
+        completions.push({
+          id: f.id,
+          stop,
+          payload: {
             oss_key: tokenData.oss_key,
             filename: f.file.name,
-            folder_id: parseInt(targetFolderId),
+            folder_id: parseInt(folderId),
             file_size: f.file.size,
-            is_restricted: permission === 'private'
-          });
-
-          if (completeError) {
-            throw new Error(completeError.message || '保存文件记录失败');
+            is_restricted: permission === 'private',
+            content_hash: hashes[i]
           }
+        });
+      } catch (e: any) {
+        console.error("Upload Error:", e);
+        stop();
+        fail(f.id, e.message);
+      }
+    }
 
-          // Success Logic
-          uploadComplete = true; // Signal timer to accelerate
-          await new Promise<void>(resolve => {
-            const checkDone = setInterval(() => {
-              setFiles(prev => {
-                const file = prev.find(p => p.id === f.id);
-                if (file && file.progress >= 100) {
-                  clearInterval(checkDone);
-                  resolve();
-                }
-                return prev;
-              });
-            }, 50);
-          });
-
-          clearInterval(progressTimer);
-          setFiles(prev => prev.map(file =>
-            file.id === f.id ? { ...file, status: 'complete', progress: 100 } : file
-          ));
-
-          if (onUploadSuccess) onUploadSuccess();
-
-        } catch (e: any) {
-          console.error("Upload Error:", e);
-          isError = true;
-          clearInterval(progressTimer);
-
-          let errorMsg = e.message || '网络或系统异常';
-          if (errorMsg.includes('409') || errorMsg.includes('already exists')) {
-            errorMsg = '文件已存在';
-          }
-
-          const isDuplicate = errorMsg === '文件已存在';
-          // Do not toast for every error if it is duplicate
-          if (!isDuplicate) toast.error(errorMsg);
-
-          setFiles(prev => prev.map(file =>
-            file.id === f.id ? { ...file, status: 'error', errorMessage: errorMsg } : file
-          ));
+    // STEP 3: Complete Upload (Save Metadata), one commit per batch
+    for (let i = 0; i < completions.length; i += UPLOAD_BATCH_SIZE) {
+      const chunk = completions.slice(i, i + UPLOAD_BATCH_SIZE);
+      const { data, error } = await api.post<{ items: UploadBatchItem[] }>('/files/upload-complete/batch', {
+        files: chunk.map(c => c.payload)
+      });
+      chunk.forEach((c, j) => {
+        c.stop();
+        const item = data?.items[j];
+        if (error || !item) {
+          fail(c.id, error?.message || '保存文件记录失败');
+        } else if (item.error) {
+          fail(c.id, item.status_code === 409 ? 'already exists' : item.error);
+        } else {
+          setStatus(c.id, { status: 'complete', progress: 100 });
+          succeeded++;
         }
-      }
+      });
     }
+
+    if (succeeded > 0 && onUploadSuccess) onUploadSuccess();
   };
 
   const handleClose = () => {
@@ -224,6 +224,12 @@ interface BreadcrumbItem {
 
 type ViewMode = 'grid' | 'list';
 
+interface BatchResponse {
+  results: { type: 'folder' | 'document'; id: number; status_code: number; error: string | null; new_id: number | null }[];
+  succeeded: number;
+  failed: number;
+}
+
 // NEW: Add props interface
 interface DocumentsProps {
   initialFolderId?: string;
@@ -1485,14 +1491,46 @@ export function Documents({ initialFolderId }: DocumentsProps) {
     setSelectedItems(new Set());
   };
 
-  const handleBatchDelete = () => {
-    toast.success(`已删除 ${selectedItems.size} 个项目`);
-    setSelectedItems(new Set());
+  // Selection ids are "<folderId>" or "doc-<documentId>"
+  const splitSelection = () => {
+    const folder_ids: number[] = [];
+    const document_ids: number[] = [];
+    selectedItems.forEach(id => {
+      if (id.startsWith('doc-')) document_ids.push(Number(id.slice(4)));
+      else if (/^\d+$/.test(id)) folder_ids.push(Number(id));
+    });
+    return { folder_ids, document_ids };
   };
 
-  const handleBatchMove = (targetPath: string) => {
-    toast.success(`已移动 ${selectedItems.size} 个项目`);
+  const reportBatch = (data: BatchResponse | null, error: unknown, verb: string) => {
+    if (error || !data) {
+      toast.error(`${verb}失败`);
+      console.error(error);
+      return;
+    }
+    if (data.failed === 0) {
+      toast.success(`已${verb} ${data.succeeded} 个项目`);
+    } else {
+      const firstError = data.results.find(r => r.error)?.error;
+      toast.warning(`已${verb} ${data.succeeded} 个项目，${data.failed} 个失败${firstError ? `：${firstError}` : ''}`);
+    }
     setSelectedItems(new Set());
+    setRefreshKey(prev => prev + 1);
+  };
+
+  const handleBatchDelete = async () => {
+    const { data, error } = await api.post<BatchResponse>('/batch/delete', splitSelection());
+    reportBatch(data, error, '删除');
+  };
+
+  const handleBatchMove = async (targetPath: string) => {
+    const targetFolderId = Number(targetPath);
+    if (!Number.isInteger(targetFolderId)) {
+      toast.error('请选择具体的目标文件夹');
+      return;
+    }
+    const { data, error } = await api.post<BatchResponse>('/batch/move', { ...splitSelection(), target_folder_id: targetFolderId });
+    reportBatch(data, error, '移动');
   };
 
   const handleOpenRename = (item: FolderItem) => {
@@ -1548,14 +1586,45 @@ export function Documents({ initialFolderId }: DocumentsProps) {
     return `${apiBase}/documents/${docId}/content?token=${token}`;
   };
 
+  // Server-side renditions: HTML for Word/Excel, downscaled image for photos
+  const PREVIEW_RENDITION_EXT = /\.(docx|xlsx|jpe?g|png|gif|webp|bmp)$/i;
+
   const handlePreviewFile = (item: FolderItem) => {
     if (item.type !== 'folder') {
-      const fileUrl = getFileUrl(item);
+      // inline: let the browser render video/PDF (with seeking) instead of downloading
+      const fileUrl = PREVIEW_RENDITION_EXT.test(item.name)
+        ? getFileUrl(item).replace('/content?', '/preview?')
+        : `${getFileUrl(item)}&inline=true`;
       window.open(fileUrl, '_blank', 'noopener,noreferrer');
       toast.info(`正在预览: ${item.name}`);
     }
   };
 
+  // Folder archives are built in the background (and cached server-side); poll until ready.
+  // Falls back to the streaming /zip endpoint if the job cannot be created or fails.
+  const downloadFolderArchive = async (item: FolderItem, streamUrl: string) => {
+    type ZipJob = { job_id: string; status: string; download_url?: string | null; error?: string | null };
+    const { data: job, error } = await api.post<ZipJob>(`/folders/${item.id}/zip-jobs`, {});
+    if (error || !job) {
+      window.open(streamUrl, '_self');
+      return;
+    }
+
+    let current: ZipJob = job;
+    const deadline = Date.now() + 30 * 60 * 1000;
+    while (current.status !== 'ready' && current.status !== 'failed' && Date.now() < deadline) {
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      const { data } = await api.get<ZipJob>(`/zip-jobs/${job.job_id}`);
+      if (data) current = data;
+    }
+
+    if (current.status === 'ready' && current.download_url) {
+      window.open(current.download_url, '_self');
+    } else {
+      window.open(streamUrl, '_self');
+    }
+  };
+
   const handleDownloadFile = (item: FolderItem) => {
     const isDev = window.location.port === '5173';
     const apiBase = isDev ? `http://${window.location.hostname}:8001` : '';
@@ -1563,9 +1632,8 @@ export function Documents({ initialFolderId }: DocumentsProps) {
 
     if (item.type === 'folder') {
       const zipUrl = `${apiBase}/folders/${item.id}/zip?token=${token}`;
-      // Use _blank to avoid navigating away if application/zip isn't handled by browser download manager immediately (though _self is usually fine for attachments)
       // _self is better for file downloads to avoid empty tabs.
-      window.open(zipUrl, '_self');
+      downloadFolderArchive(item, zipUrl);
       toast.success(`正在打包下载文件夹: ${item.name}，请稍候...`);
     } else {
       const fileUrl = getFileUrl(item);
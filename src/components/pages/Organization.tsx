@@ -1,5 +1,5 @@
-import { useState, useMemo, useEffect } from 'react';
-import { Search, Users, Plus, Edit2, Trash2, MoreHorizontal, Settings, Folder, ChevronRight, ChevronDown, CornerDownRight, ChevronsRight, RefreshCw, FolderTree, Filter, Check, X, Shield, Eye } from 'lucide-react';
+import { useState, useMemo, useEffect, useRef } from 'react';
+import { Search, Users, Plus, Edit2, Trash2, MoreHorizontal, Settings, Folder, ChevronRight, ChevronDown, CornerDownRight, ChevronsRight, RefreshCw, FolderTree, Filter, Check, X, Shield, Eye, Upload } from 'lucide-react';
 import { UserDetailDialog } from '@/components/dialogs/UserDetailDialog';
 import { Input } from '@/components/ui/input';
 import {
@@ -37,7 +37,7 @@ import { Button } from '@/components/ui/button';
 import { Label } from '@/components/ui/label';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Separator } from '@/components/ui/separator';
-import { useUsers, useDepartments, UserProfile } from '@/hooks/useDatabase';
+import { useUsers, useDepartments, UserProfile, DepartmentTreeNode } from '@/hooks/useDatabase';
 import { useAuth } from '@/hooks/useAuth';
 import { cn } from '@/lib/utils';
 import { api } from '@/lib/api';
@@ -61,6 +61,7 @@ export function Organization() {
   const [searchQuery, setSearchQuery] = useState('');
   const [selectedDepartmentId, setSelectedDepartmentId] = useState<number | null>(null);
   const [users, setUsers] = useState<UserProfile[]>([]);
+  const [memberCounts, setMemberCounts] = useState<Record<number, number>>({});
   const [departments, setDepartments] = useState<any[]>([]);
 
   // User 360 View State
@@ -74,7 +75,7 @@ export function Organization() {
     deleteUser,
     getUsers
   } = useUsers();
-  const { getDepartments, createDepartment, updateDepartment, deleteDepartment } = useDepartments();
+  const { getDepartments, getDepartmentTree, createDepartment, updateDepartment, deleteDepartment } = useDepartments();
 
   // ----- Member Dialog State -----
   const [isMemberDialogOpen, setIsMemberDialogOpen] = useState(false);
@@ -109,6 +110,18 @@ export function Organization() {
     const { data: deptsData } = await getDepartments();
     if (usersData) setUsers(usersData);
     if (deptsData) setDepartments(deptsData);
+
+    // Headcounts (including sub-departments) for the tree badges
+    const { data: treeData } = await getDepartmentTree();
+    if (treeData) {
+      const counts: Record<number, number> = {};
+      const walk = (nodes: DepartmentTreeNode[]) => nodes.forEach(n => {
+        counts[n.id] = n.total_member_count;
+        walk(n.children);
+      });
+      walk(treeData);
+      setMemberCounts(counts);
+    }
   };
 
   useEffect(() => {
@@ -225,6 +238,37 @@ export function Organization() {
     }
   };
 
+  // --- Bulk Import (CSV / XLSX) ---
+  const importInputRef = useRef<HTMLInputElement>(null);
+  const [isImporting, setIsImporting] = useState(false);
+
+  const handleImportFile = async (e: React.ChangeEvent<HTMLInputElement>) => {
+    const file = e.target.files?.[0];
+    e.target.value = '';
+    if (!file) return;
+    const formData = new FormData();
+    formData.append('file', file);
+    setIsImporting(true);
+    const { data, error } = await api.post<{
+      created: number;
+      failed: number;
+      results: { row: number; username: string | null; status: string; error: string | null }[];
+    }>('/users/import', formData, true);
+    setIsImporting(false);
+    if (error || !data) {
+      toast.error(`导入失败: ${error?.message || '未知错误'}`);
+      return;
+    }
+    if (data.failed > 0) {
+      const first = data.results.filter(r => r.status === 'error').slice(0, 3)
+        .map(r => `第 ${r.row} 行 ${r.username || ''}: ${r.error}`).join('\n');
+      toast.warning(`已导入 ${data.created} 人, ${data.failed} 行失败`, { description: first });
+    } else {
+      toast.success(`已导入 ${data.created} 人`);
+    }
+    fetchData();
+  };
+
   // --- Role Update Handler ---
   const handleRoleChange = async (userId: number, newRole: string) => {
     try {
@@ -390,6 +434,7 @@ export function Organization() {
                   key={dept.id}
                   dept={dept}
                   departments={departments}
+                  memberCounts={memberCounts}
                   selectedDepartmentId={selectedDepartmentId}
                   setSelectedDepartmentId={setSelectedDepartmentId}
                   isAdmin={isAdmin}
@@ -434,10 +479,23 @@ export function Organization() {
             </div>
 
             {isAdmin && (
-              <Button onClick={handleOpenAddMember} className="gap-2 shrink-0 h-9">
-                <Plus className="w-4 h-4" />
-                添加成员
-              </Button>
+              <>
+                <input ref={importInputRef} type="file" accept=".csv,.xlsx" className="hidden" onChange={handleImportFile} />
+                <Button
+                  variant="outline"
+                  onClick={() => importInputRef.current?.click()}
+                  disabled={isImporting}
+                  className="gap-2 shrink-0 h-9"
+                  title="CSV / XLSX: 用户名, 密码, 工号, 邮箱, 部门, 角色"
+                >
+                  <Upload className="w-4 h-4" />
+                  {isImporting ? '导入中...' : '批量导入'}
+                </Button>
+                <Button onClick={handleOpenAddMember} className="gap-2 shrink-0 h-9">
+                  <Plus className="w-4 h-4" />
+                  添加成员
+                </Button>
+              </>
             )}
           </div>
 
@@ -767,6 +825,7 @@ export function Organization() {
 function DeptTreeNode({
   dept,
   departments,
+  memberCounts,
   selectedDepartmentId,
   setSelectedDepartmentId,
   isAdmin,
@@ -776,6 +835,7 @@ function DeptTreeNode({
 }: {
   dept: any,
   departments: any[],
+  memberCounts: Record<number, number>,
   selectedDepartmentId: number | null,
   setSelectedDepartmentId: (id: number | null) => void,
   isAdmin: boolean,
@@ -808,6 +868,9 @@ function DeptTreeNode({
 
           <Folder className={cn("w-4 h-4 shrink-0", isSelected ? "fill-primary/20" : "fill-none text-muted-foreground")} />
           <span className="text-sm truncate font-medium">{dept.name}</span>
+          {memberCounts[dept.id] !== undefined && (
+            <span className="text-[10px] text-muted-foreground shrink-0">{memberCounts[dept.id]}</span>
+          )}
         </div>
 
         {/* Admin Actions */}
@@ -842,6 +905,7 @@ function DeptTreeNode({
               key={child.id}
               dept={child}
               departments={departments}
+              memberCounts={memberCounts}
               selectedDepartmentId={selectedDepartmentId}
               setSelectedDepartmentId={setSelectedDepartmentId}
               isAdmin={isAdmin}
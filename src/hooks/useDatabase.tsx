@@ -85,7 +85,7 @@ export function useFolders() {
       endpoint += `?${params.toString()}`;
     }
 
-    const { data, error } = await api.get<Folder[]>(endpoint);
+    const { data, error } = await api.getList<Folder>(endpoint);
     return { data, error };
   };
 
@@ -129,7 +129,7 @@ export function useDocuments() {
 
     if (params.toString()) endpoint += `?${params.toString()}`;
 
-    const { data, error } = await api.get<Document[]>(endpoint);
+    const { data, error } = await api.getList<Document>(endpoint);
     return { data, error };
   };
 
@@ -204,6 +204,14 @@ export function useDocuments() {
     return { data, error };
   };
 
+  const getDocumentUrls = async (ids: number[], download = false) => {
+    const { data, error } = await api.post<{ urls: Record<string, string>; denied: number[]; missing: number[] }>(
+      '/documents/urls',
+      { document_ids: ids, download }
+    );
+    return { data, error };
+  };
+
   const getDocument = async (id: number) => {
     const { data, error } = await api.get<Document>(`/documents/${id}`);
     return { data, error };
@@ -214,7 +222,44 @@ export function useDocuments() {
     return { data, error };
   };
 
-  return { getDocuments, getDocument, createDocument, deleteDocument, getDocumentUrl, getSharedResources };
+  return { getDocuments, getDocument, createDocument, deleteDocument, getDocumentUrl, getDocumentUrls, getSharedResources };
+}
+
+// Trash
+export interface TrashItem {
+  id: number;
+  name: string;
+  file_type: string;
+  size: number;
+  folder_id: number | null;
+  folder_name: string | null;
+  author_id: number | null;
+  deleted_at: string;
+  deleted_by: number | null;
+  deleted_by_name: string | null;
+  expires_at: string;
+}
+
+export function useTrash() {
+  const getTrash = async (skip = 0, limit = 100) => {
+    const { data, error } = await api.get<{ items: TrashItem[]; total: number; retention_days: number }>(
+      `/trash?skip=${skip}&limit=${limit}`
+    );
+    return { data, error };
+  };
+
+  const restoreDocument = async (id: number, folderId?: number) => {
+    const query = folderId !== undefined ? `?folder_id=${folderId}` : '';
+    const { data, error } = await api.post<Document>(`/trash/${id}/restore${query}`, {});
+    return { data, error };
+  };
+
+  const purgeDocument = async (id: number) => {
+    const { error } = await api.delete(`/trash/${id}`);
+    return { error };
+  };
+
+  return { getTrash, restoreDocument, purgeDocument };
 }
 
 // Project Operations
@@ -313,7 +358,7 @@ export interface UserProfile {
 export function useUsers() {
   const getUsers = async () => {
     // Increase limit to prevent truncation (default is 100)
-    const { data, error } = await api.get<UserProfile[]>('/users?limit=1000');
+    const { data, error } = await api.getList<UserProfile>('/users?limit=1000');
     return { data, error };
   };
 
@@ -347,6 +392,14 @@ export interface Department {
   root_folder_id?: number | null;
 }
 
+export interface DepartmentTreeNode extends Department {
+  member_count: number;
+  total_member_count: number;
+  document_count: number;
+  storage_bytes: number;
+  children: DepartmentTreeNode[];
+}
+
 // Department operations
 export function useDepartments() {
   const getDepartments = async (parentId?: number) => {
@@ -357,6 +410,12 @@ export function useDepartments() {
     return { data, error };
   };
 
+  // Nested hierarchy with member counts and root-folder storage, in one request
+  const getDepartmentTree = async () => {
+    const { data, error } = await api.get<DepartmentTreeNode[]>('/departments/tree');
+    return { data, error };
+  };
+
   const createDepartment = async (deptData: { name: string, parent_id?: number | null }) => {
     const { data, error } = await api.post<Department>('/departments', deptData);
     return { data, error };
@@ -372,7 +431,7 @@ export function useDepartments() {
     return { error };
   };
 
-  return { getDepartments, createDepartment, updateDepartment, deleteDepartment };
+  return { getDepartments, getDepartmentTree, createDepartment, updateDepartment, deleteDepartment };
 }
 
 export function useProfiles() {
@@ -57,8 +57,43 @@ async function request<T>(endpoint: string, options: RequestInit = {}): Promise<
 }
 
 
+// Compact list format (see backend services/columnar.py): one array per field,
+// repeated strings dictionary-encoded. Decoded back to plain row objects here.
+const COLUMNAR_MEDIA_TYPE = 'application/vnd.sdh.columnar+json';
+
+interface ColumnarPayload {
+    count: number;
+    columns: { name: string; values?: unknown[]; dictionary?: unknown[]; indices?: (number | null)[] }[];
+}
+
+function decodeColumnar<T>(payload: ColumnarPayload): T[] {
+    const rows: Record<string, unknown>[] = Array.from({ length: payload.count }, () => ({}));
+    for (const column of payload.columns) {
+        if (column.values) {
+            column.values.forEach((value, i) => { rows[i][column.name] = value; });
+        } else {
+            const dictionary = column.dictionary || [];
+            (column.indices || []).forEach((index, i) => {
+                rows[i][column.name] = index === null ? null : dictionary[index];
+            });
+        }
+    }
+    return rows as T[];
+}
+
+async function getList<T>(endpoint: string): Promise<ApiResponse<T[]>> {
+    const { data, error } = await request<ColumnarPayload>(endpoint, {
+        method: 'GET',
+        headers: { 'Accept': COLUMNAR_MEDIA_TYPE },
+    });
+    if (error || !data) return { data: null, error };
+    return { data: decodeColumnar<T>(data), error: null };
+}
+
 export const api = {
     get: <T>(endpoint: string) => request<T>(endpoint, { method: 'GET' }),
+    // For list endpoints that support the columnar format (folders, documents, users, permissions)
+    getList: <T>(endpoint: string) => getList<T>(endpoint),
     post: <T>(endpoint: string, body: any, isFormData: boolean = false) => request<T>(endpoint, {
         method: 'POST',
         body: isFormData ? body : JSON.stringify(body),